@@ -0,0 +1,209 @@
+"""Daily and weekly delivery rollups and the ranged analytics report.
+
+Triggers on ``deliveries`` add every completion to ``delivery_rollups``, one
+row per period, client and arrival hour (UTC, ``-1`` when unknown) with the
+number of deliveries, breads and stay totals. A report reads only rollup
+rows, so its cost depends on the range asked for, not on the history kept.
+
+Weeks start on Monday. :func:`rebuild_rollups` recomputes everything from
+the hot and archived deliveries, e.g. after importing history.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+if __package__ in (None, ""):
+    from archive import connect_history
+    from database import ROLLUP_PERIODS, fetch_all, fetch_one
+else:
+    from .archive import connect_history
+    from .database import ROLLUP_PERIODS, fetch_all, fetch_one
+
+ANALYTICS_DEFAULT_DAYS = 30
+GROUP_BY = ("day", "week", "client")
+# SQL for the first day of each rollup period, the same as in the triggers.
+PERIOD_STARTS = tuple((period, start.format(row="deliveries_history")) for period, start in ROLLUP_PERIODS)
+
+
+@dataclass
+class AnalyticsQuery:
+    date_from: date
+    date_to: date
+    group_by: str = "day"
+    client_ids: Tuple[int, ...] = ()
+
+
+def week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def parse_analytics_query(params: Dict[str, List[str]], today: Optional[date] = None) -> AnalyticsQuery:
+    """Build :class:`AnalyticsQuery` from a ``parse_qs`` mapping.
+
+    Without ``from``/``to`` the report covers the last
+    ``ANALYTICS_DEFAULT_DAYS`` days. Raises :class:`ValueError` with a
+    user-facing message on invalid input.
+    """
+
+    group_by = (params.get("group_by", ["day"])[0] or "day").lower()
+    if group_by not in GROUP_BY:
+        raise ValueError("group_by deve ser day, week ou client")
+    date_to = _parse_date(params.get("to", [None])[0], "to") or today or datetime.now(timezone.utc).date()
+    date_from = _parse_date(params.get("from", [None])[0], "from") or (
+        date_to - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    )
+    if date_from > date_to:
+        raise ValueError("from deve ser anterior ou igual a to")
+
+    client_ids: List[int] = []
+    for raw in params.get("client_id", []):
+        for value in raw.split(","):
+            value = value.strip()
+            if not value:
+                continue
+            try:
+                client_ids.append(int(value))
+            except ValueError:
+                raise ValueError("client_id deve ser numérico") from None
+    return AnalyticsQuery(date_from, date_to, group_by, tuple(client_ids))
+
+
+def _parse_date(value: Optional[str], name: str) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} deve estar no formato AAAA-MM-DD") from None
+
+
+def _empty_bucket() -> Dict[str, Any]:
+    return {"deliveries": 0, "breads": 0, "stay_count": 0, "stay_total": 0, "arrivals_by_hour": [0] * 24}
+
+
+def _add(bucket: Dict[str, Any], row: Dict[str, Any]) -> None:
+    for field in ("deliveries", "breads", "stay_count", "stay_total"):
+        bucket[field] += row[field]
+    if row["arrival_hour"] >= 0:
+        bucket["arrivals_by_hour"][row["arrival_hour"]] += row["deliveries"]
+
+
+def _finish(bucket: Dict[str, Any]) -> Dict[str, Any]:
+    stay_count = bucket.pop("stay_count")
+    stay_total = bucket.pop("stay_total")
+    bucket["average_stay_seconds"] = round(stay_total / stay_count, 1) if stay_count else None
+    return bucket
+
+
+def build_report(query: AnalyticsQuery) -> Dict[str, Any]:
+    """Totals per day, week or client within the range, read from the rollups.
+
+    Weeks that overlap the range are reported whole.
+    """
+
+    period = "week" if query.group_by == "week" else "day"
+    first = week_start(query.date_from) if period == "week" else query.date_from
+    conditions = ["delivery_rollups.period = ?", "delivery_rollups.period_start BETWEEN ? AND ?"]
+    params: List[Any] = [period, first.isoformat(), query.date_to.isoformat()]
+    if query.client_ids:
+        conditions.append(f"delivery_rollups.client_id IN ({','.join('?' * len(query.client_ids))})")
+        params.extend(query.client_ids)
+    key = "delivery_rollups.client_id" if query.group_by == "client" else "delivery_rollups.period_start"
+    rows = fetch_all(
+        f"SELECT {key} AS bucket, delivery_rollups.arrival_hour, SUM(delivery_rollups.deliveries) AS deliveries, "
+        "SUM(delivery_rollups.breads) AS breads, SUM(delivery_rollups.stay_count) AS stay_count, "
+        "SUM(delivery_rollups.stay_total) AS stay_total FROM delivery_rollups "
+        f"WHERE {' AND '.join(conditions)} GROUP BY bucket, delivery_rollups.arrival_hour ORDER BY bucket",
+        params,
+    )
+
+    buckets: Dict[Any, Dict[str, Any]] = {}
+    totals = _empty_bucket()
+    for row in rows:
+        _add(buckets.setdefault(row["bucket"], _empty_bucket()), row)
+        _add(totals, row)
+
+    items: List[Dict[str, Any]] = []
+    if query.group_by == "client":
+        names = _client_names(list(buckets))
+        for client_id, bucket in buckets.items():
+            items.append({"client_id": client_id, "client_name": names.get(client_id), **_finish(bucket)})
+        items.sort(key=lambda item: (-item["breads"], item["client_id"]))
+    else:
+        items = [{"period_start": start, **_finish(bucket)} for start, bucket in buckets.items()]
+    return {
+        "from": query.date_from.isoformat(),
+        "to": query.date_to.isoformat(),
+        "group_by": query.group_by,
+        "items": items,
+        "totals": _finish(totals),
+    }
+
+
+def _client_names(client_ids: List[int]) -> Dict[int, str]:
+    if not client_ids:
+        return {}
+    placeholders = ",".join("?" * len(client_ids))
+    rows = fetch_all(f"SELECT id, name FROM clients WHERE id IN ({placeholders})", client_ids)
+    return {row["id"]: row["name"] for row in rows}
+
+
+def rebuild_rollups() -> int:
+    """Recompute the rollups from hot and archived completed deliveries."""
+
+    conn = connect_history()
+    try:
+        with conn:
+            conn.execute("DELETE FROM main.delivery_rollups")
+            for period, period_start in PERIOD_STARTS:
+                conn.execute(
+                    "INSERT INTO main.delivery_rollups (period, period_start, client_id, arrival_hour, "
+                    "deliveries, breads, stay_count, stay_total) "
+                    f"SELECT ?, {period_start} AS period_start, client_id, "
+                    "COALESCE(CAST(strftime('%H', COALESCE(arrived_at, completed_at)) AS INTEGER), -1) "
+                    "AS arrival_hour, COUNT(*), SUM(COALESCE(quantity, 0)), COUNT(stay_seconds), "
+                    "SUM(COALESCE(stay_seconds, 0)) FROM deliveries_history WHERE status = 'completed' "
+                    "GROUP BY period_start, client_id, arrival_hour",
+                    (period,),
+                )
+        return conn.execute("SELECT COUNT(*) FROM main.delivery_rollups").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def backfill_rollups() -> Optional[int]:
+    """Build the rollups once for databases that had history before them."""
+
+    if fetch_one("SELECT 1 FROM delivery_rollups LIMIT 1", ()):
+        return None
+    completed = fetch_one(
+        "SELECT 1 FROM deliveries_history WHERE status = 'completed' LIMIT 1", (), connect=connect_history
+    )
+    if completed is None:
+        return None
+    return rebuild_rollups()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rebuild", action="store_true", help="recompute the rollups from all deliveries")
+    parser.add_argument("--from", dest="date_from")
+    parser.add_argument("--to", dest="date_to")
+    parser.add_argument("--group-by", default="day", choices=GROUP_BY)
+    args = parser.parse_args(argv)
+
+    if args.rebuild:
+        print(json.dumps({"rows": rebuild_rollups()}))
+        return 0
+    params = {"group_by": [args.group_by], "from": [args.date_from], "to": [args.date_to]}
+    print(json.dumps(build_report(parse_analytics_query(params)), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,21 +1,117 @@
+import functools
+import io
 import json
+import logging
 import os
-from datetime import datetime
+import threading
+import time
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from urllib.parse import parse_qs, urlparse
 
 if __package__ in (None, ""):
-    from database import execute, fetch_all, fetch_one, initialize
-    from routes_logic import detect_visit_events, nearest_neighbor_route, optimize_route_with_google
+    import metrics
+    from analytics import backfill_rollups, build_report, parse_analytics_query
+    from archive import (
+        ARCHIVE_AFTER_DAYS,
+        ARCHIVE_INTERVAL_SECONDS,
+        archive_completed,
+        connect_history,
+        prepare_archive,
+    )
+    from backups import BACKUP_INTERVAL_SECONDS, BACKUPS, verify_snapshot
+    from bulk_import import parse_records, validate_clients, validate_deliveries
+    from client_search import parse_limit, search_clients
+    from database import (
+        add_query_observer,
+        epoch_ms,
+        execute,
+        execute_many,
+        fetch_all,
+        fetch_one,
+        get_connection,
+        initialize,
+        iso_from_ms,
+        iter_rows,
+    )
+    from distance_matrix import STORE as DISTANCES
+    from exports import (
+        DELIVERY_COLUMNS,
+        EXPORT_FORMATS,
+        VISIT_COLUMNS,
+        build_deliveries_query,
+        build_visits_query,
+        encode_rows,
+        parse_export_filters,
+    )
+    from geocoding import GEOCODE_INTERVAL_SECONDS, worker_from_env
+    from idempotency import STORE as IDEMPOTENCY
+    from idempotency import IN_PROGRESS, MAX_KEY_LENGTH, MISMATCH, NEW
+    from query_profiler import profiler_from_env
+    from route_jobs import JOBS as ROUTE_JOBS
+    from route_planning import PreparedRoute, finish_route, prepare_route, solve_route
+    from route_plans import ROUTE_PRECOMPUTE_INTERVAL_SECONDS, load_plan, precompute_due_plans, store_plan
+    from routes_logic import detect_visit_events
+    from settings import env_float, env_int
+    from sync import SYNC_COMPACT_INTERVAL_SECONDS, changes_since, compact_change_log, parse_since
+    from travel_model import MODEL as TRAVEL_MODEL
 else:
-    from .database import execute, fetch_all, fetch_one, initialize
-    from .routes_logic import detect_visit_events, nearest_neighbor_route, optimize_route_with_google
+    from . import metrics
+    from .analytics import backfill_rollups, build_report, parse_analytics_query
+    from .archive import (
+        ARCHIVE_AFTER_DAYS,
+        ARCHIVE_INTERVAL_SECONDS,
+        archive_completed,
+        connect_history,
+        prepare_archive,
+    )
+    from .backups import BACKUP_INTERVAL_SECONDS, BACKUPS, verify_snapshot
+    from .bulk_import import parse_records, validate_clients, validate_deliveries
+    from .client_search import parse_limit, search_clients
+    from .database import (
+        add_query_observer,
+        epoch_ms,
+        execute,
+        execute_many,
+        fetch_all,
+        fetch_one,
+        get_connection,
+        initialize,
+        iso_from_ms,
+        iter_rows,
+    )
+    from .distance_matrix import STORE as DISTANCES
+    from .exports import (
+        DELIVERY_COLUMNS,
+        EXPORT_FORMATS,
+        VISIT_COLUMNS,
+        build_deliveries_query,
+        build_visits_query,
+        encode_rows,
+        parse_export_filters,
+    )
+    from .geocoding import GEOCODE_INTERVAL_SECONDS, worker_from_env
+    from .idempotency import STORE as IDEMPOTENCY
+    from .idempotency import IN_PROGRESS, MAX_KEY_LENGTH, MISMATCH, NEW
+    from .query_profiler import profiler_from_env
+    from .route_jobs import JOBS as ROUTE_JOBS
+    from .route_planning import PreparedRoute, finish_route, prepare_route, solve_route
+    from .route_plans import ROUTE_PRECOMPUTE_INTERVAL_SECONDS, load_plan, precompute_due_plans, store_plan
+    from .routes_logic import detect_visit_events
+    from .settings import env_float, env_int
+    from .sync import SYNC_COMPACT_INTERVAL_SECONDS, changes_since, compact_change_log, parse_since
+    from .travel_model import MODEL as TRAVEL_MODEL
+
+logger = logging.getLogger(__name__)
 
 FRONTEND_DIR = Path(__file__).resolve().parent.parent / "frontend"
-DEFAULT_START = (-23.55052, -46.633308)  # São Paulo como ponto inicial padrão
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
+STREAM_CHUNK_BYTES = 64 * 1024
+VISIT_THRESHOLD_METERS = env_float("VISIT_THRESHOLD_METERS", 80.0)
+VISIT_MIN_DURATION = env_int("VISIT_MIN_DURATION", 90)
+VISIT_LOOKBACK_MS = 20 * 60 * 1000
+TRAVEL_MODEL_REFRESH_SECONDS = env_int("TRAVEL_MODEL_REFRESH_SECONDS", 3600)
 STATUS_LABELS = {
     "pending": "Pendente",
     "arrived": "Parada detectada",
@@ -23,24 +119,158 @@ STATUS_LABELS = {
 }
 
 
+def _instrumented(method):
+    """Record latency, status and SQL usage of a ``do_*`` handler."""
+
+    @functools.wraps(method)
+    def wrapper(self) -> None:
+        if not metrics.ENABLED:
+            method(self)
+            return
+        metrics.start_request()
+        started = time.perf_counter()
+        try:
+            method(self)
+        finally:
+            metrics.finish_request(
+                self.command,
+                urlparse(self.path).path,
+                self._response_status,
+                time.perf_counter() - started,
+            )
+
+    return wrapper
+
+
 class RequestHandler(BaseHTTPRequestHandler):
     server_version = "BakeryDelivery/1.0"
+    # HTTP/1.1 is required for chunked responses; every reply still closes the
+    # connection so handlers that write without Content-Length stay valid.
+    protocol_version = "HTTP/1.1"
+    _response_status: Optional[int] = None
 
     def log_message(self, format: str, *args) -> None:  # noqa: D401
         """Silencia logs padrão do servidor HTTP."""
         return
 
-    def _set_headers(self, status: int = 200, content_type: str = "application/json") -> None:
+    def send_response(self, code: int, message: Optional[str] = None) -> None:
+        self._response_status = code
+        super().send_response(code, message)
+
+    def _set_headers(
+        self,
+        status: int = 200,
+        content_type: str = "application/json",
+        chunked: bool = False,
+        extra_headers: Optional[Dict[str, str]] = None,
+    ) -> None:
         self.send_response(status)
         self.send_header("Content-Type", content_type)
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
         self.send_header("Access-Control-Allow-Origin", "*")
         self.send_header("Access-Control-Allow-Methods", "GET, POST, PUT, DELETE, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type, Idempotency-Key")
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Connection", "close")
         self.end_headers()
 
+    def _send_stream(
+        self,
+        pieces: Iterable[bytes],
+        status: int = 200,
+        content_type: str = "application/json",
+        extra_headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """Write ``pieces`` as they are produced, coalesced into bounded chunks.
+
+        HTTP/1.0 clients cannot parse chunked bodies, so they get the raw bytes
+        and the end of the body is signalled by closing the connection.
+        """
+
+        chunked = self.request_version != "HTTP/1.0"
+        self._set_headers(status, content_type, chunked=chunked, extra_headers=extra_headers)
+        buffer = bytearray()
+        try:
+            for piece in pieces:
+                buffer += piece
+                if len(buffer) >= STREAM_CHUNK_BYTES:
+                    self._write_chunk(bytes(buffer), chunked)
+                    buffer.clear()
+            if buffer:
+                self._write_chunk(bytes(buffer), chunked)
+        finally:
+            close = getattr(pieces, "close", None)
+            if close is not None:
+                close()
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data: bytes, chunked: bool) -> None:
+        if chunked:
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        else:
+            self.wfile.write(data)
+
+    def _send_json_rows(self, rows: Iterator[Dict], status: int = 200) -> None:
+        self._send_stream(_encode_json_array(rows), status)
+
+    def _run_idempotent(self, key: Optional[str], path: str, body: bytes, handler) -> None:
+        """Run ``handler`` once per ``Idempotency-Key``; retries get the stored reply.
+
+        The handler writes into a buffer so the exact bytes can be replayed.
+        Server errors are not stored, so a retry after a 5xx runs again.
+        """
+
+        if key is None:
+            handler()
+            return
+        if not key or len(key) > MAX_KEY_LENGTH:
+            self._set_headers(400)
+            message = f"Idempotency-Key deve ter entre 1 e {MAX_KEY_LENGTH} caracteres"
+            self.wfile.write(json.dumps({"error": message}).encode())
+            return
+
+        scope = f"{self.command} {path}"
+        outcome, entry = IDEMPOTENCY.begin(scope, key, body)
+        if outcome == MISMATCH:
+            self._set_headers(422)
+            self.wfile.write(json.dumps({"error": "Idempotency-Key reutilizada com outro conteúdo"}).encode())
+            return
+        if outcome == IN_PROGRESS:
+            self._set_headers(409, extra_headers={"Retry-After": "1"})
+            self.wfile.write(json.dumps({"error": "Requisição com esta Idempotency-Key em andamento"}).encode())
+            return
+        if outcome != NEW:
+            self._response_status = entry.status
+            # The stored headers say "Connection: close"; honour them without send_header.
+            self.close_connection = True
+            status_line, _, rest = entry.raw.partition(b"\r\n")
+            self.wfile.write(status_line + b"\r\nIdempotent-Replayed: true\r\n" + rest)
+            return
+
+        wfile = self.wfile
+        self.wfile = io.BytesIO()
+        try:
+            handler()
+        except BaseException:
+            IDEMPOTENCY.abandon(scope, key, entry)
+            raise
+        finally:
+            # BaseHTTPRequestHandler flushes headers into self.wfile, so swap back last.
+            raw, self.wfile = self.wfile.getvalue(), wfile
+        if self._response_status is not None and self._response_status < 500:
+            IDEMPOTENCY.complete(entry, self._response_status, raw)
+        else:
+            IDEMPOTENCY.abandon(scope, key, entry)
+        self.wfile.write(raw)
+
+    @_instrumented
     def do_OPTIONS(self) -> None:  # noqa: N802
         self._set_headers()
 
+    @_instrumented
     def do_GET(self) -> None:  # noqa: N802
         parsed = urlparse(self.path)
         if parsed.path.startswith("/api/"):
@@ -48,26 +278,40 @@ class RequestHandler(BaseHTTPRequestHandler):
         else:
             self.serve_static(parsed.path)
 
+    @_instrumented
     def do_POST(self) -> None:  # noqa: N802
         parsed = urlparse(self.path)
         length = int(self.headers.get("Content-Length", 0))
         body = self.rfile.read(length) if length else b"{}"
+        if parsed.path in ("/api/clients/bulk", "/api/deliveries/bulk"):
+            self.bulk_import(parsed.path, body)
+            return
         payload = json.loads(body.decode("utf-8")) if body else {}
+        idempotency_key = self.headers.get("Idempotency-Key")
 
         if parsed.path == "/api/clients":
             self.create_client(payload)
         elif parsed.path == "/api/deliveries":
             self.create_delivery(payload)
         elif parsed.path.endswith("/complete"):
-            self.complete_delivery(parsed.path, payload)
+            handler = functools.partial(self.complete_delivery, parsed.path, payload)
+            self._run_idempotent(idempotency_key, parsed.path, body, handler)
         elif parsed.path == "/api/driver/location":
-            self.record_location(payload)
+            handler = functools.partial(self.record_location, payload)
+            self._run_idempotent(idempotency_key, parsed.path, body, handler)
         elif parsed.path == "/api/routes":
             self.generate_route(payload)
+        elif parsed.path == "/api/routes/jobs":
+            self.submit_route_job(payload)
+        elif parsed.path == "/api/admin/backups":
+            self.start_backup()
+        elif parsed.path.startswith("/api/admin/backups/") and parsed.path.endswith("/verify"):
+            self.verify_backup(parsed.path.split("/")[-2])
         else:
             self._set_headers(404)
             self.wfile.write(json.dumps({"error": "Endpoint não encontrado"}).encode())
 
+    @_instrumented
     def do_PUT(self) -> None:  # noqa: N802
         parsed = urlparse(self.path)
         if not parsed.path.startswith("/api/clients/"):
@@ -80,6 +324,7 @@ class RequestHandler(BaseHTTPRequestHandler):
         payload = json.loads(self.rfile.read(length) or b"{}")
         latitude = self._normalize_coordinate(payload.get("latitude"))
         longitude = self._normalize_coordinate(payload.get("longitude"))
+        previous = fetch_one("SELECT latitude, longitude FROM clients WHERE id = ?", (client_id,))
         execute(
             "UPDATE clients SET name = ?, phone = ?, address = ?, latitude = ?, longitude = ?, notes = ? WHERE id = ?",
             (
@@ -92,26 +337,36 @@ class RequestHandler(BaseHTTPRequestHandler):
                 client_id,
             ),
         )
+        if previous and (previous["latitude"], previous["longitude"]) != (latitude, longitude):
+            DISTANCES.refresh_client(client_id, latitude, longitude)
         self._set_headers(200)
         self.wfile.write(json.dumps({"status": "ok"}).encode())
 
+    @_instrumented
     def do_DELETE(self) -> None:  # noqa: N802
         parsed = urlparse(self.path)
+        if parsed.path.startswith("/api/routes/jobs/"):
+            self.cancel_route_job(parsed.path.rsplit("/", 1)[-1])
+            return
         if not parsed.path.startswith("/api/clients/"):
             self._set_headers(404)
             self.wfile.write(json.dumps({"error": "Endpoint não encontrado"}).encode())
             return
         client_id = parsed.path.split("/")[-1]
         execute("DELETE FROM clients WHERE id = ?", (client_id,))
+        try:
+            DISTANCES.forget_client(int(client_id))
+        except ValueError:
+            pass
         self._set_headers(200)
         self.wfile.write(json.dumps({"status": "ok"}).encode())
 
     # API handlers
     def handle_api_get(self, parsed) -> None:
         if parsed.path == "/api/clients":
-            clients = fetch_all("SELECT * FROM clients ORDER BY name")
-            self._set_headers(200)
-            self.wfile.write(json.dumps(clients).encode())
+            self._send_json_rows(iter_rows("SELECT * FROM clients ORDER BY name"))
+        elif parsed.path == "/api/clients/search":
+            self.find_clients(parsed)
         elif parsed.path == "/api/deliveries":
             params = parse_qs(parsed.query)
             date = params.get("date", [None])[0]
@@ -124,20 +379,34 @@ class RequestHandler(BaseHTTPRequestHandler):
                 query += " WHERE scheduled_date = ?"
                 args = (date,)
             query += " ORDER BY scheduled_date DESC, id DESC"
-            deliveries = fetch_all(query, args)
+            self._send_json_rows(iter_rows(query, args))
+        elif parsed.path in ("/api/export/deliveries", "/api/export/visits"):
+            self.export_history(parsed)
+        elif parsed.path == "/api/sync":
+            self.sync_changes(parsed)
+        elif parsed.path == "/api/analytics":
+            self.report_analytics(parsed)
+        elif parsed.path.startswith("/api/routes/jobs/"):
+            self.report_route_job(parsed.path.rsplit("/", 1)[-1])
+        elif parsed.path == "/api/admin/backups":
             self._set_headers(200)
-            self.wfile.write(json.dumps(deliveries).encode())
+            self.wfile.write(json.dumps(BACKUPS.status()).encode())
         elif parsed.path == "/api/metrics/summary":
             summary = self.build_metrics_summary()
             self._set_headers(200)
             self.wfile.write(json.dumps(summary).encode())
+        elif parsed.path == "/api/metrics/runtime":
+            self._set_headers(200, "text/plain; version=0.0.4; charset=utf-8")
+            self.wfile.write(metrics.render().encode())
+        elif parsed.path == "/api/metrics/slow-queries":
+            self.report_slow_queries(parsed)
         elif parsed.path == "/api/config":
             config = {"google_maps_api_key": GOOGLE_MAPS_API_KEY}
             self._set_headers(200)
             self.wfile.write(json.dumps(config).encode())
         elif parsed.path == "/api/driver/location":
             positions = fetch_all(
-                "SELECT * FROM driver_positions ORDER BY timestamp DESC LIMIT 20"
+                "SELECT * FROM driver_positions_iso ORDER BY recorded_ms DESC LIMIT 20"
             )
             payload = {
                 "positions": positions,
@@ -149,6 +418,83 @@ class RequestHandler(BaseHTTPRequestHandler):
             self._set_headers(404)
             self.wfile.write(json.dumps({"error": "Endpoint não encontrado"}).encode())
 
+    def find_clients(self, parsed) -> None:
+        params = parse_qs(parsed.query)
+        text = params.get("q", [""])[0].strip()
+        try:
+            limit = parse_limit(params.get("limit", [None])[0])
+        except ValueError as exc:
+            self._set_headers(400)
+            self.wfile.write(json.dumps({"error": str(exc)}).encode())
+            return
+        if not text:
+            self._set_headers(400)
+            self.wfile.write(json.dumps({"error": "q é obrigatório"}).encode())
+            return
+        self._set_headers(200)
+        self.wfile.write(json.dumps(search_clients(text, limit)).encode())
+
+    def report_analytics(self, parsed) -> None:
+        try:
+            query = parse_analytics_query(parse_qs(parsed.query))
+        except ValueError as exc:
+            self._set_headers(400)
+            self.wfile.write(json.dumps({"error": str(exc)}).encode())
+            return
+        self._set_headers(200)
+        self.wfile.write(json.dumps(build_report(query)).encode())
+
+    def sync_changes(self, parsed) -> None:
+        try:
+            since = parse_since(parse_qs(parsed.query).get("since", [None])[0])
+        except ValueError as exc:
+            self._set_headers(400)
+            self.wfile.write(json.dumps({"error": str(exc)}).encode())
+            return
+        self._set_headers(200)
+        self.wfile.write(json.dumps(changes_since(since)).encode())
+
+    def report_slow_queries(self, parsed) -> None:
+        if QUERY_PROFILER is None:
+            self._set_headers(404)
+            self.wfile.write(json.dumps({"error": "Defina SLOW_QUERY_MS para ativar o perfil de consultas"}).encode())
+            return
+        params = parse_qs(parsed.query)
+        limit = self._parse_limit(params.get("limit", [None])[0])
+        if params.get("format", ["json"])[0] == "text":
+            self._set_headers(200, "text/plain; charset=utf-8")
+            self.wfile.write(QUERY_PROFILER.dump(limit).encode())
+            return
+        report = {"threshold_ms": QUERY_PROFILER.threshold_ms, "statements": QUERY_PROFILER.top(limit)}
+        self._set_headers(200)
+        self.wfile.write(json.dumps(report).encode())
+
+    def _parse_limit(self, value: Optional[str]) -> Optional[int]:
+        try:
+            return max(1, int(value)) if value else None
+        except ValueError:
+            return None
+
+    def export_history(self, parsed) -> None:
+        try:
+            filters = parse_export_filters(parse_qs(parsed.query))
+        except ValueError as exc:
+            self._set_headers(400)
+            self.wfile.write(json.dumps({"error": str(exc)}).encode())
+            return
+        if parsed.path.endswith("/visits"):
+            name, columns = "visits", VISIT_COLUMNS
+            query, args = build_visits_query(filters)
+        else:
+            name, columns = "deliveries", DELIVERY_COLUMNS
+            query, args = build_deliveries_query(filters)
+        filename = f"{name}.{filters.export_format}"
+        self._send_stream(
+            encode_rows(iter_rows(query, args, connect=connect_history), columns, filters.export_format),
+            content_type=EXPORT_FORMATS[filters.export_format],
+            extra_headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+
     def _normalize_coordinate(self, value: Optional[float]) -> Optional[float]:
         if value in (None, ""):
             return None
@@ -171,6 +517,8 @@ class RequestHandler(BaseHTTPRequestHandler):
                 payload.get("notes"),
             ),
         )
+        if latitude is not None and longitude is not None:
+            DISTANCES.refresh_client(client_id, latitude, longitude)
         client = fetch_one("SELECT * FROM clients WHERE id = ?", (client_id,))
         self._set_headers(201)
         self.wfile.write(json.dumps(client).encode())
@@ -196,6 +544,31 @@ class RequestHandler(BaseHTTPRequestHandler):
         self._set_headers(201)
         self.wfile.write(json.dumps(delivery).encode())
 
+    def bulk_import(self, path: str, body: bytes) -> None:
+        try:
+            records = parse_records(body, self.headers.get("Content-Type"))
+            if path == "/api/clients/bulk":
+                rows, errors = validate_clients(records)
+                query = (
+                    "INSERT INTO clients (name, phone, address, latitude, longitude, notes) "
+                    "VALUES (?, ?, ?, ?, ?, ?)"
+                )
+            else:
+                known = (row["id"] for row in iter_rows("SELECT id FROM clients"))
+                rows, errors = validate_deliveries(records, known)
+                query = "INSERT INTO deliveries (client_id, scheduled_date, quantity, notes) VALUES (?, ?, ?, ?)"
+        except ValueError as exc:
+            self._set_headers(400)
+            self.wfile.write(json.dumps({"error": str(exc)}).encode())
+            return
+        if errors:
+            self._set_headers(400)
+            self.wfile.write(json.dumps({"inserted": 0, "errors": errors}).encode())
+            return
+        inserted = execute_many(query, rows) if rows else 0
+        self._set_headers(201)
+        self.wfile.write(json.dumps({"inserted": inserted, "errors": []}).encode())
+
     def complete_delivery(self, path: str, payload: Dict) -> None:
         delivery_id = path.split("/")[-2]
         quantity = payload.get("quantity")
@@ -207,10 +580,10 @@ class RequestHandler(BaseHTTPRequestHandler):
             (quantity, notes, delivery_id),
         )
         execute(
-            "UPDATE delivery_visits SET status = 'confirmed', confirmed_at = datetime('now'), "
+            "UPDATE delivery_visits SET status = 'confirmed', confirmed_ms = ?, "
             "quantity = COALESCE(?, quantity), notes = COALESCE(?, notes) "
             "WHERE delivery_id = ? AND status IN ('detected', 'awaiting_confirmation')",
-            (quantity, notes, delivery_id),
+            (epoch_ms(), quantity, notes, delivery_id),
         )
         delivery = fetch_one(
             "SELECT deliveries.*, clients.name as client_name FROM deliveries "
@@ -246,160 +619,125 @@ class RequestHandler(BaseHTTPRequestHandler):
         self.wfile.write(json.dumps(response).encode())
 
     def generate_route(self, payload: Dict) -> None:
-        start_lat = self._parse_float(payload.get("start_latitude"), DEFAULT_START[0])
-        start_lon = self._parse_float(payload.get("start_longitude"), DEFAULT_START[1])
-        date = payload.get("date")
-        client_ids = payload.get("client_ids") or []
+        prepared = prepare_route(payload)
+        stored = load_plan(prepared)
+        if stored is not None:
+            ordered, directions = stored
+            replan_summary = None
+        else:
+            ordered, directions, replan_summary = solve_route(*prepared.solve_args(GOOGLE_MAPS_API_KEY))
+            store_plan(prepared, ordered, directions)
+        self._set_headers(200)
+        self.wfile.write(json.dumps(self._route_response(prepared, ordered, directions, replan_summary)).encode())
 
-        try:
-            client_ids_iterable: Iterable[int] = tuple(int(cid) for cid in client_ids)
-        except (TypeError, ValueError):
-            client_ids_iterable = ()
-
-        clients = self._fetch_route_candidates(date, client_ids_iterable)
-
-        with_coordinates = [
-            client
-            for client in clients
-            if client.get("latitude") is not None and client.get("longitude") is not None
-        ]
-        missing_coordinates = [
-            client
-            for client in clients
-            if client.get("latitude") is None or client.get("longitude") is None
-        ]
-
-        ordered, directions = optimize_route_with_google(
-            GOOGLE_MAPS_API_KEY,
-            (start_lat, start_lon),
-            with_coordinates,
-        )
+    def submit_route_job(self, payload: Dict) -> None:
+        prepared = prepare_route(payload)
+        stored = load_plan(prepared)
+        deduplicated = False
+        if stored is not None:
+            ordered, directions = stored
+            job = ROUTE_JOBS.resolved(prepared.fingerprint(), prepared, (ordered, directions, None))
+        else:
+            job, deduplicated = ROUTE_JOBS.submit(
+                prepared.fingerprint(),
+                prepared,
+                solve_route,
+                *prepared.solve_args(GOOGLE_MAPS_API_KEY),
+                on_done=lambda prepared, result: store_plan(prepared, result[0], result[1]),
+            )
+        response = job.describe()
+        response["deduplicated"] = deduplicated
+        self._set_headers(202, extra_headers={"Location": f"/api/routes/jobs/{job.id}"})
+        self.wfile.write(json.dumps(response).encode())
+
+    def report_route_job(self, job_id: str) -> None:
+        job = ROUTE_JOBS.get(job_id)
+        if job is None:
+            self._set_headers(404)
+            self.wfile.write(json.dumps({"error": "Job de rota não encontrado"}).encode())
+            return
+        response = job.describe()
+        if job.status == "done":
+            # Learned durations and the warm-start order are written by the
+            # server process, once, the first time the result is read.
+            response["result"] = ROUTE_JOBS.response(
+                job, lambda finished: self._route_response(finished.context, *finished.result)
+            )
+        self._set_headers(200)
+        self.wfile.write(json.dumps(response).encode())
 
-        if not ordered and with_coordinates:
-            ordered = nearest_neighbor_route((start_lat, start_lon), with_coordinates)
-            directions = None
+    def start_backup(self) -> None:
+        run = BACKUPS.start()
+        if run is None:
+            self._set_headers(409)
+            self.wfile.write(json.dumps({"error": "Já existe um backup em andamento"}).encode())
+            return
+        self._set_headers(202, extra_headers={"Location": "/api/admin/backups"})
+        self.wfile.write(json.dumps(run.describe()).encode())
+
+    def verify_backup(self, backup_id: str) -> None:
+        result = verify_snapshot(backup_id)
+        if result is None:
+            self._set_headers(404)
+            self.wfile.write(json.dumps({"error": "Backup não encontrado"}).encode())
+            return
+        self._set_headers(200 if result["ok"] else 422)
+        self.wfile.write(json.dumps(result).encode())
+
+    def cancel_route_job(self, job_id: str) -> None:
+        job = ROUTE_JOBS.cancel(job_id)
+        if job is None:
+            self._set_headers(404)
+            self.wfile.write(json.dumps({"error": "Job de rota não encontrado"}).encode())
+            return
+        self._set_headers(200)
+        self.wfile.write(json.dumps(job.describe()).encode())
 
+    def _route_response(
+        self,
+        prepared: PreparedRoute,
+        ordered: List[Dict],
+        directions: Optional[Dict],
+        replan_summary: Optional[Dict],
+    ) -> Dict:
+        finish_route(prepared, ordered, directions)
         self._apply_status_labels(ordered)
-        self._apply_status_labels(missing_coordinates)
+        self._apply_status_labels(prepared.missing_coordinates)
 
-        progress_reference: List[Dict] = list(ordered) if ordered else list(clients)
+        progress_reference: List[Dict] = list(ordered) if ordered else list(prepared.clients)
         progress = self._build_progress_payload(progress_reference)
 
         response = {
-            "start": {"latitude": start_lat, "longitude": start_lon},
+            "start": {"latitude": prepared.start[0], "longitude": prepared.start[1]},
             "ordered": ordered,
-            "skipped": missing_coordinates,
+            "skipped": prepared.missing_coordinates,
             "directions": directions,
             "progress": progress,
         }
-
-        self._set_headers(200)
-        self.wfile.write(json.dumps(response).encode())
-
-    def _parse_float(self, value, default: float) -> float:
-        if value in (None, "", []):
-            return float(default)
-        try:
-            return float(value)
-        except (TypeError, ValueError):
-            return float(default)
-
-    def _fetch_route_candidates(self, date: Optional[str], client_ids: Iterable[int]) -> List[Dict]:
-        client_ids_tuple = tuple(client_ids)
-        if client_ids_tuple:
-            placeholders = ",".join(["?"] * len(client_ids_tuple))
-            clients = fetch_all(
-                f"SELECT * FROM clients WHERE id IN ({placeholders}) ORDER BY name",
-                client_ids_tuple,
-            )
-            deliveries_params: Tuple = client_ids_tuple
-            deliveries_query = (
-                "SELECT deliveries.*, clients.name as client_name FROM deliveries "
-                "JOIN clients ON clients.id = deliveries.client_id "
-                f"WHERE deliveries.client_id IN ({placeholders}) AND deliveries.status != 'completed'"
-            )
-            if date:
-                deliveries_query += " AND deliveries.scheduled_date = ?"
-                deliveries_params = client_ids_tuple + (date,)
-            deliveries = fetch_all(deliveries_query, deliveries_params)
-            delivery_map = {delivery["client_id"]: delivery for delivery in deliveries}
-
-            enriched: List[Dict] = []
-            for client in clients:
-                entry = dict(client)
-                delivery = delivery_map.get(client["id"])
-                if delivery:
-                    entry.update(
-                        {
-                            "delivery_id": delivery["id"],
-                            "status": delivery["status"],
-                            "scheduled_date": delivery["scheduled_date"],
-                            "client_name": delivery["client_name"],
-                        }
-                    )
-                else:
-                    entry.update(
-                        {
-                            "delivery_id": None,
-                            "status": "pending",
-                            "scheduled_date": date,
-                            "client_name": client["name"],
-                        }
-                    )
-                entry.setdefault("client_id", entry.get("id"))
-                enriched.append(entry)
-            return enriched
-
-        query = (
-            "SELECT clients.*, deliveries.id as delivery_id, deliveries.status, deliveries.scheduled_date, "
-            "clients.name as client_name "
-            "FROM deliveries JOIN clients ON deliveries.client_id = clients.id "
-            "WHERE deliveries.status != 'completed'"
-        )
-        params: Tuple = ()
-        if date:
-            query += " AND deliveries.scheduled_date = ?"
-            params = (date,)
-        query += " ORDER BY deliveries.scheduled_date ASC, deliveries.id ASC"
-        results = fetch_all(query, params)
-        if results:
-            for client in results:
-                client.setdefault("client_id", client.get("client_id") or client.get("id"))
-                client.setdefault("client_name", client.get("client_name") or client.get("name"))
-            return results
-
-        clients = fetch_all("SELECT * FROM clients ORDER BY name")
-        enriched: List[Dict] = []
-        for client in clients:
-            entry = dict(client)
-            entry.setdefault("client_id", entry.get("id"))
-            entry.update(
-                {
-                    "delivery_id": None,
-                    "status": "pending",
-                    "scheduled_date": date,
-                    "client_name": client.get("name"),
-                }
-            )
-            enriched.append(entry)
-        return enriched
+        if replan_summary is not None:
+            response["replan"] = replan_summary
+        return response
 
     def build_metrics_summary(self) -> Dict:
         total_clients = fetch_one("SELECT COUNT(*) as total FROM clients", ())["total"]
-        total_deliveries = fetch_one("SELECT COUNT(*) as total FROM deliveries", ())["total"]
+        total_deliveries = fetch_one(
+            "SELECT COUNT(*) as total FROM deliveries_history", (), connect=connect_history
+        )["total"]
         completed_today = fetch_one(
             "SELECT COUNT(*) as total FROM deliveries WHERE status = 'completed' AND date(completed_at) = date('now')",
             (),
         )["total"]
         totals_by_day = fetch_all(
             "SELECT scheduled_date as day, SUM(COALESCE(quantity, 0)) as breads "
-            "FROM deliveries WHERE status = 'completed' "
-            "GROUP BY scheduled_date ORDER BY scheduled_date DESC LIMIT 14"
+            "FROM deliveries_history WHERE status = 'completed' "
+            "GROUP BY scheduled_date ORDER BY scheduled_date DESC LIMIT 14",
+            connect=connect_history,
         )
         top_clients = fetch_all(
             "SELECT clients.name, COUNT(deliveries.id) as deliveries "
-            "FROM deliveries JOIN clients ON clients.id = deliveries.client_id "
-            "GROUP BY clients.name ORDER BY deliveries DESC LIMIT 5"
+            "FROM deliveries_history AS deliveries JOIN clients ON clients.id = deliveries.client_id "
+            "GROUP BY clients.name ORDER BY deliveries DESC LIMIT 5",
+            connect=connect_history,
         )
         return {
             "totals": {
@@ -460,7 +798,9 @@ class RequestHandler(BaseHTTPRequestHandler):
 
     def _get_recent_positions(self) -> List[Dict]:
         return fetch_all(
-            "SELECT * FROM driver_positions WHERE timestamp >= datetime('now', '-20 minutes') ORDER BY timestamp ASC"
+            "SELECT recorded_ms, latitude, longitude FROM driver_positions "
+            "WHERE recorded_ms >= ? ORDER BY recorded_ms ASC",
+            (epoch_ms() - VISIT_LOOKBACK_MS,),
         )
 
     def _get_active_deliveries(self) -> List[Dict]:
@@ -474,9 +814,9 @@ class RequestHandler(BaseHTTPRequestHandler):
     def _fetch_pending_confirmations(self) -> List[Dict]:
         return fetch_all(
             "SELECT delivery_visits.*, clients.name as client_name "
-            "FROM delivery_visits JOIN clients ON clients.id = delivery_visits.client_id "
+            "FROM delivery_visits_iso AS delivery_visits JOIN clients ON clients.id = delivery_visits.client_id "
             "WHERE delivery_visits.status = 'awaiting_confirmation' "
-            "ORDER BY delivery_visits.detected_at ASC",
+            "ORDER BY delivery_visits.detected_ms ASC",
         )
 
     def _detect_and_register_visits(self) -> List[Dict]:
@@ -484,7 +824,12 @@ class RequestHandler(BaseHTTPRequestHandler):
         deliveries = self._get_active_deliveries()
         if not positions or not deliveries:
             return self._fetch_pending_confirmations()
-        detections = detect_visit_events(positions, deliveries)
+        detections = detect_visit_events(
+            positions,
+            deliveries,
+            threshold_meters=VISIT_THRESHOLD_METERS,
+            min_duration=VISIT_MIN_DURATION,
+        )
         if not detections:
             return self._fetch_pending_confirmations()
 
@@ -497,27 +842,26 @@ class RequestHandler(BaseHTTPRequestHandler):
                 continue
             if delivery.get("status") == "completed":
                 continue
-            detected_at = detection.detected_at.isoformat(timespec="seconds")
             existing_visit = fetch_one(
                 "SELECT * FROM delivery_visits WHERE delivery_id = ? AND status IN ('detected','awaiting_confirmation') "
-                "ORDER BY detected_at DESC LIMIT 1",
+                "ORDER BY detected_ms DESC LIMIT 1",
                 (detection.delivery_id,),
             )
             if existing_visit:
                 execute(
-                    "UPDATE delivery_visits SET stay_seconds = ?, detected_at = ? WHERE id = ?",
-                    (detection.stay_seconds, detected_at, existing_visit["id"]),
+                    "UPDATE delivery_visits SET stay_seconds = ?, detected_ms = ? WHERE id = ?",
+                    (detection.stay_seconds, detection.detected_ms, existing_visit["id"]),
                 )
                 visit_id = existing_visit["id"]
             else:
                 visit_id = execute(
-                    "INSERT INTO delivery_visits (delivery_id, client_id, stay_seconds, status, detected_at) "
+                    "INSERT INTO delivery_visits (delivery_id, client_id, stay_seconds, status, detected_ms) "
                     "VALUES (?, ?, ?, 'awaiting_confirmation', ?)",
                     (
                         detection.delivery_id,
                         detection.client_id,
                         detection.stay_seconds,
-                        detected_at,
+                        detection.detected_ms,
                     ),
                 )
             execute(
@@ -527,7 +871,7 @@ class RequestHandler(BaseHTTPRequestHandler):
             execute(
                 "UPDATE deliveries SET status = 'arrived', arrived_at = COALESCE(arrived_at, ?), "
                 "stay_seconds = COALESCE(?, stay_seconds) WHERE id = ? AND status != 'completed'",
-                (detected_at, detection.stay_seconds, detection.delivery_id),
+                (iso_from_ms(detection.detected_ms), detection.stay_seconds, detection.delivery_id),
             )
         return self._fetch_pending_confirmations()
 
@@ -581,6 +925,8 @@ class RequestHandler(BaseHTTPRequestHandler):
                     "quantity": client.get("quantity"),
                     "arrived_at": client.get("arrived_at"),
                     "completed_at": client.get("completed_at"),
+                    "eta": client.get("eta"),
+                    "eta_seconds": client.get("eta_seconds"),
                 }
             )
             if next_client_id is None and status != "completed":
@@ -603,6 +949,29 @@ class RequestHandler(BaseHTTPRequestHandler):
         }
 
 
+if metrics.ENABLED:
+    add_query_observer(metrics.observe_query)
+
+QUERY_PROFILER = profiler_from_env(get_connection)
+if QUERY_PROFILER is not None:
+    add_query_observer(QUERY_PROFILER)
+
+
+def _encode_json_array(rows: Iterable[Dict]) -> Iterator[bytes]:
+    """Encode ``rows`` as a JSON array one element at a time."""
+
+    separator = b"["
+    try:
+        for row in rows:
+            yield separator + json.dumps(row).encode()
+            separator = b","
+    finally:
+        close = getattr(rows, "close", None)
+        if close is not None:
+            close()
+    yield b"[]" if separator == b"[" else b"]"
+
+
 def _resolve_port(default: int) -> int:
     """Return the port informed by the PORT environment variable if present."""
 
@@ -616,9 +985,42 @@ def _resolve_port(default: int) -> int:
         return default
 
 
+def _run_periodically(name: str, interval: float, task) -> threading.Thread:
+    """Run ``task`` now and then every ``interval`` seconds in a daemon thread."""
+
+    def loop() -> None:
+        while True:
+            try:
+                task()
+            except Exception:  # noqa: BLE001 - keep the worker alive
+                logger.exception("Falha na tarefa periódica %s", name)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
 def run(host: str = "0.0.0.0", port: int = 8000) -> None:
     resolved_port = _resolve_port(port)
     initialize()
+    prepare_archive()
+    backfill_rollups()
+    _run_periodically("travel-model", TRAVEL_MODEL_REFRESH_SECONDS, TRAVEL_MODEL.refresh)
+    _run_periodically(
+        "route-precompute",
+        ROUTE_PRECOMPUTE_INTERVAL_SECONDS,
+        lambda: precompute_due_plans(GOOGLE_MAPS_API_KEY),
+    )
+    _run_periodically("sync-compaction", SYNC_COMPACT_INTERVAL_SECONDS, compact_change_log)
+    if ARCHIVE_AFTER_DAYS > 0:
+        _run_periodically("archive", ARCHIVE_INTERVAL_SECONDS, archive_completed)
+    if BACKUP_INTERVAL_SECONDS > 0:
+        # Checked hourly so a restart does not postpone the next snapshot by a full interval.
+        _run_periodically("backup", min(BACKUP_INTERVAL_SECONDS, 3600), BACKUPS.run_if_due)
+    geocoding = worker_from_env()
+    if geocoding is not None:
+        _run_periodically("geocoding", GEOCODE_INTERVAL_SECONDS, geocoding.run_batch)
     server = ThreadingHTTPServer((host, resolved_port), RequestHandler)
     print(f"Servidor iniciado em http://{host}:{resolved_port}")
     try:
@@ -627,6 +1029,7 @@ def run(host: str = "0.0.0.0", port: int = 8000) -> None:
         print("Encerrando servidor...")
     finally:
         server.server_close()
+        ROUTE_JOBS.shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,231 @@
+"""Hot/cold archival of finished deliveries and their visits.
+
+Completed deliveries scheduled more than ``ARCHIVE_AFTER_DAYS`` days ago are
+moved, together with all their ``delivery_visits``, into a separate SQLite
+file (``ARCHIVE_DB_PATH``, by default next to the main database). The hot
+tables then hold little more than open work, which keeps the operational
+queries and their indexes small.
+
+Reports, exports and the travel model read through :func:`connect_history`,
+which attaches the archive and defines TEMP views that span both files (the
+visit replay uses the read-only :func:`attach_archive_readonly`):
+
+* ``deliveries_history``: every column of ``deliveries``;
+* ``delivery_visits_history``: the columns of ``delivery_visits_iso``.
+
+Both files use WAL mode, where a transaction is atomic per file only, so each
+batch is first copied and committed to the archive and then deleted from the
+hot tables. A crash in between leaves the batch in both files, never in
+neither; the views show such rows once and the next run completes the move.
+
+Run ``python -m backend.archive`` to archive from the command line; the
+server also archives once a day. ``ARCHIVE_AFTER_DAYS=0`` turns it off.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Set
+
+if __package__ in (None, ""):
+    import database
+    from settings import env_int
+else:
+    from . import database
+    from .settings import env_int
+
+ARCHIVE_AFTER_DAYS = env_int("ARCHIVE_AFTER_DAYS", 90)
+ARCHIVE_BATCH_SIZE = env_int("ARCHIVE_BATCH_SIZE", 2000)
+ARCHIVE_INTERVAL_SECONDS = env_int("ARCHIVE_INTERVAL_SECONDS", 86400)
+
+DELIVERY_FIELDS = (
+    "id, client_id, scheduled_date, status, quantity, notes, completed_at, "
+    "arrived_at, departed_at, stay_seconds"
+)
+VISIT_FIELDS = "id, delivery_id, client_id, detected_ms, confirmed_ms, stay_seconds, quantity, notes, status"
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archive.deliveries (
+    id INTEGER PRIMARY KEY,
+    client_id INTEGER NOT NULL,
+    scheduled_date TEXT NOT NULL,
+    status TEXT NOT NULL,
+    quantity INTEGER,
+    notes TEXT,
+    completed_at TEXT,
+    arrived_at TEXT,
+    departed_at TEXT,
+    stay_seconds INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS archive.delivery_visits (
+    id INTEGER PRIMARY KEY,
+    delivery_id INTEGER,
+    client_id INTEGER,
+    detected_ms INTEGER,
+    confirmed_ms INTEGER,
+    stay_seconds INTEGER,
+    quantity INTEGER,
+    notes TEXT,
+    status TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS archive.idx_deliveries_scheduled_date ON deliveries(scheduled_date);
+CREATE INDEX IF NOT EXISTS archive.idx_deliveries_client_id ON deliveries(client_id);
+CREATE INDEX IF NOT EXISTS archive.idx_delivery_visits_detected_ms ON delivery_visits(detected_ms);
+CREATE INDEX IF NOT EXISTS archive.idx_delivery_visits_delivery_id ON delivery_visits(delivery_id);
+"""
+
+# Only TEMP views may refer to tables of more than one attached database.
+HISTORY_VIEWS = f"""
+CREATE TEMP VIEW IF NOT EXISTS deliveries_history AS
+SELECT {DELIVERY_FIELDS} FROM main.deliveries
+UNION ALL
+SELECT {DELIVERY_FIELDS} FROM archive.deliveries WHERE id NOT IN (SELECT id FROM main.deliveries);
+
+CREATE TEMP VIEW IF NOT EXISTS delivery_visits_history AS
+SELECT
+    id,
+    delivery_id,
+    client_id,
+    detected_ms,
+    datetime(detected_ms / 1000, 'unixepoch') AS detected_at,
+    confirmed_ms,
+    datetime(confirmed_ms / 1000, 'unixepoch') AS confirmed_at,
+    stay_seconds,
+    quantity,
+    notes,
+    status
+FROM (
+    SELECT {VISIT_FIELDS} FROM main.delivery_visits
+    UNION ALL
+    SELECT {VISIT_FIELDS} FROM archive.delivery_visits WHERE id NOT IN (SELECT id FROM main.delivery_visits)
+);
+"""
+
+
+def archive_path(main: Optional[Path] = None) -> Path:
+    configured = os.getenv("ARCHIVE_DB_PATH")
+    if configured:
+        return Path(configured)
+    main = Path(main or database.DB_PATH)
+    return main.with_name(f"{main.stem}-archive{main.suffix}")
+
+
+# Archive files whose schema and WAL mode were set up by this process.
+_prepared: Set[str] = set()
+_prepared_lock = threading.Lock()
+
+
+def prepare_archive() -> None:
+    """Create the archive file with its schema in WAL mode, once per process."""
+
+    path = str(archive_path())
+    with _prepared_lock:
+        if path in _prepared:
+            return
+        conn = database.get_connection()
+        try:
+            conn.execute("ATTACH DATABASE ? AS archive", (path,))
+            conn.execute("PRAGMA archive.journal_mode = WAL")
+            conn.executescript(ARCHIVE_SCHEMA)
+        finally:
+            conn.close()
+        _prepared.add(path)
+
+
+def attach_archive(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Attach the archive to ``conn`` and add the history views."""
+
+    prepare_archive()
+    conn.execute("ATTACH DATABASE ? AS archive", (str(archive_path()),))
+    conn.executescript(HISTORY_VIEWS)
+    return conn
+
+
+def attach_archive_readonly(conn: sqlite3.Connection, main: Path) -> sqlite3.Connection:
+    """Attach the archive of ``main`` read-only and add the history views.
+
+    ``conn`` must have been opened with ``uri=True``. Without an archive file
+    an empty in-memory one stands in, so the views always exist.
+    """
+
+    path = archive_path(main)
+    if path.exists():
+        conn.execute("ATTACH DATABASE ? AS archive", (f"{path.resolve().as_uri()}?mode=ro",))
+    else:
+        conn.execute("ATTACH DATABASE ':memory:' AS archive")
+        conn.executescript(ARCHIVE_SCHEMA)
+    conn.executescript(HISTORY_VIEWS)
+    return conn
+
+
+def connect_history() -> sqlite3.Connection:
+    """Connection for reports: hot tables plus the archive, via the history views."""
+
+    return attach_archive(database.get_connection())
+
+
+def archive_completed(
+    days: int = ARCHIVE_AFTER_DAYS,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    today: Optional[date] = None,
+) -> Dict[str, int]:
+    """Move completed deliveries scheduled before ``today - days`` to the archive.
+
+    Each batch is committed to the archive before it is deleted from the hot
+    tables, so a crash never loses rows (see the module docstring).
+    """
+
+    cutoff = ((today or datetime.now(timezone.utc).date()) - timedelta(days=days)).isoformat()
+    moved = {"deliveries": 0, "visits": 0}
+    conn = connect_history()
+    try:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)")
+        while True:
+            with conn:
+                conn.execute("DELETE FROM temp.archive_batch")
+                selected = conn.execute(
+                    "INSERT INTO temp.archive_batch SELECT id FROM main.deliveries "
+                    "WHERE status = 'completed' AND scheduled_date < ? ORDER BY id LIMIT ?",
+                    (cutoff, batch_size),
+                ).rowcount
+                if not selected:
+                    break
+                conn.execute(
+                    f"INSERT OR REPLACE INTO archive.deliveries ({DELIVERY_FIELDS}) "
+                    f"SELECT {DELIVERY_FIELDS} FROM main.deliveries WHERE id IN temp.archive_batch"
+                )
+                moved["visits"] += conn.execute(
+                    f"INSERT OR REPLACE INTO archive.delivery_visits ({VISIT_FIELDS}) "
+                    f"SELECT {VISIT_FIELDS} FROM main.delivery_visits WHERE delivery_id IN temp.archive_batch"
+                ).rowcount
+            with conn:
+                conn.execute("DELETE FROM main.delivery_visits WHERE delivery_id IN temp.archive_batch")
+                moved["deliveries"] += conn.execute(
+                    "DELETE FROM main.deliveries WHERE id IN temp.archive_batch"
+                ).rowcount
+    finally:
+        conn.close()
+    return moved
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", type=Path, default=database.DB_PATH)
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="minimum age in days")
+    args = parser.parse_args(argv)
+
+    database.DB_PATH = args.db
+    print(json.dumps(archive_completed(days=args.days)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,325 @@
+"""Online snapshots of the database and its archive with the SQLite backup API.
+
+A snapshot copies ``BACKUP_PAGES_PER_STEP`` pages at a time from one WAL
+read snapshot and pauses between steps, so location writes are neither
+blocked nor starved of I/O while it runs. Each snapshot is written into
+``<BACKUP_DIR>/<id>.partial/`` and renamed to ``<BACKUP_DIR>/<id>/`` only after
+every file passed verification: it is opened read-only, must pass
+``PRAGMA integrity_check`` and have its tables readable. ``manifest.json``
+records the sizes, row counts and check results. Only the newest
+``BACKUP_KEEP`` snapshots are kept. Copies are not fsynced; the operating
+system writes them out in the background.
+
+The server takes a snapshot every ``BACKUP_INTERVAL_SECONDS``
+(``0`` disables it). ``python -m backend.backups`` takes, lists or verifies
+snapshots from the command line.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+if __package__ in (None, ""):
+    import database
+    from archive import archive_path
+    from settings import env_float, env_int
+else:
+    from . import database
+    from .archive import archive_path
+    from .settings import env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+BACKUP_INTERVAL_SECONDS = env_int("BACKUP_INTERVAL_SECONDS", 86400)
+BACKUP_KEEP = env_int("BACKUP_KEEP", 7)
+BACKUP_PAGES_PER_STEP = env_int("BACKUP_PAGES_PER_STEP", 256)
+BACKUP_STEP_PAUSE_SECONDS = env_float("BACKUP_STEP_PAUSE_SECONDS", 0.005)
+
+ID_FORMAT = "%Y%m%dT%H%M%S%fZ"
+PARTIAL_SUFFIX = ".partial"
+MANIFEST = "manifest.json"
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def backup_dir() -> Path:
+    configured = os.getenv("BACKUP_DIR")
+    if configured:
+        return Path(configured)
+    return Path(database.DB_PATH).parent / "backups"
+
+
+def copy_database(
+    source: Path,
+    target: Path,
+    pages: int = BACKUP_PAGES_PER_STEP,
+    pause: float = BACKUP_STEP_PAUSE_SECONDS,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Dict[str, int]:
+    """Copy ``source`` into ``target`` in steps of ``pages`` pages.
+
+    The copy is the state of ``source`` when it started. ``progress(remaining,
+    total)`` is called after every step. Returns the page count of the copy.
+    """
+
+    src = sqlite3.connect(source, isolation_level=None)
+    target.unlink(missing_ok=True)
+    dst = sqlite3.connect(target)
+    try:
+        # An open read transaction pins one WAL snapshot: writers keep going
+        # and SQLite never has to restart the copy because of their commits.
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        # One fsync of the whole copy at the end would stall the writers' own.
+        dst.execute("PRAGMA synchronous = OFF")
+
+        def step(status: int, remaining: int, total: int) -> None:
+            if progress is not None:
+                progress(remaining, total)
+            if pause > 0 and remaining:
+                time.sleep(pause)
+
+        src.backup(dst, pages=pages, progress=step)
+        src.execute("COMMIT")
+        # The copy inherits WAL mode; without it the file stands alone and
+        # restoring it is a plain file copy.
+        dst.execute("PRAGMA journal_mode = DELETE")
+        return {"pages": dst.execute("PRAGMA page_count").fetchone()[0]}
+    finally:
+        dst.close()
+        src.close()
+
+
+def verify_backup(path: Path) -> Dict[str, Any]:
+    """Open ``path`` read-only and check that it is a usable database.
+
+    Returns ``ok``, the ``PRAGMA integrity_check`` messages and the row
+    count of every table, which also proves each table can be read back.
+    """
+
+    result: Dict[str, Any] = {"file": path.name, "ok": False, "integrity": [], "tables": {}}
+    try:
+        conn = sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True)
+    except sqlite3.Error as exc:
+        result["integrity"] = [str(exc)]
+        return result
+    try:
+        integrity = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+        tables = [
+            row[0]
+            for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+                "AND sql NOT LIKE 'CREATE VIRTUAL TABLE%' ORDER BY name"
+            )
+        ]
+        for table in tables:
+            result["tables"][table] = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+    except sqlite3.Error as exc:
+        integrity = [str(exc)]
+    finally:
+        conn.close()
+    result["integrity"] = integrity
+    result["ok"] = integrity == ["ok"]
+    return result
+
+
+def list_backups(directory: Optional[Path] = None) -> List[Dict[str, Any]]:
+    """Manifests of the finished snapshots, newest first."""
+
+    directory = directory or backup_dir()
+    if not directory.is_dir():
+        return []
+    manifests = []
+    for entry in sorted(directory.iterdir(), reverse=True):
+        manifest = entry / MANIFEST
+        if entry.is_dir() and not entry.name.endswith(PARTIAL_SUFFIX) and manifest.is_file():
+            manifests.append(json.loads(manifest.read_text(encoding="utf-8")))
+    return manifests
+
+
+def verify_snapshot(backup_id: str, directory: Optional[Path] = None) -> Optional[Dict[str, Any]]:
+    """Verify every file of snapshot ``backup_id`` again; ``None`` if unknown."""
+
+    snapshot = (directory or backup_dir()) / backup_id
+    if Path(backup_id).name != backup_id or not (snapshot / MANIFEST).is_file():
+        return None
+    manifest = json.loads((snapshot / MANIFEST).read_text(encoding="utf-8"))
+    checks = [verify_backup(snapshot / item["file"]) for item in manifest["files"]]
+    return {"id": backup_id, "ok": all(check["ok"] for check in checks), "files": checks}
+
+
+@dataclass
+class BackupRun:
+    id: str
+    started_at: float
+    status: str = RUNNING
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    current_file: Optional[str] = None
+    remaining_pages: Optional[int] = None
+    total_pages: Optional[int] = None
+    manifest: Optional[Dict[str, Any]] = field(default=None, repr=False)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "file": self.current_file,
+            "remaining_pages": self.remaining_pages,
+            "total_pages": self.total_pages,
+            "elapsed_ms": round(((self.finished_at or time.monotonic()) - self.started_at) * 1000, 1),
+        }
+
+
+class BackupManager:
+    """Take one snapshot at a time, in the caller's thread or in the background."""
+
+    def __init__(self, keep: int = BACKUP_KEEP, interval: float = BACKUP_INTERVAL_SECONDS) -> None:
+        self.keep = max(1, keep)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._current: Optional[BackupRun] = None
+        self._last: Optional[BackupRun] = None
+
+    def start(self) -> Optional[BackupRun]:
+        """Take a snapshot in a background thread; ``None`` if one is already running."""
+
+        run = self._begin()
+        if run is None:
+            return None
+        threading.Thread(target=self._take, args=(run,), name="backup", daemon=True).start()
+        return run
+
+    def run(self) -> Optional[BackupRun]:
+        """Take a snapshot now; ``None`` if one is already running."""
+
+        run = self._begin()
+        if run is not None:
+            self._take(run)
+        return run
+
+    def run_if_due(self) -> Optional[BackupRun]:
+        """Take a snapshot unless the newest one is younger than the interval."""
+
+        newest = list_backups()
+        if newest:
+            created = datetime.strptime(newest[0]["id"], ID_FORMAT).replace(tzinfo=timezone.utc)
+            if (datetime.now(timezone.utc) - created).total_seconds() < self.interval:
+                return None
+        return self.run()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            current, last = self._current, self._last
+        return {
+            "running": current.describe() if current else None,
+            "last": last.describe() if last else None,
+            "backups": list_backups(),
+        }
+
+    def _begin(self) -> Optional[BackupRun]:
+        with self._lock:
+            if self._current is not None:
+                return None
+            backup_id = datetime.now(timezone.utc).strftime(ID_FORMAT)
+            self._current = BackupRun(id=backup_id, started_at=time.monotonic())
+            return self._current
+
+    def _take(self, run: BackupRun) -> None:
+        try:
+            run.manifest = self._snapshot(run)
+            run.status = DONE
+        except Exception as exc:  # noqa: BLE001 - reported through the run status
+            logger.exception("Falha no backup %s", run.id)
+            run.error = str(exc) or exc.__class__.__name__
+            run.status = FAILED
+        finally:
+            run.finished_at = time.monotonic()
+            run.current_file = run.remaining_pages = run.total_pages = None
+            with self._lock:
+                self._current = None
+                self._last = run
+
+    def _snapshot(self, run: BackupRun) -> Dict[str, Any]:
+        directory = backup_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        for stale in directory.glob(f"*{PARTIAL_SUFFIX}"):
+            shutil.rmtree(stale, ignore_errors=True)
+        partial = directory / f"{run.id}{PARTIAL_SUFFIX}"
+        partial.mkdir()
+        try:
+            sources = [Path(database.DB_PATH)]
+            if archive_path().exists():
+                sources.append(archive_path())
+            files = []
+            for source in sources:
+                run.current_file = source.name
+                target = partial / source.name
+
+                def progress(remaining: int, total: int) -> None:
+                    run.remaining_pages, run.total_pages = remaining, total
+
+                copied = copy_database(source, target, progress=progress)
+                check = verify_backup(target)
+                if not check["ok"]:
+                    raise RuntimeError(f"Backup de {source.name} inválido: {'; '.join(check['integrity'])}")
+                files.append({"size": target.stat().st_size, **copied, **check})
+            manifest = {
+                "id": run.id,
+                "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+                "duration_ms": round((time.monotonic() - run.started_at) * 1000, 1),
+                "files": files,
+            }
+            (partial / MANIFEST).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+            partial.rename(directory / run.id)
+        except BaseException:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        self._rotate(directory)
+        return manifest
+
+    def _rotate(self, directory: Path) -> None:
+        for manifest in list_backups(directory)[self.keep :]:
+            shutil.rmtree(directory / manifest["id"], ignore_errors=True)
+
+
+BACKUPS = BackupManager()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", type=Path, default=database.DB_PATH)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--list", action="store_true", help="list the kept snapshots")
+    group.add_argument("--verify", metavar="ID", help="verify an existing snapshot again")
+    args = parser.parse_args(argv)
+
+    database.DB_PATH = args.db
+    if args.list:
+        print(json.dumps(list_backups(), indent=2))
+        return 0
+    if args.verify:
+        result = verify_snapshot(args.verify)
+        print(json.dumps(result, indent=2))
+        return 0 if result and result["ok"] else 1
+    run = BACKUPS.run()
+    print(json.dumps(run.describe() if run else None, indent=2))
+    return 0 if run and run.status == DONE else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,190 @@
+"""Parsing and validation for bulk client and delivery imports."""
+
+from __future__ import annotations
+
+import csv
+import io
+import json
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+MAX_BULK_ROWS = 20000
+MAX_RECURRING_DAYS = 92
+
+RowErrors = List[Dict[str, Any]]
+
+
+def parse_records(body: bytes, content_type: Optional[str]) -> Any:
+    """Decode a bulk upload as CSV or JSON depending on ``content_type``."""
+
+    text = body.decode("utf-8-sig")
+    if content_type and content_type.split(";")[0].strip().lower() == "text/csv":
+        return [
+            {key.strip(): (value.strip() if isinstance(value, str) else value) for key, value in row.items() if key}
+            for row in csv.DictReader(io.StringIO(text))
+        ]
+    try:
+        return json.loads(text) if text.strip() else []
+    except json.JSONDecodeError:
+        raise ValueError("Corpo deve ser um JSON válido ou CSV (Content-Type: text/csv)") from None
+
+
+def _ensure_record_list(records: Any) -> List[Dict[str, Any]]:
+    if isinstance(records, dict) and isinstance(records.get("rows"), list):
+        records = records["rows"]
+    if not isinstance(records, list):
+        raise ValueError("Envie uma lista de registros")
+    if len(records) > MAX_BULK_ROWS:
+        raise ValueError(f"Máximo de {MAX_BULK_ROWS} registros por importação")
+    return records
+
+
+def _blank(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _parse_coordinate(value: Any, limit: float) -> float:
+    number = float(value)
+    if not -limit <= number <= limit:
+        raise ValueError
+    return number
+
+
+def validate_clients(records: Any) -> Tuple[List[Tuple[Any, ...]], RowErrors]:
+    """Return insert-ready client tuples and the errors found per row."""
+
+    rows: List[Tuple[Any, ...]] = []
+    errors: RowErrors = []
+    for index, record in enumerate(_ensure_record_list(records)):
+        if not isinstance(record, dict):
+            errors.append({"row": index, "error": "Registro deve ser um objeto"})
+            continue
+        name = record.get("name")
+        if _blank(name):
+            errors.append({"row": index, "error": "name é obrigatório"})
+            continue
+        coordinates: List[Optional[float]] = []
+        for field, limit in (("latitude", 90.0), ("longitude", 180.0)):
+            value = record.get(field)
+            if _blank(value):
+                coordinates.append(None)
+                continue
+            try:
+                coordinates.append(_parse_coordinate(value, limit))
+            except (TypeError, ValueError):
+                errors.append({"row": index, "error": f"{field} inválida"})
+                break
+        else:
+            if (coordinates[0] is None) != (coordinates[1] is None):
+                errors.append({"row": index, "error": "Informe latitude e longitude juntas"})
+                continue
+            rows.append(
+                (
+                    str(name).strip(),
+                    record.get("phone") or None,
+                    record.get("address") or None,
+                    coordinates[0],
+                    coordinates[1],
+                    record.get("notes") or None,
+                )
+            )
+    return rows, errors
+
+
+def expand_recurring_deliveries(spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Expand a recurring schedule into one delivery record per client and day.
+
+    ``spec`` holds ``client_ids``, ``start_date``, ``days`` and optionally
+    ``weekdays`` (0 = segunda), ``quantity`` and ``notes``.
+    """
+
+    if not isinstance(spec, dict):
+        raise ValueError("recurring deve ser um objeto")
+    client_ids = spec.get("client_ids")
+    if not isinstance(client_ids, list) or not client_ids:
+        raise ValueError("client_ids é obrigatório na recorrência")
+    try:
+        start = date.fromisoformat(str(spec.get("start_date")))
+    except ValueError:
+        raise ValueError("start_date deve estar no formato AAAA-MM-DD") from None
+    try:
+        days = int(spec.get("days", 7))
+    except (TypeError, ValueError):
+        raise ValueError("days deve ser numérico") from None
+    if not 1 <= days <= MAX_RECURRING_DAYS:
+        raise ValueError(f"days deve estar entre 1 e {MAX_RECURRING_DAYS}")
+    weekdays = spec.get("weekdays")
+    allowed: Optional[Set[int]] = None
+    if weekdays is not None:
+        try:
+            if not isinstance(weekdays, list):
+                raise TypeError
+            allowed = {int(day) for day in weekdays}
+        except (TypeError, ValueError):
+            raise ValueError("weekdays deve ser uma lista de números de 0 a 6") from None
+        if not allowed <= set(range(7)):
+            raise ValueError("weekdays deve ser uma lista de números de 0 a 6")
+
+    records: List[Dict[str, Any]] = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        if allowed is not None and day.weekday() not in allowed:
+            continue
+        for client_id in client_ids:
+            records.append(
+                {
+                    "client_id": client_id,
+                    "scheduled_date": day.isoformat(),
+                    "quantity": spec.get("quantity"),
+                    "notes": spec.get("notes"),
+                }
+            )
+    return records
+
+
+def validate_deliveries(
+    records: Any,
+    known_client_ids: Iterable[int],
+) -> Tuple[List[Tuple[Any, ...]], RowErrors]:
+    """Return insert-ready delivery tuples and the errors found per row."""
+
+    if isinstance(records, dict) and "recurring" in records:
+        records = expand_recurring_deliveries(records["recurring"])
+    known = set(known_client_ids)
+    rows: List[Tuple[Any, ...]] = []
+    errors: RowErrors = []
+    for index, record in enumerate(_ensure_record_list(records)):
+        if not isinstance(record, dict):
+            errors.append({"row": index, "error": "Registro deve ser um objeto"})
+            continue
+        try:
+            client_id = int(record.get("client_id"))
+        except (TypeError, ValueError):
+            errors.append({"row": index, "error": "client_id é obrigatório"})
+            continue
+        if client_id not in known:
+            errors.append({"row": index, "error": f"Cliente {client_id} não encontrado"})
+            continue
+        try:
+            scheduled = date.fromisoformat(str(record.get("scheduled_date"))).isoformat()
+        except ValueError:
+            errors.append({"row": index, "error": "scheduled_date deve estar no formato AAAA-MM-DD"})
+            continue
+        quantity = record.get("quantity")
+        if _blank(quantity):
+            quantity = None
+        else:
+            try:
+                number = float(quantity)
+                quantity = int(number)
+            except (TypeError, ValueError, OverflowError):
+                errors.append({"row": index, "error": "quantity deve ser numérica"})
+                continue
+            if number != quantity:
+                errors.append({"row": index, "error": "quantity deve ser um número inteiro"})
+                continue
+            if quantity < 0:
+                errors.append({"row": index, "error": "quantity não pode ser negativa"})
+                continue
+        rows.append((client_id, scheduled, quantity, record.get("notes") or None))
+    return rows, errors
@@ -0,0 +1,62 @@
+"""Prefix search over client names, addresses and notes.
+
+Backed by the ``clients_fts`` FTS5 index, which triggers keep in step with
+``clients``. Every word typed must match the start of some word of the
+client, ignoring case and accents ("pad ideal" finds "Padaria Ideal").
+Matches in the name rank above matches in the address, then the notes.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Dict, List, Optional
+
+if __package__ in (None, ""):
+    from database import fetch_all
+    from settings import env_int
+else:
+    from .database import fetch_all
+    from .settings import env_int
+
+CLIENT_SEARCH_LIMIT = env_int("CLIENT_SEARCH_LIMIT", 20)
+CLIENT_SEARCH_MAX_LIMIT = 100
+MAX_TERMS = 8
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def build_match_query(text: str) -> Optional[str]:
+    """FTS5 query matching every word of ``text`` as a prefix; ``None`` if empty.
+
+    Words are quoted, so operators and punctuation typed by the user are
+    never interpreted as FTS5 syntax.
+    """
+
+    terms = _WORD.findall(text or "")[:MAX_TERMS]
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def parse_limit(value: Optional[str]) -> int:
+    if value in (None, ""):
+        return CLIENT_SEARCH_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= CLIENT_SEARCH_MAX_LIMIT:
+        raise ValueError(f"limit deve estar entre 1 e {CLIENT_SEARCH_MAX_LIMIT}")
+    return limit
+
+
+def search_clients(text: str, limit: int = CLIENT_SEARCH_LIMIT) -> List[Dict]:
+    match = build_match_query(text)
+    if match is None:
+        return []
+    # ``rank`` is bm25 with the column weights configured in database.py.
+    return fetch_all(
+        "SELECT clients.* FROM clients_fts JOIN clients ON clients.id = clients_fts.rowid "
+        "WHERE clients_fts MATCH ? ORDER BY clients_fts.rank LIMIT ?",
+        (match, limit),
+    )
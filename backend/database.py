@@ -3,10 +3,17 @@
 from __future__ import annotations
 
 import sqlite3
+import time
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 DB_PATH = Path(__file__).resolve().parent / "delivery.db"
+FETCH_BATCH_SIZE = 500
+
+Connector = Callable[[], sqlite3.Connection]
+QueryObserver = Callable[[str, Tuple[Any, ...], float, Connector], None]
+_query_observers: List[QueryObserver] = []
 
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS clients (
@@ -33,7 +40,7 @@ CREATE TABLE IF NOT EXISTS deliveries (
 
 CREATE TABLE IF NOT EXISTS driver_positions (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    timestamp TEXT DEFAULT (datetime('now')),
+    recorded_ms INTEGER DEFAULT (CAST(ROUND((julianday('now') - 2440587.5) * 86400000) AS INTEGER)),
     latitude REAL NOT NULL,
     longitude REAL NOT NULL
 );
@@ -42,8 +49,8 @@ CREATE TABLE IF NOT EXISTS delivery_visits (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     delivery_id INTEGER,
     client_id INTEGER,
-    detected_at TEXT DEFAULT (datetime('now')),
-    confirmed_at TEXT,
+    detected_ms INTEGER DEFAULT (CAST(ROUND((julianday('now') - 2440587.5) * 86400000) AS INTEGER)),
+    confirmed_ms INTEGER,
     stay_seconds INTEGER,
     quantity INTEGER,
     notes TEXT,
@@ -51,6 +58,269 @@ CREATE TABLE IF NOT EXISTS delivery_visits (
     FOREIGN KEY (delivery_id) REFERENCES deliveries(id),
     FOREIGN KEY (client_id) REFERENCES clients(id)
 );
+
+CREATE TABLE IF NOT EXISTS client_distances (
+    origin_id INTEGER NOT NULL,
+    destination_id INTEGER NOT NULL,
+    distance_km REAL NOT NULL,
+    duration_seconds REAL,
+    return_duration_seconds REAL,
+    PRIMARY KEY (origin_id, destination_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS travel_leg_stats (
+    origin_id INTEGER NOT NULL,
+    destination_id INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    samples INTEGER NOT NULL,
+    total_seconds REAL NOT NULL,
+    PRIMARY KEY (origin_id, destination_id, hour)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS travel_speed_stats (
+    hour INTEGER PRIMARY KEY,
+    total_km REAL NOT NULL,
+    total_seconds REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS travel_model_state (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS route_plans (
+    plan_date TEXT PRIMARY KEY,
+    inputs_hash TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    computed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS geocode_cache (
+    address_key TEXT PRIMARY KEY,
+    latitude REAL,
+    longitude REAL,
+    provider TEXT NOT NULL,
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS change_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    operation TEXT NOT NULL,
+    changed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS delivery_rollups (
+    period TEXT NOT NULL,
+    period_start TEXT NOT NULL,
+    client_id INTEGER NOT NULL,
+    arrival_hour INTEGER NOT NULL,
+    deliveries INTEGER NOT NULL,
+    breads INTEGER NOT NULL,
+    stay_count INTEGER NOT NULL,
+    stay_total INTEGER NOT NULL,
+    PRIMARY KEY (period, period_start, client_id, arrival_hour)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_client_distances_destination ON client_distances(destination_id);
+CREATE INDEX IF NOT EXISTS idx_deliveries_scheduled_date ON deliveries(scheduled_date);
+"""
+
+# Indexes and views on tables that migrations may rebuild; created after them.
+# Timestamps of driver_positions and delivery_visits are integer milliseconds
+# since the Unix epoch (UTC). The *_iso views add the ISO text columns the API
+# and exports always returned.
+POST_MIGRATION_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_driver_positions_recorded_ms ON driver_positions(recorded_ms);
+CREATE INDEX IF NOT EXISTS idx_delivery_visits_detected_ms ON delivery_visits(detected_ms);
+CREATE INDEX IF NOT EXISTS idx_delivery_visits_delivery_id ON delivery_visits(delivery_id);
+
+CREATE VIEW IF NOT EXISTS driver_positions_iso AS
+SELECT
+    id,
+    recorded_ms,
+    datetime(recorded_ms / 1000, 'unixepoch') AS timestamp,
+    latitude,
+    longitude
+FROM driver_positions;
+
+CREATE VIEW IF NOT EXISTS delivery_visits_iso AS
+SELECT
+    id,
+    delivery_id,
+    client_id,
+    detected_ms,
+    datetime(detected_ms / 1000, 'unixepoch') AS detected_at,
+    confirmed_ms,
+    datetime(confirmed_ms / 1000, 'unixepoch') AS confirmed_at,
+    stay_seconds,
+    quantity,
+    notes,
+    status
+FROM delivery_visits;
+"""
+
+# Full-text index over the searchable client fields. External content: the
+# text lives only in ``clients``; the triggers below keep the index in step.
+# ``rank`` weighs matches in the name above the address, then the notes.
+CLIENT_SEARCH_INDEX = """
+CREATE VIRTUAL TABLE clients_fts USING fts5(
+    name,
+    address,
+    notes,
+    content = 'clients',
+    content_rowid = 'id',
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+INSERT INTO clients_fts (clients_fts, rank) VALUES ('rank', 'bm25(10.0, 3.0, 1.0)');
+"""
+
+# Created after the column migrations so they can reference every column.
+TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS trg_clients_coordinates_changed
+AFTER UPDATE OF latitude, longitude ON clients
+WHEN OLD.latitude IS NOT NEW.latitude OR OLD.longitude IS NOT NEW.longitude
+BEGIN
+    DELETE FROM client_distances WHERE origin_id = NEW.id OR destination_id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_clients_deleted_distances
+AFTER DELETE ON clients
+BEGIN
+    DELETE FROM client_distances WHERE origin_id = OLD.id OR destination_id = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_clients_log_insert
+AFTER INSERT ON clients
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation) VALUES ('clients', NEW.id, 'upsert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_clients_log_update
+AFTER UPDATE ON clients
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation) VALUES ('clients', NEW.id, 'upsert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_clients_log_delete
+AFTER DELETE ON clients
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation) VALUES ('clients', OLD.id, 'delete');
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_deliveries_log_insert
+AFTER INSERT ON deliveries
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation) VALUES ('deliveries', NEW.id, 'upsert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_deliveries_log_update
+AFTER UPDATE ON deliveries
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation) VALUES ('deliveries', NEW.id, 'upsert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_deliveries_log_delete
+AFTER DELETE ON deliveries
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation) VALUES ('deliveries', OLD.id, 'delete');
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_clients_fts_insert
+AFTER INSERT ON clients
+BEGIN
+    INSERT INTO clients_fts (rowid, name, address, notes) VALUES (NEW.id, NEW.name, NEW.address, NEW.notes);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_clients_fts_update
+AFTER UPDATE OF name, address, notes ON clients
+BEGIN
+    INSERT INTO clients_fts (clients_fts, rowid, name, address, notes)
+    VALUES ('delete', OLD.id, OLD.name, OLD.address, OLD.notes);
+    INSERT INTO clients_fts (rowid, name, address, notes) VALUES (NEW.id, NEW.name, NEW.address, NEW.notes);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_clients_fts_delete
+AFTER DELETE ON clients
+BEGIN
+    INSERT INTO clients_fts (clients_fts, rowid, name, address, notes)
+    VALUES ('delete', OLD.id, OLD.name, OLD.address, OLD.notes);
+END;
+"""
+
+# Rollup rows a completion counts in: its day and the Monday of its week.
+ROLLUP_PERIODS = (
+    ("day", "{row}.scheduled_date"),
+    ("week", "date({row}.scheduled_date, '-6 days', 'weekday 1')"),
+)
+
+
+def _rollup_statements(row: str, sign: str) -> str:
+    """Trigger statements adding (``+``) or taking back (``-``) ``row`` when completed."""
+
+    hour = f"COALESCE(CAST(strftime('%H', COALESCE({row}.arrived_at, {row}.completed_at)) AS INTEGER), -1)"
+    factor = "-" if sign == "-" else ""
+    statements = []
+    for period, start in ROLLUP_PERIODS:
+        start = start.format(row=row)
+        statements.append(
+            f"""
+    INSERT INTO delivery_rollups (
+        period, period_start, client_id, arrival_hour, deliveries, breads, stay_count, stay_total
+    )
+    SELECT
+        '{period}',
+        {start},
+        {row}.client_id,
+        {hour},
+        {factor}1,
+        {factor}COALESCE({row}.quantity, 0),
+        {factor}({row}.stay_seconds IS NOT NULL),
+        {factor}COALESCE({row}.stay_seconds, 0)
+    WHERE {row}.status = 'completed'
+    ON CONFLICT(period, period_start, client_id, arrival_hour) DO UPDATE SET
+        deliveries = deliveries + excluded.deliveries,
+        breads = breads + excluded.breads,
+        stay_count = stay_count + excluded.stay_count,
+        stay_total = stay_total + excluded.stay_total;"""
+        )
+        if factor:
+            statements.append(
+                f"""
+    DELETE FROM delivery_rollups
+    WHERE period = '{period}' AND period_start = {start} AND client_id = {row}.client_id
+        AND arrival_hour = {hour} AND deliveries = 0;"""
+            )
+    return "".join(statements)
+
+
+# Completions are added to the daily and weekly rollups. Corrections of a
+# completed delivery (a second /complete, a new quantity or stay) take the old
+# values back before adding the new ones. Archiving or deleting a completed
+# delivery keeps it in the history, so deletes are not tracked.
+ROLLUP_TRIGGERS = f"""
+CREATE TRIGGER IF NOT EXISTS trg_deliveries_rollup_insert
+AFTER INSERT ON deliveries
+WHEN NEW.status = 'completed'
+BEGIN{_rollup_statements("NEW", "+")}
+END;
+
+-- Replaced by trg_deliveries_rollup_change, which also handles corrections.
+DROP TRIGGER IF EXISTS trg_deliveries_rollup_update;
+
+CREATE TRIGGER IF NOT EXISTS trg_deliveries_rollup_change
+AFTER UPDATE OF status, client_id, scheduled_date, quantity, arrived_at, completed_at, stay_seconds ON deliveries
+WHEN OLD.status = 'completed' OR NEW.status = 'completed'
+BEGIN{_rollup_statements("OLD", "-")}{_rollup_statements("NEW", "+")}
+END;
 """
 
 IDEAL_SUPERMARKETS = (
@@ -97,6 +367,43 @@ IDEAL_SUPERMARKETS = (
 )
 
 
+def add_query_observer(observer: QueryObserver) -> None:
+    """Register ``observer(query, params, seconds, connect)`` to run after each statement.
+
+    ``connect`` opens a connection like the one the statement ran on, so
+    statements over the archive's TEMP views can be explained again.
+    """
+
+    if observer not in _query_observers:
+        _query_observers.append(observer)
+
+
+def remove_query_observer(observer: QueryObserver) -> None:
+    if observer in _query_observers:
+        _query_observers.remove(observer)
+
+
+def _notify_observers(query: str, params: Tuple[Any, ...], seconds: float, connect: Connector) -> None:
+    for observer in tuple(_query_observers):
+        observer(query, params, seconds, connect)
+
+
+def epoch_ms(moment: Optional[datetime] = None) -> int:
+    """Milliseconds since the Unix epoch; naive datetimes are taken as UTC."""
+
+    if moment is None:
+        return time.time_ns() // 1_000_000
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return round(moment.timestamp() * 1000)
+
+
+def iso_from_ms(value: int) -> str:
+    """``value`` in the ``datetime('now')`` text format."""
+
+    return datetime.fromtimestamp(value / 1000, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
 def get_connection() -> sqlite3.Connection:
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
@@ -106,43 +413,134 @@ def get_connection() -> sqlite3.Connection:
 def initialize() -> None:
     conn = get_connection()
     try:
+        # Readers, including online backups, then never block location writes.
+        conn.execute("PRAGMA journal_mode = WAL")
         conn.executescript(SCHEMA)
         ensure_delivery_tracking_columns(conn)
         ensure_client_coordinate_columns(conn)
+        ensure_epoch_timestamp_columns(conn)
+        ensure_distance_duration_columns(conn)
+        conn.executescript(POST_MIGRATION_SCHEMA)
+        ensure_client_search_index(conn)
+        conn.executescript(TRIGGERS)
+        conn.executescript(ROLLUP_TRIGGERS)
         seed_initial_clients(conn)
         conn.commit()
     finally:
         conn.close()
 
 
-def fetch_all(query: str, params: Iterable[Any] = ()) -> List[Dict[str, Any]]:
-    conn = get_connection()
+def fetch_all(
+    query: str,
+    params: Iterable[Any] = (),
+    connect: Optional[Connector] = None,
+) -> List[Dict[str, Any]]:
+    params = tuple(params)
+    started = time.perf_counter() if _query_observers else None
+    conn = (connect or get_connection)()
     try:
-        cur = conn.execute(query, tuple(params))
+        cur = conn.execute(query, params)
         rows = [dict(row) for row in cur.fetchall()]
         return rows
     finally:
         conn.close()
+        if started is not None:
+            _notify_observers(query, params, time.perf_counter() - started, connect or get_connection)
 
 
-def fetch_one(query: str, params: Iterable[Any]) -> Optional[Dict[str, Any]]:
-    conn = get_connection()
+def iter_rows(
+    query: str,
+    params: Iterable[Any] = (),
+    batch_size: int = FETCH_BATCH_SIZE,
+    connect: Optional[Connector] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Yield rows lazily, pulling ``batch_size`` rows at a time from the cursor.
+
+    The connection stays open until the generator is exhausted or closed, so
+    callers streaming a response should close it when they stop early.
+    ``connect`` replaces :func:`get_connection`, e.g. to attach the archive.
+    """
+
+    params = tuple(params)
+    observed = bool(_query_observers)
+    # Only time spent inside SQLite counts; consumers may pause between batches.
+    elapsed = 0.0
+    conn = (connect or get_connection)()
+    try:
+        started = time.perf_counter()
+        cur = conn.execute(query, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            elapsed += time.perf_counter() - started
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+            started = time.perf_counter()
+    finally:
+        conn.close()
+        if observed:
+            _notify_observers(query, params, elapsed, connect or get_connection)
+
+
+def fetch_one(
+    query: str,
+    params: Iterable[Any],
+    connect: Optional[Connector] = None,
+) -> Optional[Dict[str, Any]]:
+    params = tuple(params)
+    started = time.perf_counter() if _query_observers else None
+    conn = (connect or get_connection)()
     try:
-        cur = conn.execute(query, tuple(params))
+        cur = conn.execute(query, params)
         row = cur.fetchone()
         return dict(row) if row else None
     finally:
         conn.close()
+        if started is not None:
+            _notify_observers(query, params, time.perf_counter() - started, connect or get_connection)
 
 
 def execute(query: str, params: Iterable[Any] = ()) -> int:
+    params = tuple(params)
+    started = time.perf_counter() if _query_observers else None
     conn = get_connection()
     try:
-        cur = conn.execute(query, tuple(params))
+        cur = conn.execute(query, params)
         conn.commit()
         return cur.lastrowid
     finally:
         conn.close()
+        if started is not None:
+            _notify_observers(query, params, time.perf_counter() - started, get_connection)
+
+
+def execute_many(query: str, rows: Iterable[Iterable[Any]]) -> int:
+    """Run ``query`` for every row inside a single transaction.
+
+    Returns the number of affected rows; nothing is written if any row fails.
+    Observers get the first row as the statement's parameters.
+    """
+
+    started = time.perf_counter() if _query_observers else None
+    first: List[Tuple[Any, ...]] = []
+
+    def bound() -> Iterator[Tuple[Any, ...]]:
+        for row in rows:
+            row = tuple(row)
+            if not first:
+                first.append(row)
+            yield row
+
+    conn = get_connection()
+    try:
+        with conn:
+            cur = conn.executemany(query, bound())
+        return cur.rowcount
+    finally:
+        conn.close()
+        if started is not None:
+            _notify_observers(query, first[0] if first else (), time.perf_counter() - started, get_connection)
 
 
 def ensure_client_coordinate_columns(conn: sqlite3.Connection) -> None:
@@ -156,6 +554,16 @@ def ensure_client_coordinate_columns(conn: sqlite3.Connection) -> None:
         conn.execute("ALTER TABLE clients ADD COLUMN longitude REAL")
 
 
+def ensure_distance_duration_columns(conn: sqlite3.Connection) -> None:
+    # duration_seconds runs origin -> destination, the return column back.
+    columns = {
+        row["name"]
+        for row in conn.execute("PRAGMA table_info(client_distances)")
+    }
+    if "return_duration_seconds" not in columns:
+        conn.execute("ALTER TABLE client_distances ADD COLUMN return_duration_seconds REAL")
+
+
 def ensure_delivery_tracking_columns(conn: sqlite3.Connection) -> None:
     columns = {
         row["name"]
@@ -169,6 +577,85 @@ def ensure_delivery_tracking_columns(conn: sqlite3.Connection) -> None:
         conn.execute("ALTER TABLE deliveries ADD COLUMN stay_seconds INTEGER")
 
 
+def _text_to_ms(column: str) -> str:
+    return f"CAST(ROUND((julianday({column}) - 2440587.5) * 86400000) AS INTEGER)"
+
+
+def ensure_epoch_timestamp_columns(conn: sqlite3.Connection) -> None:
+    """Rebuild driver_positions and delivery_visits created with ISO text timestamps.
+
+    SQLite cannot change a column type in place, so each table is copied into
+    the current layout inside one transaction. Unparseable text becomes NULL.
+    """
+
+    position_columns = {row["name"] for row in conn.execute("PRAGMA table_info(driver_positions)")}
+    visit_columns = {row["name"] for row in conn.execute("PRAGMA table_info(delivery_visits)")}
+    if "timestamp" not in position_columns and "detected_at" not in visit_columns:
+        return
+
+    conn.execute("BEGIN")
+    try:
+        if "timestamp" in position_columns:
+            conn.execute(
+                """
+                CREATE TABLE driver_positions_migrated (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    recorded_ms INTEGER DEFAULT (CAST(ROUND((julianday('now') - 2440587.5) * 86400000) AS INTEGER)),
+                    latitude REAL NOT NULL,
+                    longitude REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "INSERT INTO driver_positions_migrated (id, recorded_ms, latitude, longitude) "
+                f"SELECT id, {_text_to_ms('timestamp')}, latitude, longitude FROM driver_positions"
+            )
+            conn.execute("DROP TABLE driver_positions")
+            conn.execute("ALTER TABLE driver_positions_migrated RENAME TO driver_positions")
+        if "detected_at" in visit_columns:
+            conn.execute(
+                """
+                CREATE TABLE delivery_visits_migrated (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    delivery_id INTEGER,
+                    client_id INTEGER,
+                    detected_ms INTEGER DEFAULT (CAST(ROUND((julianday('now') - 2440587.5) * 86400000) AS INTEGER)),
+                    confirmed_ms INTEGER,
+                    stay_seconds INTEGER,
+                    quantity INTEGER,
+                    notes TEXT,
+                    status TEXT NOT NULL DEFAULT 'detected',
+                    FOREIGN KEY (delivery_id) REFERENCES deliveries(id),
+                    FOREIGN KEY (client_id) REFERENCES clients(id)
+                )
+                """
+            )
+            conn.execute(
+                "INSERT INTO delivery_visits_migrated (id, delivery_id, client_id, detected_ms, confirmed_ms, "
+                "stay_seconds, quantity, notes, status) "
+                f"SELECT id, delivery_id, client_id, {_text_to_ms('detected_at')}, {_text_to_ms('confirmed_at')}, "
+                "stay_seconds, quantity, notes, status FROM delivery_visits"
+            )
+            conn.execute("DROP TABLE delivery_visits")
+            conn.execute("ALTER TABLE delivery_visits_migrated RENAME TO delivery_visits")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def ensure_client_search_index(conn: sqlite3.Connection) -> None:
+    """Create ``clients_fts`` and index the clients saved before it existed."""
+
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'clients_fts'"
+    ).fetchone()
+    if exists:
+        return
+    conn.executescript(CLIENT_SEARCH_INDEX)
+    conn.execute("INSERT INTO clients_fts (clients_fts) VALUES ('rebuild')")
+
+
 def seed_initial_clients(conn: sqlite3.Connection) -> None:
     for client in IDEAL_SUPERMARKETS:
         exists = conn.execute(
@@ -0,0 +1,197 @@
+"""Persistent client-to-client distance matrix backed by ``client_distances``.
+
+Pairs are stored once with ``origin_id < destination_id``. Measured travel
+times keep their direction: ``duration_seconds`` runs from origin to
+destination and ``return_duration_seconds`` back. Rows are filled lazily the
+first time a pair is needed and eagerly for a client whose coordinates were
+just saved; triggers in :mod:`database` drop the rows of a client whose
+coordinates change or who is deleted.
+"""
+
+from __future__ import annotations
+
+import threading
+from itertools import combinations, permutations
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+if __package__ in (None, ""):
+    from database import execute, execute_many, fetch_all
+    from routes_logic import DistanceMatrix, client_key, haversine_distance
+else:
+    from .database import execute, execute_many, fetch_all
+    from .routes_logic import DistanceMatrix, client_key, haversine_distance
+
+Pair = Tuple[int, int]
+Point = Tuple[float, float]
+
+# SQLite caps the number of bound parameters per statement.
+MAX_IN_PARAMS = 400
+
+
+def _pair(first: int, second: int) -> Pair:
+    return (first, second) if first <= second else (second, first)
+
+
+def _chunks(values: Sequence[int], size: int) -> Iterable[Sequence[int]]:
+    for offset in range(0, len(values), size):
+        yield values[offset : offset + size]
+
+
+class DistanceMatrixStore:
+    """Process-wide cache in front of the ``client_distances`` table."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._distances: Dict[Pair, float] = {}
+        # Keyed by (origin, destination) in the direction travelled.
+        self._durations: Dict[Pair, float] = {}
+        self._coordinates: Dict[int, Point] = {}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._distances.clear()
+            self._durations.clear()
+            self._coordinates.clear()
+
+    def matrix_for(self, clients: Iterable[Dict]) -> DistanceMatrix:
+        """Return a dense matrix covering every client with coordinates."""
+
+        points: Dict[int, Point] = {}
+        for client in clients:
+            identifier = client_key(client)
+            if identifier is None or client.get("latitude") is None or client.get("longitude") is None:
+                continue
+            points[identifier] = (float(client["latitude"]), float(client["longitude"]))
+        ids = sorted(points)
+
+        with self._lock:
+            for identifier, point in points.items():
+                known = self._coordinates.get(identifier)
+                if known is not None and known != point:
+                    self._forget_locked(identifier)
+                self._coordinates[identifier] = point
+            missing = [pair for pair in combinations(ids, 2) if pair not in self._distances]
+
+        if missing:
+            self._load(sorted({identifier for pair in missing for identifier in pair}))
+            with self._lock:
+                missing = [pair for pair in missing if pair not in self._distances]
+            if missing:
+                computed = [(a, b, haversine_distance(points[a], points[b])) for a, b in missing]
+                execute_many(
+                    "INSERT OR IGNORE INTO client_distances (origin_id, destination_id, distance_km) VALUES (?, ?, ?)",
+                    computed,
+                )
+                with self._lock:
+                    for a, b, distance in computed:
+                        self._distances[(a, b)] = distance
+
+        with self._lock:
+            distances = self._distances
+
+            def distance(a: int, b: int) -> float:
+                value = distances.get(_pair(a, b))
+                if value is None:
+                    # Dropped by a concurrent refresh_client/forget_client since
+                    # the fill above; this call's own coordinates still hold.
+                    value = haversine_distance(points[a], points[b])
+                return value
+
+            rows = [[0.0 if a == b else distance(a, b) for b in ids] for a in ids]
+            durations = {
+                pair: self._durations[pair]
+                for pair in permutations(ids, 2)
+                if pair in self._durations
+            }
+        return DistanceMatrix(ids, rows, durations)
+
+    def _load(self, ids: Sequence[int]) -> None:
+        """Pull stored rows touching ``ids`` into memory."""
+
+        wanted = set(ids)
+        for chunk in _chunks(list(ids), MAX_IN_PARAMS):
+            placeholders = ",".join(["?"] * len(chunk))
+            rows = fetch_all(
+                "SELECT origin_id, destination_id, distance_km, duration_seconds, return_duration_seconds "
+                "FROM client_distances "
+                f"WHERE origin_id IN ({placeholders})",
+                chunk,
+            )
+            with self._lock:
+                for row in rows:
+                    if row["destination_id"] not in wanted:
+                        continue
+                    pair = (row["origin_id"], row["destination_id"])
+                    self._distances[pair] = row["distance_km"]
+                    if row["duration_seconds"] is not None:
+                        self._durations[pair] = row["duration_seconds"]
+                    if row["return_duration_seconds"] is not None:
+                        self._durations[(pair[1], pair[0])] = row["return_duration_seconds"]
+
+    def refresh_client(self, client_id: int, latitude: Optional[float], longitude: Optional[float]) -> None:
+        """Recompute the row of a client whose coordinates were just saved."""
+
+        client_id = int(client_id)
+        execute(
+            "DELETE FROM client_distances WHERE origin_id = ? OR destination_id = ?",
+            (client_id, client_id),
+        )
+        with self._lock:
+            self._forget_locked(client_id)
+        if latitude is None or longitude is None:
+            return
+        point = (float(latitude), float(longitude))
+        others = fetch_all(
+            "SELECT id, latitude, longitude FROM clients "
+            "WHERE id != ? AND latitude IS NOT NULL AND longitude IS NOT NULL",
+            (client_id,),
+        )
+        computed: List[Tuple[int, int, float]] = []
+        for other in others:
+            a, b = _pair(client_id, other["id"])
+            computed.append((a, b, haversine_distance(point, (other["latitude"], other["longitude"]))))
+        if computed:
+            execute_many(
+                "INSERT OR REPLACE INTO client_distances (origin_id, destination_id, distance_km) VALUES (?, ?, ?)",
+                computed,
+            )
+        with self._lock:
+            self._coordinates[client_id] = point
+            for a, b, distance in computed:
+                self._distances[(a, b)] = distance
+
+    def forget_client(self, client_id: int) -> None:
+        with self._lock:
+            self._forget_locked(int(client_id))
+
+    def _forget_locked(self, client_id: int) -> None:
+        self._coordinates.pop(client_id, None)
+        for store in (self._distances, self._durations):
+            for pair in [pair for pair in store if client_id in pair]:
+                del store[pair]
+
+    def record_durations(self, legs: Iterable[Tuple[int, int, float]]) -> None:
+        """Store measured travel times (seconds) from origin to destination."""
+
+        forward, backward = [], []
+        for origin_id, destination_id, seconds in legs:
+            if origin_id < destination_id:
+                forward.append((seconds, origin_id, destination_id))
+            elif origin_id > destination_id:
+                backward.append((seconds, destination_id, origin_id))
+        for column, updates in (("duration_seconds", forward), ("return_duration_seconds", backward)):
+            if updates:
+                execute_many(
+                    f"UPDATE client_distances SET {column} = ? WHERE origin_id = ? AND destination_id = ?",
+                    updates,
+                )
+        with self._lock:
+            for seconds, a, b in forward:
+                if (a, b) in self._distances:
+                    self._durations[(a, b)] = seconds
+            for seconds, a, b in backward:
+                if (a, b) in self._distances:
+                    self._durations[(b, a)] = seconds
+
+
+STORE = DistanceMatrixStore()
@@ -0,0 +1,197 @@
+"""Streaming CSV/NDJSON exports of delivery and visit history.
+
+The queries read the history views, so run them on a connection from
+:func:`archive.connect_history` to include archived rows.
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+import json
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+DELIVERY_COLUMNS = (
+    "id",
+    "client_id",
+    "client_name",
+    "scheduled_date",
+    "status",
+    "quantity",
+    "arrived_at",
+    "departed_at",
+    "completed_at",
+    "stay_seconds",
+    "notes",
+)
+
+VISIT_COLUMNS = (
+    "id",
+    "delivery_id",
+    "client_id",
+    "client_name",
+    "detected_at",
+    "confirmed_at",
+    "stay_seconds",
+    "quantity",
+    "status",
+    "notes",
+)
+
+
+@dataclass
+class ExportFilters:
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    client_ids: Tuple[int, ...] = ()
+    export_format: str = "csv"
+
+
+def parse_export_filters(params: Dict[str, List[str]]) -> ExportFilters:
+    """Build :class:`ExportFilters` from a ``parse_qs`` mapping.
+
+    Raises :class:`ValueError` with a user-facing message on invalid input.
+    """
+
+    export_format = (params.get("format", ["csv"])[0] or "csv").lower()
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError("format deve ser csv ou ndjson")
+
+    date_from = _parse_date(params.get("from", [None])[0], "from")
+    date_to = _parse_date(params.get("to", [None])[0], "to")
+    if date_from and date_to and date_from > date_to:
+        raise ValueError("from deve ser anterior ou igual a to")
+
+    client_ids: List[int] = []
+    for raw in params.get("client_id", []):
+        for value in raw.split(","):
+            value = value.strip()
+            if not value:
+                continue
+            try:
+                client_ids.append(int(value))
+            except ValueError:
+                raise ValueError("client_id deve ser numérico") from None
+    return ExportFilters(date_from, date_to, tuple(client_ids), export_format)
+
+
+def _parse_date(value: Optional[str], name: str) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} deve estar no formato AAAA-MM-DD") from None
+
+
+def build_deliveries_query(filters: ExportFilters) -> Tuple[str, Tuple[Any, ...]]:
+    conditions: List[str] = []
+    params: List[Any] = []
+    if filters.date_from:
+        conditions.append("deliveries.scheduled_date >= ?")
+        params.append(filters.date_from.isoformat())
+    if filters.date_to:
+        conditions.append("deliveries.scheduled_date <= ?")
+        params.append(filters.date_to.isoformat())
+    _append_client_filter("deliveries.client_id", filters, conditions, params)
+    query = (
+        "SELECT deliveries.id, deliveries.client_id, clients.name as client_name, "
+        "deliveries.scheduled_date, deliveries.status, deliveries.quantity, "
+        "deliveries.arrived_at, deliveries.departed_at, deliveries.completed_at, "
+        "deliveries.stay_seconds, deliveries.notes "
+        "FROM deliveries_history AS deliveries JOIN clients ON clients.id = deliveries.client_id"
+    )
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY deliveries.scheduled_date ASC, deliveries.id ASC"
+    return query, tuple(params)
+
+
+def build_visits_query(filters: ExportFilters) -> Tuple[str, Tuple[Any, ...]]:
+    conditions: List[str] = []
+    params: List[Any] = []
+    # Day boundaries become epoch milliseconds so the range uses the index.
+    if filters.date_from:
+        conditions.append("delivery_visits.detected_ms >= ?")
+        params.append(_day_start_ms(filters.date_from))
+    if filters.date_to:
+        conditions.append("delivery_visits.detected_ms < ?")
+        params.append(_day_start_ms(filters.date_to + timedelta(days=1)))
+    _append_client_filter("delivery_visits.client_id", filters, conditions, params)
+    query = (
+        "SELECT delivery_visits.id, delivery_visits.delivery_id, delivery_visits.client_id, "
+        "clients.name as client_name, delivery_visits.detected_at, delivery_visits.confirmed_at, "
+        "delivery_visits.stay_seconds, delivery_visits.quantity, delivery_visits.status, "
+        "delivery_visits.notes "
+        "FROM delivery_visits_history AS delivery_visits "
+        "LEFT JOIN clients ON clients.id = delivery_visits.client_id"
+    )
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY delivery_visits.detected_ms ASC, delivery_visits.id ASC"
+    return query, tuple(params)
+
+
+def _day_start_ms(day: date) -> int:
+    return round(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def _append_client_filter(
+    column: str,
+    filters: ExportFilters,
+    conditions: List[str],
+    params: List[Any],
+) -> None:
+    if not filters.client_ids:
+        return
+    placeholders = ",".join(["?"] * len(filters.client_ids))
+    conditions.append(f"{column} IN ({placeholders})")
+    params.extend(filters.client_ids)
+
+
+def encode_rows(
+    rows: Iterable[Dict[str, Any]],
+    columns: Sequence[str],
+    export_format: str,
+) -> Iterator[bytes]:
+    """Encode ``rows`` lazily in the requested export format."""
+
+    if export_format == "ndjson":
+        return _encode_ndjson(rows)
+    return _encode_csv(rows, columns)
+
+
+def _encode_csv(rows: Iterable[Dict[str, Any]], columns: Sequence[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    try:
+        for row in rows:
+            writer.writerow([row.get(column) for column in columns])
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    finally:
+        close = getattr(rows, "close", None)
+        if close is not None:
+            close()
+    if buffer.tell():
+        # Header of an empty export.
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _encode_ndjson(rows: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    try:
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False).encode("utf-8") + b"\n"
+    finally:
+        close = getattr(rows, "close", None)
+        if close is not None:
+            close()
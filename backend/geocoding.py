@@ -0,0 +1,274 @@
+"""Background geocoding of clients saved without coordinates.
+
+A worker thread picks clients with an address but no latitude/longitude,
+answers what it can from ``geocode_cache`` (keyed by normalized address) and
+sends the rest to the configured backend at most ``GEOCODE_RATE_PER_SECOND``
+times per second. Addresses the backend cannot resolve are cached too and only
+retried after ``GEOCODE_RETRY_DAYS``.
+
+``GEOCODER=google`` (the default when ``GOOGLE_MAPS_API_KEY`` is set) uses the
+Google Geocoding API; ``GEOCODER=stub`` resolves every address to a stable
+point around São Paulo for local development and tests.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Callable, Dict, List, Optional, Protocol, Tuple
+from urllib.error import URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+if __package__ in (None, ""):
+    from database import execute_many, fetch_all
+    from distance_matrix import STORE as DISTANCES
+    from route_planning import DEFAULT_START
+    from settings import env_float, env_int
+else:
+    from .database import execute_many, fetch_all
+    from .distance_matrix import STORE as DISTANCES
+    from .route_planning import DEFAULT_START
+    from .settings import env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+Point = Tuple[float, float]
+
+GOOGLE_GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+GEOCODE_BATCH_SIZE = env_int("GEOCODE_BATCH_SIZE", 50)
+GEOCODE_RATE_PER_SECOND = env_float("GEOCODE_RATE_PER_SECOND", 5.0)
+GEOCODE_INTERVAL_SECONDS = env_int("GEOCODE_INTERVAL_SECONDS", 60)
+GEOCODE_RETRY_DAYS = env_int("GEOCODE_RETRY_DAYS", 7)
+# SQLite caps the number of bound parameters per statement.
+MAX_IN_PARAMS = 400
+
+ABBREVIATIONS = {
+    "av": "avenida",
+    "r": "rua",
+    "al": "alameda",
+    "pca": "praca",
+    "rod": "rodovia",
+    "estr": "estrada",
+    "sp": "sao paulo",
+}
+
+
+class GeocoderError(RuntimeError):
+    """Transient failure; the address is retried on the next batch."""
+
+
+class Geocoder(Protocol):
+    name: str
+
+    def geocode(self, address: str) -> Optional[Point]:
+        """Coordinates of ``address``, ``None`` if it does not exist."""
+
+
+def normalize_address(address: str) -> str:
+    """Cache key: no accents, punctuation, case or common abbreviations."""
+
+    text = unicodedata.normalize("NFKD", address)
+    text = "".join(char for char in text if not unicodedata.combining(char)).lower()
+    words = re.sub(r"[^a-z0-9]+", " ", text).split()
+    return " ".join(ABBREVIATIONS.get(word, word) for word in words)
+
+
+class GoogleGeocoder:
+    name = "google"
+
+    def __init__(self, api_key: str, timeout: float = 10) -> None:
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def geocode(self, address: str) -> Optional[Point]:
+        query = urlencode({"address": address, "key": self.api_key, "region": "br", "language": "pt-BR"})
+        try:
+            with urlopen(f"{GOOGLE_GEOCODE_URL}?{query}", timeout=self.timeout) as response:
+                data = json.loads(response.read().decode("utf-8"))
+        except (URLError, TimeoutError, json.JSONDecodeError) as exc:
+            raise GeocoderError(str(exc)) from exc
+        status = data.get("status")
+        if status == "ZERO_RESULTS":
+            return None
+        if status != "OK":
+            raise GeocoderError(f"Geocoding API respondeu {status}")
+        location = data["results"][0]["geometry"]["location"]
+        return (float(location["lat"]), float(location["lng"]))
+
+
+class StubGeocoder:
+    """Offline backend: known addresses, else a stable point near São Paulo."""
+
+    name = "stub"
+
+    def __init__(self, known: Optional[Dict[str, Point]] = None, synthesize: bool = True) -> None:
+        self.known = {normalize_address(address): point for address, point in (known or {}).items()}
+        self.synthesize = synthesize
+        self.calls: List[str] = []
+
+    def geocode(self, address: str) -> Optional[Point]:
+        self.calls.append(address)
+        key = normalize_address(address)
+        if key in self.known:
+            return self.known[key]
+        if not self.synthesize:
+            return None
+        digest = hashlib.sha1(key.encode("utf-8")).digest()
+        return (
+            round(DEFAULT_START[0] + (digest[0] - 128) / 128 * 0.05, 6),
+            round(DEFAULT_START[1] + (digest[1] - 128) / 128 * 0.05, 6),
+        )
+
+
+def geocoder_from_env() -> Optional[Geocoder]:
+    backend = os.getenv("GEOCODER", "google" if os.getenv("GOOGLE_MAPS_API_KEY") else "")
+    if backend == "stub":
+        return StubGeocoder()
+    if backend == "google" and os.getenv("GOOGLE_MAPS_API_KEY"):
+        return GoogleGeocoder(os.environ["GOOGLE_MAPS_API_KEY"])
+    return None
+
+
+class RateLimiter:
+    """Space calls at least ``1 / per_second`` seconds apart."""
+
+    def __init__(
+        self,
+        per_second: float,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = self._clock()
+            if now < self._next:
+                self._sleep(self._next - now)
+                now = self._next
+            self._next = now + self.interval
+
+
+class GeocodingWorker:
+    def __init__(
+        self,
+        geocoder: Geocoder,
+        rate_limiter: Optional[RateLimiter] = None,
+        batch_size: int = GEOCODE_BATCH_SIZE,
+    ) -> None:
+        self.geocoder = geocoder
+        self.rate_limiter = rate_limiter or RateLimiter(GEOCODE_RATE_PER_SECOND)
+        self.batch_size = batch_size
+        # Only one batch at a time, even if a run overlaps the next tick.
+        self._lock = threading.Lock()
+
+    def run_batch(self) -> Dict[str, int]:
+        """Fill in what the cache knows and geocode up to ``batch_size`` new addresses."""
+
+        with self._lock:
+            return self._run_batch()
+
+    def _run_batch(self) -> Dict[str, int]:
+        pending = fetch_all(
+            "SELECT id, address FROM clients "
+            "WHERE (latitude IS NULL OR longitude IS NULL) AND TRIM(COALESCE(address, '')) != '' "
+            "ORDER BY id"
+        )
+        by_key: Dict[str, List[Dict]] = {}
+        for client in pending:
+            key = normalize_address(client["address"])
+            if key:
+                by_key.setdefault(key, []).append(client)
+        cached = _load_cache(list(by_key))
+
+        resolved: Dict[str, Point] = {}
+        stored: List[Tuple] = []
+        counts = {"pending": len(pending), "cached": 0, "geocoded": 0, "not_found": 0, "errors": 0}
+        for key, clients in by_key.items():
+            if key in cached:
+                if cached[key] is not None:
+                    resolved[key] = cached[key]
+                    counts["cached"] += 1
+                continue
+            if counts["geocoded"] + counts["not_found"] + counts["errors"] >= self.batch_size:
+                continue
+            self.rate_limiter.wait()
+            try:
+                point = self.geocoder.geocode(clients[0]["address"])
+            except GeocoderError as exc:
+                logger.warning("Falha ao geocodificar %r: %s", clients[0]["address"], exc)
+                counts["errors"] += 1
+                continue
+            stored.append((key, point[0] if point else None, point[1] if point else None, self.geocoder.name))
+            if point is None:
+                counts["not_found"] += 1
+            else:
+                resolved[key] = point
+                counts["geocoded"] += 1
+
+        if stored:
+            execute_many(
+                "INSERT OR REPLACE INTO geocode_cache (address_key, latitude, longitude, provider, updated_at) "
+                "VALUES (?, ?, ?, ?, datetime('now'))",
+                stored,
+            )
+        updates = [
+            (point[0], point[1], client["id"])
+            for key, point in resolved.items()
+            for client in by_key[key]
+        ]
+        counts["updated"] = 0
+        if updates:
+            # Coordinates typed in by a user meanwhile are left alone.
+            counts["updated"] = execute_many(
+                "UPDATE clients SET latitude = ?, longitude = ? "
+                "WHERE id = ? AND (latitude IS NULL OR longitude IS NULL)",
+                updates,
+            )
+            for client in _fetch_in_chunks(
+                "SELECT id, latitude, longitude FROM clients WHERE id IN ({})",
+                [client_id for _, _, client_id in updates],
+            ):
+                DISTANCES.refresh_client(client["id"], client["latitude"], client["longitude"])
+        return counts
+
+
+def _fetch_in_chunks(query: str, values: List) -> List[Dict]:
+    rows: List[Dict] = []
+    for offset in range(0, len(values), MAX_IN_PARAMS):
+        chunk = values[offset : offset + MAX_IN_PARAMS]
+        rows.extend(fetch_all(query.format(",".join("?" * len(chunk))), chunk))
+    return rows
+
+
+def _load_cache(keys: List[str]) -> Dict[str, Optional[Point]]:
+    """Cached coordinates by key; ``None`` marks a recent miss."""
+
+    rows = _fetch_in_chunks(
+        "SELECT address_key, latitude, longitude, updated_at >= datetime('now', "
+        f"'-{GEOCODE_RETRY_DAYS} days') AS recent FROM geocode_cache WHERE address_key IN ({{}})",
+        keys,
+    )
+    cached: Dict[str, Optional[Point]] = {}
+    for row in rows:
+        if row["latitude"] is not None and row["longitude"] is not None:
+            cached[row["address_key"]] = (row["latitude"], row["longitude"])
+        elif row["recent"]:
+            cached[row["address_key"]] = None
+    return cached
+
+
+def worker_from_env() -> Optional[GeocodingWorker]:
+    geocoder = geocoder_from_env()
+    return GeocodingWorker(geocoder) if geocoder is not None else None
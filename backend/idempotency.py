@@ -0,0 +1,123 @@
+"""In-memory store of responses to requests sent with an ``Idempotency-Key``.
+
+The first request with a key runs normally and its raw response is kept for
+``IDEMPOTENCY_TTL_SECONDS``; a retry with the same key and body gets those
+bytes back without touching the database. A retry that arrives while the first
+attempt is still running waits for it. Reusing a key with a different body is
+rejected. The store holds at most ``IDEMPOTENCY_MAX_ENTRIES`` keys and evicts
+the oldest first.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Tuple
+
+if __package__ in (None, ""):
+    from settings import env_float, env_int
+else:
+    from .settings import env_float, env_int
+
+IDEMPOTENCY_TTL_SECONDS = env_float("IDEMPOTENCY_TTL_SECONDS", 600.0)
+IDEMPOTENCY_MAX_ENTRIES = env_int("IDEMPOTENCY_MAX_ENTRIES", 2000)
+IN_FLIGHT_WAIT_SECONDS = 10.0
+MAX_KEY_LENGTH = 255
+
+NEW = "new"
+REPLAY = "replay"
+IN_PROGRESS = "in_progress"
+MISMATCH = "mismatch"
+
+
+@dataclass
+class StoredResponse:
+    fingerprint: str
+    expires_at: float
+    status: Optional[int] = None
+    raw: Optional[bytes] = None
+    done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+
+def fingerprint(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(
+        self,
+        ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS,
+        max_entries: int = IDEMPOTENCY_MAX_ENTRIES,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: "OrderedDict[Tuple[str, str], StoredResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def begin(
+        self,
+        scope: str,
+        key: str,
+        body: bytes,
+        wait: float = IN_FLIGHT_WAIT_SECONDS,
+    ) -> Tuple[str, StoredResponse]:
+        """Claim ``key`` within ``scope``; the outcome says what the caller must do.
+
+        ``NEW``: process the request, then :meth:`complete` or :meth:`abandon`.
+        ``REPLAY``: send ``entry.raw``. ``IN_PROGRESS``: the first attempt is
+        still running after ``wait`` seconds. ``MISMATCH``: different body.
+        """
+
+        digest = fingerprint(body)
+        with self._lock:
+            self._purge_expired()
+            entry = self._entries.get((scope, key))
+            if entry is None:
+                entry = StoredResponse(digest, self._clock() + self.ttl_seconds)
+                self._entries[(scope, key)] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                return NEW, entry
+        if entry.fingerprint != digest:
+            return MISMATCH, entry
+        if not entry.done.wait(wait) or entry.raw is None:
+            return IN_PROGRESS, entry
+        return REPLAY, entry
+
+    def complete(self, entry: StoredResponse, status: int, raw: bytes) -> None:
+        entry.status = status
+        entry.raw = raw
+        entry.done.set()
+
+    def abandon(self, scope: str, key: str, entry: StoredResponse) -> None:
+        """Forget a key whose first attempt failed so a retry runs again."""
+
+        with self._lock:
+            if self._entries.get((scope, key)) is entry:
+                del self._entries[(scope, key)]
+        entry.done.set()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _purge_expired(self) -> None:
+        now = self._clock()
+        # Entries are kept in insertion order, which is also expiry order.
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if oldest.expires_at > now:
+                break
+            self._entries.popitem(last=False)
+
+
+STORE = IdempotencyStore()
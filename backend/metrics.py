@@ -0,0 +1,265 @@
+"""In-process runtime metrics rendered in the Prometheus text format."""
+
+from __future__ import annotations
+
+import os
+import re
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+ENABLED = os.getenv("RUNTIME_METRICS", "1").lower() not in ("0", "false", "no", "off")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Route label of every API path the server answers; anything else is
+# "unmatched" so that 404s (scanners, typos) cannot add series without bound.
+ROUTE_TEMPLATES = (
+    "/api/admin/backups",
+    "/api/admin/backups/:id/verify",
+    "/api/analytics",
+    "/api/clients",
+    "/api/clients/:id",
+    "/api/clients/bulk",
+    "/api/clients/search",
+    "/api/config",
+    "/api/deliveries",
+    "/api/deliveries/:id/complete",
+    "/api/deliveries/bulk",
+    "/api/driver/location",
+    "/api/export/deliveries",
+    "/api/export/visits",
+    "/api/metrics/runtime",
+    "/api/metrics/slow-queries",
+    "/api/metrics/summary",
+    "/api/routes",
+    "/api/routes/jobs",
+    "/api/routes/jobs/:id",
+    "/api/sync",
+)
+UNMATCHED_ROUTE = "unmatched"
+
+_ROUTE_PATTERNS = tuple(
+    (re.compile("^" + re.escape(template).replace(":id", r"[^/]+") + "$"), template) for template in ROUTE_TEMPLATES
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Fixed-bucket histogram; callers serialize access through the registry lock."""
+
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._bounds: Dict[str, Sequence[float]] = {}
+        self._help: Dict[str, str] = {}
+
+    def counter(self, name: str, help_text: str) -> None:
+        self._counters.setdefault(name, {})
+        self._help[name] = help_text
+
+    def histogram(self, name: str, help_text: str, bounds: Sequence[float]) -> None:
+        self._histograms.setdefault(name, {})
+        self._bounds[name] = bounds
+        self._help[name] = help_text
+
+    def inc(self, name: str, labels: Labels, amount: float = 1.0) -> None:
+        with self._lock:
+            series = self._counters[name]
+            series[labels] = series.get(labels, 0.0) + amount
+
+    def observe(self, name: str, labels: Labels, value: float) -> None:
+        with self._lock:
+            series = self._histograms[name]
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram(self._bounds[name])
+            histogram.observe(value)
+
+    def reset(self) -> None:
+        with self._lock:
+            for series in self._counters.values():
+                series.clear()
+            for series in self._histograms.values():
+                series.clear()
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, series in self._counters.items():
+                lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            for name, series in self._histograms.items():
+                lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.bounds, histogram.counts):
+                        cumulative += count
+                        bucket_labels = labels + (("le", _format_value(bound)),)
+                        lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                    bucket_labels = labels + (("le", "+Inf"),)
+                    lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.total)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels) + "}"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+REGISTRY = MetricsRegistry()
+REGISTRY.counter("bakery_http_requests_total", "HTTP requests handled, by route and status.")
+REGISTRY.counter("bakery_sql_statements_total", "SQL statements executed, by route.")
+REGISTRY.counter("bakery_sql_seconds_total", "Time spent in SQL statements, by route.")
+REGISTRY.counter("bakery_google_api_requests_total", "Google Directions API calls, by outcome.")
+REGISTRY.histogram(
+    "bakery_http_request_duration_seconds",
+    "HTTP request latency, by route.",
+    LATENCY_BUCKETS,
+)
+REGISTRY.histogram(
+    "bakery_sql_statements_per_request",
+    "SQL statements issued while serving one request, by route.",
+    STATEMENT_BUCKETS,
+)
+REGISTRY.histogram(
+    "bakery_sql_seconds_per_request",
+    "Time spent in SQL while serving one request, by route.",
+    LATENCY_BUCKETS,
+)
+REGISTRY.histogram(
+    "bakery_google_api_duration_seconds",
+    "Google Directions API call latency, by outcome.",
+    LATENCY_BUCKETS,
+)
+
+_local = threading.local()
+
+
+class _RequestStats:
+    __slots__ = ("statements", "sql_seconds")
+
+    def __init__(self) -> None:
+        self.statements = 0
+        self.sql_seconds = 0.0
+
+
+def normalize_route(path: str) -> str:
+    """Map an API path to its entry of ``ROUTE_TEMPLATES``, one series per endpoint."""
+
+    if not path.startswith("/api/"):
+        return "static"
+    path = path.rstrip("/")
+    # Literal templates first, so "/api/clients/search" is not "/api/clients/:id".
+    if path in ROUTE_TEMPLATES and ":id" not in path:
+        return path
+    for pattern, template in _ROUTE_PATTERNS:
+        if pattern.match(path):
+            return template
+    return UNMATCHED_ROUTE
+
+
+def start_request() -> None:
+    _local.stats = _RequestStats()
+
+
+def finish_request(method: str, path: str, status: Optional[int], seconds: float) -> None:
+    stats: Optional[_RequestStats] = getattr(_local, "stats", None)
+    _local.stats = None
+    route = normalize_route(path)
+    REGISTRY.inc(
+        "bakery_http_requests_total",
+        (("method", method), ("route", route), ("status", str(status or 500))),
+    )
+    labels = (("method", method), ("route", route))
+    REGISTRY.observe("bakery_http_request_duration_seconds", labels, seconds)
+    if stats is not None:
+        REGISTRY.observe("bakery_sql_statements_per_request", labels, stats.statements)
+        REGISTRY.observe("bakery_sql_seconds_per_request", labels, stats.sql_seconds)
+        if stats.statements:
+            route_labels = (("route", route),)
+            REGISTRY.inc("bakery_sql_statements_total", route_labels, stats.statements)
+            REGISTRY.inc("bakery_sql_seconds_total", route_labels, stats.sql_seconds)
+
+
+def observe_query(query: str, params: Tuple[Any, ...], seconds: float, connect: Any = None) -> None:
+    """Database observer: attribute the statement to the request being served."""
+
+    stats: Optional[_RequestStats] = getattr(_local, "stats", None)
+    if stats is None:
+        REGISTRY.inc("bakery_sql_statements_total", (("route", "background"),))
+        REGISTRY.inc("bakery_sql_seconds_total", (("route", "background"),), seconds)
+        return
+    stats.statements += 1
+    stats.sql_seconds += seconds
+
+
+def observe_google_call(outcome: str, seconds: float) -> None:
+    collected: Optional[List[Tuple[str, float]]] = getattr(_local, "google_calls", None)
+    if collected is not None:
+        collected.append((outcome, seconds))
+        return
+    if not ENABLED:
+        return
+    labels = (("outcome", outcome),)
+    REGISTRY.inc("bakery_google_api_requests_total", labels)
+    REGISTRY.observe("bakery_google_api_duration_seconds", labels, seconds)
+
+
+@contextmanager
+def collect_google_calls() -> Iterator[List[Tuple[str, float]]]:
+    """Gather this thread's Google calls in a list instead of the registry.
+
+    Used in worker processes, whose registry is never rendered; the parent
+    passes the list to :func:`record_google_calls`.
+    """
+
+    _local.google_calls = collected = []
+    try:
+        yield collected
+    finally:
+        _local.google_calls = None
+
+
+def record_google_calls(calls: Sequence[Tuple[str, float]]) -> None:
+    for outcome, seconds in calls:
+        observe_google_call(outcome, seconds)
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,158 @@
+"""Opt-in slow-query log with EXPLAIN QUERY PLAN capture.
+
+Enable it by setting ``SLOW_QUERY_MS`` to the threshold in milliseconds.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_N = 20
+MAX_TRACKED_STATEMENTS = 500
+
+_WHITESPACE = re.compile(r"\s+")
+_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+
+
+def normalize_statement(query: str) -> str:
+    """Collapse whitespace and ``IN (?, ?, ...)`` lists into one statement key."""
+
+    return _PLACEHOLDER_LIST.sub("?, ...", _WHITESPACE.sub(" ", query).strip())
+
+
+@dataclass
+class StatementStats:
+    statement: str
+    calls: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    slow_calls: int = 0
+    last_slow_params: Optional[Tuple[Any, ...]] = None
+    plan: Optional[List[str]] = field(default=None)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "statement": self.statement,
+            "calls": self.calls,
+            "total_ms": round(self.total_seconds * 1000, 3),
+            "avg_ms": round(self.total_seconds * 1000 / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 3),
+            "slow_calls": self.slow_calls,
+            "last_slow_params": list(self.last_slow_params) if self.last_slow_params is not None else None,
+            "plan": self.plan,
+        }
+
+
+class QueryProfiler:
+    """Database query observer that aggregates timings and logs slow statements."""
+
+    def __init__(
+        self,
+        threshold_ms: float,
+        connect: Callable[[], sqlite3.Connection],
+        top_n: int = DEFAULT_TOP_N,
+    ) -> None:
+        self.threshold_ms = threshold_ms
+        self.top_n = top_n
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._stats: Dict[str, StatementStats] = {}
+
+    def __call__(
+        self,
+        query: str,
+        params: Tuple[Any, ...],
+        seconds: float,
+        connect: Optional[Callable[[], sqlite3.Connection]] = None,
+    ) -> None:
+        key = normalize_statement(query)
+        slow = seconds * 1000 >= self.threshold_ms
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                if len(self._stats) >= MAX_TRACKED_STATEMENTS:
+                    self._evict_cheapest()
+                stats = self._stats[key] = StatementStats(key)
+            stats.calls += 1
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            if not slow:
+                return
+            stats.slow_calls += 1
+            stats.last_slow_params = params
+            needs_plan = stats.plan is None
+            if needs_plan:
+                # Mark before releasing the lock so concurrent slow calls
+                # of the same statement do not explain it twice.
+                stats.plan = []
+        logger.warning("Consulta lenta (%.1f ms): %s params=%r", seconds * 1000, key, params)
+        if needs_plan:
+            plan = self._explain(query, params, connect or self._connect)
+            with self._lock:
+                stats.plan = plan
+            logger.warning("Plano de execução de %s:\n%s", key, "\n".join(plan))
+
+    def _evict_cheapest(self) -> None:
+        cheapest = min(self._stats.values(), key=lambda item: item.total_seconds)
+        del self._stats[cheapest.statement]
+
+    def _explain(
+        self,
+        query: str,
+        params: Tuple[Any, ...],
+        connect: Callable[[], sqlite3.Connection],
+    ) -> List[str]:
+        conn = connect()
+        try:
+            rows = conn.execute("EXPLAIN QUERY PLAN " + query, params).fetchall()
+        except sqlite3.Error as exc:
+            return [f"EXPLAIN indisponível: {exc}"]
+        finally:
+            conn.close()
+        return [row[-1] for row in rows]
+
+    def top(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            ranked = sorted(self._stats.values(), key=lambda item: item.total_seconds, reverse=True)
+            return [stats.as_dict() for stats in ranked[: limit or self.top_n]]
+
+    def dump(self, limit: Optional[int] = None) -> str:
+        lines = [f"{'total ms':>10} {'calls':>7} {'avg ms':>8} {'max ms':>8}  statement"]
+        for entry in self.top(limit):
+            lines.append(
+                f"{entry['total_ms']:>10.1f} {entry['calls']:>7} {entry['avg_ms']:>8.2f} "
+                f"{entry['max_ms']:>8.2f}  {entry['statement']}"
+            )
+            for step in entry["plan"] or ():
+                lines.append(f"{'':>37}  {step}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+def profiler_from_env(connect: Callable[[], sqlite3.Connection]) -> Optional[QueryProfiler]:
+    """Build a profiler when ``SLOW_QUERY_MS`` is set to a valid number."""
+
+    raw = os.getenv("SLOW_QUERY_MS")
+    if not raw:
+        return None
+    try:
+        threshold = float(raw)
+    except ValueError:
+        logger.warning("SLOW_QUERY_MS inválido: %r", raw)
+        return None
+    try:
+        top_n = int(os.getenv("SLOW_QUERY_TOP_N", DEFAULT_TOP_N))
+    except ValueError:
+        top_n = DEFAULT_TOP_N
+    return QueryProfiler(threshold, connect, top_n=top_n)
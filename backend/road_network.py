@@ -0,0 +1,452 @@
+"""Offline road-network routing with contraction hierarchies.
+
+Build a graph once from an OpenStreetMap extract (XML) and point
+``ROAD_GRAPH_PATH`` at the result::
+
+    python -m backend.road_network extract.osm data/road_graph.json.gz
+
+The file holds the node coordinates, directed edges weighted by driving time
+and the contraction produced at build time (node ranks and shortcuts), so
+loading it needs no preprocessing. A graph without ranks is contracted when
+loaded, which is fine for small test graphs.
+
+Many-to-many queries use the bucket algorithm: one upward search per target
+fills buckets, one upward search per source scans them. Points are snapped to
+the nearest graph node; the access legs, and whole legs to points too far
+from the graph, are priced as straight lines at ``ACCESS_SPEED_KMH``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import heapq
+import json
+import logging
+import os
+import threading
+import xml.etree.ElementTree as ElementTree
+from collections import defaultdict
+from math import ceil, cos, floor, inf, radians
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+if __package__ in (None, ""):
+    from routes_logic import DistanceMatrix, client_key, haversine_distance
+else:
+    from .routes_logic import DistanceMatrix, client_key, haversine_distance
+
+logger = logging.getLogger(__name__)
+
+Point = Tuple[float, float]
+Edge = Tuple[int, int, float, float]  # origin, destination, seconds, meters
+Reached = Dict[int, Tuple[float, float]]  # node -> (seconds, meters)
+
+ROAD_GRAPH_PATH = os.getenv("ROAD_GRAPH_PATH")
+GRAPH_FORMAT_VERSION = 1
+ACCESS_SPEED_KMH = 20.0
+SNAP_MAX_KM = 2.0
+GRID_CELL_DEGREES = 0.01
+# Witness searches give up after this many settled nodes; a missed witness only
+# costs an unnecessary shortcut, never a wrong distance.
+WITNESS_SETTLE_LIMIT = 200
+
+# Free-flow speeds (km/h) by OSM ``highway`` value when ``maxspeed`` is absent.
+HIGHWAY_SPEEDS_KMH = {
+    "motorway": 80.0,
+    "motorway_link": 50.0,
+    "trunk": 60.0,
+    "trunk_link": 40.0,
+    "primary": 45.0,
+    "primary_link": 35.0,
+    "secondary": 40.0,
+    "secondary_link": 30.0,
+    "tertiary": 35.0,
+    "tertiary_link": 25.0,
+    "unclassified": 25.0,
+    "residential": 25.0,
+    "living_street": 10.0,
+    "service": 15.0,
+}
+
+
+def _cheapest_edges(edges: Iterable[Edge]) -> Dict[Tuple[int, int], Tuple[float, float]]:
+    cheapest: Dict[Tuple[int, int], Tuple[float, float]] = {}
+    for origin, destination, seconds, meters in edges:
+        if origin == destination:
+            continue
+        known = cheapest.get((origin, destination))
+        if known is None or seconds < known[0]:
+            cheapest[(origin, destination)] = (float(seconds), float(meters))
+    return cheapest
+
+
+def _witness_search(
+    out: List[Dict[int, Tuple[float, float]]],
+    source: int,
+    skipped: int,
+    targets: Dict[int, Tuple[float, float]],
+) -> Dict[int, float]:
+    """Distances from ``source`` avoiding ``skipped``, enough to judge ``targets``."""
+
+    limit = max(seconds for seconds, _ in targets.values())
+    pending = set(targets)
+    dist = {source: 0.0}
+    heap = [(0.0, source)]
+    settled = 0
+    while heap and pending and settled < WITNESS_SETTLE_LIMIT:
+        cost, node = heapq.heappop(heap)
+        if cost > limit:
+            break
+        if cost > dist.get(node, inf):
+            continue
+        pending.discard(node)
+        settled += 1
+        for neighbor, (seconds, _) in out[node].items():
+            if neighbor == skipped:
+                continue
+            candidate = cost + seconds
+            if candidate < dist.get(neighbor, inf):
+                dist[neighbor] = candidate
+                heapq.heappush(heap, (candidate, neighbor))
+    return dist
+
+
+def contract(node_count: int, edges: Iterable[Edge]) -> Tuple[List[int], List[Edge]]:
+    """Order nodes by importance and add the shortcuts that preserve distances.
+
+    Returns ``(ranks, shortcuts)``; ``ranks[node]`` is the contraction order.
+    """
+
+    out: List[Dict[int, Tuple[float, float]]] = [{} for _ in range(node_count)]
+    inc: List[Dict[int, Tuple[float, float]]] = [{} for _ in range(node_count)]
+    for (origin, destination), weight in _cheapest_edges(edges).items():
+        out[origin][destination] = weight
+        inc[destination][origin] = weight
+    deleted_neighbors = [0] * node_count
+
+    def needed_shortcuts(node: int) -> List[Edge]:
+        shortcuts: List[Edge] = []
+        for origin, (in_seconds, in_meters) in inc[node].items():
+            targets = {
+                target: (in_seconds + seconds, in_meters + meters)
+                for target, (seconds, meters) in out[node].items()
+                if target != origin
+            }
+            if not targets:
+                continue
+            witness = _witness_search(out, origin, node, targets)
+            for target, (seconds, meters) in targets.items():
+                if witness.get(target, inf) > seconds:
+                    shortcuts.append((origin, target, seconds, meters))
+        return shortcuts
+
+    def priority(node: int, shortcuts: List[Edge]) -> int:
+        edge_difference = len(shortcuts) - len(inc[node]) - len(out[node])
+        return edge_difference + deleted_neighbors[node]
+
+    heap = [(priority(node, needed_shortcuts(node)), node) for node in range(node_count)]
+    heapq.heapify(heap)
+    ranks = [0] * node_count
+    added: Dict[Tuple[int, int], Tuple[float, float]] = {}
+    next_rank = 0
+    while heap:
+        _, node = heapq.heappop(heap)
+        # Lazy update: re-queue the node if its priority got worse.
+        shortcuts = needed_shortcuts(node)
+        current = priority(node, shortcuts)
+        if heap and current > heap[0][0]:
+            heapq.heappush(heap, (current, node))
+            continue
+        for origin, target, seconds, meters in shortcuts:
+            known = out[origin].get(target)
+            if known is None or seconds < known[0]:
+                out[origin][target] = inc[target][origin] = (seconds, meters)
+                added[(origin, target)] = (seconds, meters)
+        for origin in inc[node]:
+            del out[origin][node]
+            deleted_neighbors[origin] += 1
+        for target in out[node]:
+            del inc[target][node]
+            deleted_neighbors[target] += 1
+        inc[node] = {}
+        out[node] = {}
+        ranks[node] = next_rank
+        next_rank += 1
+    shortcuts = [(origin, target, seconds, meters) for (origin, target), (seconds, meters) in added.items()]
+    return ranks, shortcuts
+
+
+class RoadNetwork:
+    """Contracted road graph answering shortest driving times between points."""
+
+    def __init__(
+        self,
+        coordinates: Sequence[Point],
+        edges: Iterable[Edge],
+        ranks: Optional[Sequence[int]] = None,
+        shortcuts: Optional[Iterable[Edge]] = None,
+    ) -> None:
+        self.coordinates = [(float(lat), float(lon)) for lat, lon in coordinates]
+        self.edges = [(o, d, s, m) for (o, d), (s, m) in _cheapest_edges(edges).items()]
+        if ranks is None:
+            ranks, shortcuts = contract(len(self.coordinates), self.edges)
+        self.ranks = list(ranks)
+        self.shortcuts = list(shortcuts or [])
+        # Forward searches climb along edges; backward searches climb against them.
+        self._up: List[List[Tuple[int, float, float]]] = [[] for _ in self.coordinates]
+        self._down: List[List[Tuple[int, float, float]]] = [[] for _ in self.coordinates]
+        for origin, destination, seconds, meters in self.edges + self.shortcuts:
+            if self.ranks[destination] > self.ranks[origin]:
+                self._up[origin].append((destination, seconds, meters))
+            else:
+                self._down[destination].append((origin, seconds, meters))
+        self._grid: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        for node, point in enumerate(self.coordinates):
+            self._grid[_cell(point)].append(node)
+
+    @classmethod
+    def load(cls, path: Path) -> "RoadNetwork":
+        with _open(Path(path), "rt") as handle:
+            data = json.load(handle)
+        if data.get("version") != GRAPH_FORMAT_VERSION:
+            raise ValueError(f"Versão de grafo não suportada: {data.get('version')!r}")
+        return cls(data["nodes"], [tuple(edge) for edge in data["edges"]], data.get("ranks"), data.get("shortcuts"))
+
+    def save(self, path: Path) -> None:
+        data = {
+            "version": GRAPH_FORMAT_VERSION,
+            "nodes": [[round(lat, 7), round(lon, 7)] for lat, lon in self.coordinates],
+            "edges": [_rounded(edge) for edge in self.edges],
+            "ranks": self.ranks,
+            "shortcuts": [_rounded(edge) for edge in self.shortcuts],
+        }
+        with _open(Path(path), "wt") as handle:
+            json.dump(data, handle, separators=(",", ":"))
+
+    def nearest_node(self, point: Point, max_km: float = SNAP_MAX_KM) -> Optional[Tuple[int, float]]:
+        """Closest node to ``point`` and its distance in km, within ``max_km``."""
+
+        row, column = _cell(point)
+        max_ring = ceil(max_km / (111.0 * GRID_CELL_DEGREES)) + 1
+        # Every node in ring k is at least k - 1 cells away from ``point``.
+        cell_km = 111.0 * GRID_CELL_DEGREES * cos(radians(point[0]))
+        best: Optional[Tuple[int, float]] = None
+        for ring in range(max_ring + 1):
+            if best is not None and (ring - 1) * cell_km > best[1]:
+                break
+            for cell in _ring(row, column, ring):
+                for node in self._grid.get(cell, ()):
+                    distance = haversine_distance(point, self.coordinates[node])
+                    if distance <= max_km and (best is None or distance < best[1]):
+                        best = (node, distance)
+        return best
+
+    def many_to_many(
+        self,
+        sources: Sequence[int],
+        targets: Sequence[int],
+    ) -> Tuple[List[List[float]], List[List[float]]]:
+        """Shortest ``(seconds, meters)`` matrices from each source to each target."""
+
+        buckets: Dict[int, List[Tuple[int, float, float]]] = defaultdict(list)
+        for column, target in enumerate(targets):
+            for node, (seconds, meters) in self._climb(target, self._down, self._up).items():
+                buckets[node].append((column, seconds, meters))
+        seconds_rows: List[List[float]] = []
+        meters_rows: List[List[float]] = []
+        for source in sources:
+            seconds_row = [inf] * len(targets)
+            meters_row = [inf] * len(targets)
+            for node, (seconds, meters) in self._climb(source, self._up, self._down).items():
+                for column, rest_seconds, rest_meters in buckets.get(node, ()):
+                    if seconds + rest_seconds < seconds_row[column]:
+                        seconds_row[column] = seconds + rest_seconds
+                        meters_row[column] = meters + rest_meters
+            seconds_rows.append(seconds_row)
+            meters_rows.append(meters_row)
+        return seconds_rows, meters_rows
+
+    def route_matrix(self, start: Point, clients: Sequence[Dict]) -> Optional[Tuple[DistanceMatrix, Dict[int, float]]]:
+        """Driving seconds between ``clients`` and from ``start`` to each of them.
+
+        Legs to or from a point too far from the graph to be snapped are
+        priced as a straight line at ``ACCESS_SPEED_KMH``. Returns ``None``
+        when no client can be snapped.
+        """
+
+        points = [start] + [(float(client["latitude"]), float(client["longitude"])) for client in clients]
+        snapped = [self.nearest_node(point) for point in points]
+        if all(item is None for item in snapped[1:]):
+            return None
+        on_graph = [index for index, item in enumerate(snapped) if item is not None]
+        road, _ = self.many_to_many([snapped[i][0] for i in on_graph], [snapped[i][0] for i in on_graph])
+        position = {index: order for order, index in enumerate(on_graph)}
+        access = [item[1] / ACCESS_SPEED_KMH * 3600 if item is not None else 0.0 for item in snapped]
+
+        def seconds(origin: int, destination: int) -> float:
+            if origin == destination:
+                return 0.0
+            if origin in position and destination in position:
+                leg = road[position[origin]][position[destination]]
+                return access[origin] + leg + access[destination]
+            return haversine_distance(points[origin], points[destination]) / ACCESS_SPEED_KMH * 3600
+
+        ids = [client_key(client) for client in clients]
+        rows = [[seconds(i + 1, j + 1) for j in range(len(clients))] for i in range(len(clients))]
+        from_start = {ids[j]: seconds(0, j + 1) for j in range(len(clients))}
+        return DistanceMatrix(ids, rows), from_start
+
+    def _climb(
+        self,
+        origin: int,
+        graph: List[List[Tuple[int, float, float]]],
+        stall: List[List[Tuple[int, float, float]]],
+    ) -> Reached:
+        """Upward Dijkstra from ``origin`` with stall-on-demand.
+
+        A node reached more cheaply through a higher-ranked neighbour (found in
+        ``stall``, the opposite direction) is not on a shortest path, so it is
+        neither expanded nor returned.
+        """
+
+        reached: Dict[int, Tuple[float, float]] = {origin: (0.0, 0.0)}
+        heap = [(0.0, 0.0, origin)]
+        settled: Reached = {}
+        stalled = set()
+        while heap:
+            seconds, meters, node = heapq.heappop(heap)
+            if node in settled or node in stalled:
+                continue
+            if any(
+                neighbor in reached and reached[neighbor][0] + edge_seconds < seconds
+                for neighbor, edge_seconds, _ in stall[node]
+            ):
+                stalled.add(node)
+                continue
+            settled[node] = (seconds, meters)
+            for neighbor, edge_seconds, edge_meters in graph[node]:
+                candidate = seconds + edge_seconds
+                if neighbor not in settled and candidate < reached.get(neighbor, (inf, 0.0))[0]:
+                    reached[neighbor] = (candidate, meters + edge_meters)
+                    heapq.heappush(heap, (candidate, meters + edge_meters, neighbor))
+        return settled
+
+
+def _cell(point: Point) -> Tuple[int, int]:
+    return floor(point[0] / GRID_CELL_DEGREES), floor(point[1] / GRID_CELL_DEGREES)
+
+
+def _ring(row: int, column: int, radius: int) -> Iterable[Tuple[int, int]]:
+    if radius == 0:
+        yield row, column
+        return
+    for offset in range(-radius, radius + 1):
+        yield row - radius, column + offset
+        yield row + radius, column + offset
+    for offset in range(-radius + 1, radius):
+        yield row + offset, column - radius
+        yield row + offset, column + radius
+
+
+def _rounded(edge: Edge) -> List:
+    origin, destination, seconds, meters = edge
+    return [origin, destination, round(seconds, 1), round(meters, 1)]
+
+
+def _open(path: Path, mode: str):
+    if path.suffix == ".gz":
+        return gzip.open(path, mode, encoding="utf-8")
+    return path.open(mode[0], encoding="utf-8")
+
+
+def _speed_kmh(tags: Dict[str, str]) -> Optional[float]:
+    default = HIGHWAY_SPEEDS_KMH.get(tags.get("highway", ""))
+    if default is None:
+        return None
+    try:
+        return float(tags.get("maxspeed", "").split()[0])
+    except (IndexError, ValueError):
+        return default
+
+
+def parse_osm_xml(path: Path) -> Tuple[List[Point], List[Edge]]:
+    """Drivable ways of an OSM XML extract as ``(coordinates, edges)``."""
+
+    positions: Dict[str, Point] = {}
+    ways: List[Tuple[List[str], float, int]] = []
+    for _, element in ElementTree.iterparse(str(path)):
+        if element.tag == "node":
+            positions[element.get("id")] = (float(element.get("lat")), float(element.get("lon")))
+        elif element.tag == "way":
+            tags = {tag.get("k"): tag.get("v") for tag in element.iter("tag")}
+            speed = _speed_kmh(tags)
+            if speed:
+                oneway = tags.get("oneway")
+                direction = 1 if oneway in ("yes", "1", "true") or tags.get("junction") == "roundabout" else 0
+                direction = -1 if oneway == "-1" else direction
+                ways.append(([nd.get("ref") for nd in element.iter("nd")], speed, direction))
+        if element.tag in ("node", "way", "relation"):
+            element.clear()
+
+    index: Dict[str, int] = {}
+    coordinates: List[Point] = []
+    edges: List[Edge] = []
+    for refs, speed, direction in ways:
+        refs = [ref for ref in refs if ref in positions]
+        for first, second in zip(refs, refs[1:]):
+            for ref in (first, second):
+                if ref not in index:
+                    index[ref] = len(coordinates)
+                    coordinates.append(positions[ref])
+            meters = haversine_distance(positions[first], positions[second]) * 1000
+            seconds = meters / (speed / 3.6)
+            if direction >= 0:
+                edges.append((index[first], index[second], seconds, meters))
+            if direction <= 0:
+                edges.append((index[second], index[first], seconds, meters))
+    return coordinates, edges
+
+
+_default_network: Optional[RoadNetwork] = None
+_default_loaded = False
+_default_lock = threading.Lock()
+
+
+def default_network() -> Optional[RoadNetwork]:
+    """Graph at ``ROAD_GRAPH_PATH``, loaded once per process; ``None`` if unset."""
+
+    global _default_network, _default_loaded
+    if _default_loaded:
+        return _default_network
+    with _default_lock:
+        if not _default_loaded:
+            if ROAD_GRAPH_PATH:
+                try:
+                    _default_network = RoadNetwork.load(Path(ROAD_GRAPH_PATH))
+                except (OSError, ValueError, KeyError) as exc:
+                    logger.error("Não foi possível carregar o grafo viário %s: %s", ROAD_GRAPH_PATH, exc)
+            _default_loaded = True
+    return _default_network
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", type=Path, help="OSM XML extract or uncontracted graph JSON")
+    parser.add_argument("output", type=Path, help="graph file (.json or .json.gz)")
+    args = parser.parse_args(argv)
+
+    if args.source.suffix == ".osm":
+        coordinates, edges = parse_osm_xml(args.source)
+    else:
+        with _open(args.source, "rt") as handle:
+            data = json.load(handle)
+        coordinates, edges = data["nodes"], [tuple(edge) for edge in data["edges"]]
+    network = RoadNetwork(coordinates, edges)
+    network.save(args.output)
+    print(f"{len(network.coordinates)} nós, {len(network.edges)} arestas, {len(network.shortcuts)} atalhos")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
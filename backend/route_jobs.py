@@ -0,0 +1,252 @@
+"""Background route-planning jobs executed in a process pool.
+
+Solving a large route holds the GIL for seconds, so ``POST /api/routes/jobs``
+hands the work to worker processes and the request threads stay free for
+location updates. Identical plans submitted while one is still in flight share
+the same job.
+
+A job that is cancelled or exceeds its timeout is only detached: a call that
+already started in a worker process cannot be interrupted, so it runs to the end
+and its result is discarded. Timeouts are checked whenever the job is read or
+an identical job is submitted.
+"""
+
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, Executor, Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Tuple
+
+if __package__ in (None, ""):
+    import metrics
+    from settings import env_float, env_int
+else:
+    from . import metrics
+    from .settings import env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+ROUTE_JOB_WORKERS = env_int("ROUTE_JOB_WORKERS", 2)
+ROUTE_JOB_TIMEOUT_SECONDS = env_float("ROUTE_JOB_TIMEOUT_SECONDS", 60.0)
+ROUTE_JOB_RETENTION_SECONDS = env_float("ROUTE_JOB_RETENTION_SECONDS", 900.0)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TIMEOUT = "timeout"
+FINISHED_STATUSES = frozenset({DONE, FAILED, CANCELLED, TIMEOUT})
+
+
+@dataclass
+class RouteJob:
+    id: str
+    key: str
+    context: Any
+    future: Future
+    submitted_at: float
+    status: str = QUEUED
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    result: Any = None
+    response: Optional[Dict] = None
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def describe(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "elapsed_ms": round(((self.finished_at or time.monotonic()) - self.submitted_at) * 1000, 1),
+        }
+
+
+class RouteJobManager:
+    """Track route jobs submitted to a lazily created executor."""
+
+    def __init__(
+        self,
+        workers: int = ROUTE_JOB_WORKERS,
+        timeout: float = ROUTE_JOB_TIMEOUT_SECONDS,
+        retention: float = ROUTE_JOB_RETENTION_SECONDS,
+        executor_factory: Optional[Callable[[int], Executor]] = None,
+    ) -> None:
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.retention = retention
+        self._executor_factory = executor_factory or _spawn_pool
+        self._executor: Optional[Executor] = None
+        self._jobs: Dict[str, RouteJob] = {}
+        self._in_flight: Dict[str, str] = {}
+        # Reentrant: cancelling a queued future runs its done callback inline.
+        self._lock = threading.RLock()
+
+    def submit(
+        self,
+        key: str,
+        context: Any,
+        fn: Callable,
+        *args,
+        on_done: Optional[Callable[[Any, Any], None]] = None,
+    ) -> Tuple[RouteJob, bool]:
+        """Schedule ``fn(*args)``; returns the job and whether it was deduplicated.
+
+        ``on_done(context, result)`` runs in the server process once the job
+        has succeeded.
+        """
+
+        with self._lock:
+            self._prune()
+            existing_id = self._in_flight.get(key)
+            if existing_id is not None:
+                existing = self._jobs[existing_id]
+                self._check_timeout(existing)
+                if existing.status not in FINISHED_STATUSES:
+                    return existing, True
+            if self._executor is None:
+                self._executor = self._executor_factory(self.workers)
+            future = self._executor.submit(_run_collecting_metrics, fn, *args)
+            job = RouteJob(
+                id=uuid.uuid4().hex,
+                key=key,
+                context=context,
+                future=future,
+                submitted_at=time.monotonic(),
+            )
+            self._jobs[job.id] = job
+            self._in_flight[key] = job.id
+        future.add_done_callback(lambda done, job=job: self._complete(job, done, on_done))
+        return job, False
+
+    def resolved(self, key: str, context: Any, result: Any) -> RouteJob:
+        """Register a job whose ``result`` is already known, e.g. a stored plan."""
+
+        future: Future = Future()
+        future.set_result((result, []))
+        now = time.monotonic()
+        job = RouteJob(
+            id=uuid.uuid4().hex,
+            key=key,
+            context=context,
+            future=future,
+            submitted_at=now,
+            status=DONE,
+            finished_at=now,
+            result=result,
+        )
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[RouteJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._check_timeout(job)
+                if job.status == QUEUED and job.future.running():
+                    job.status = RUNNING
+            return job
+
+    def cancel(self, job_id: str) -> Optional[RouteJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.status not in FINISHED_STATUSES:
+                self._finish(job, CANCELLED)
+                job.future.cancel()
+            return job
+
+    def response(self, job: RouteJob, build: Callable[[RouteJob], Dict]) -> Dict:
+        """Build the response of a finished job once and reuse it afterwards."""
+
+        with job.lock:
+            if job.response is None:
+                job.response = build(job)
+                job.result = job.context = None
+            return job.response
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _complete(
+        self,
+        job: RouteJob,
+        future: Future,
+        on_done: Optional[Callable[[Any, Any], None]] = None,
+    ) -> None:
+        with self._lock:
+            if job.status in FINISHED_STATUSES:
+                return
+            try:
+                job.result, google_calls = future.result()
+            except CancelledError:
+                self._finish(job, CANCELLED)
+                return
+            except Exception as exc:  # noqa: BLE001 - reported through the job status
+                logger.exception("Falha no job de rota %s", job.id)
+                job.error = str(exc) or exc.__class__.__name__
+                self._finish(job, FAILED)
+                return
+            metrics.record_google_calls(google_calls)
+            if on_done is None:
+                self._finish(job, DONE)
+                return
+        # Readers only see DONE once ``on_done`` ran, outside the lock.
+        try:
+            on_done(job.context, job.result)
+        except Exception:  # noqa: BLE001 - the job result stays available
+            logger.exception("Falha ao concluir o job de rota %s", job.id)
+        with self._lock:
+            if job.status not in FINISHED_STATUSES:
+                self._finish(job, DONE)
+
+    def _check_timeout(self, job: RouteJob) -> None:
+        if job.status in FINISHED_STATUSES:
+            return
+        if time.monotonic() - job.submitted_at > self.timeout:
+            job.error = f"Tempo limite de {self.timeout:g}s excedido"
+            self._finish(job, TIMEOUT)
+            job.future.cancel()
+
+    def _finish(self, job: RouteJob, status: str) -> None:
+        job.status = status
+        job.finished_at = time.monotonic()
+        if self._in_flight.get(job.key) == job.id:
+            del self._in_flight[job.key]
+
+    def _prune(self) -> None:
+        cutoff = time.monotonic() - self.retention
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+def _spawn_pool(workers: int) -> Executor:
+    # The pool is created from a request thread; forking there could copy
+    # locks other threads hold (metrics, logging, the road graph) into the
+    # children, locked forever.
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def _run_collecting_metrics(fn: Callable, *args) -> Tuple[Any, list]:
+    """Run ``fn`` in a worker; its Google calls go back to the server process."""
+
+    with metrics.collect_google_calls() as google_calls:
+        result = fn(*args)
+    return result, google_calls
+
+
+JOBS = RouteJobManager()
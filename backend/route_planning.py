@@ -0,0 +1,368 @@
+"""Route planning shared by the synchronous endpoint and the job pool.
+
+A plan has three steps. :func:`prepare_route` reads everything it needs from
+the database in the server process. :func:`solve_route` only touches its
+arguments, so it can run in a worker process. :func:`finish_route` writes what
+was learned back and annotates the stops with ETAs.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+if __package__ in (None, ""):
+    from database import fetch_all, fetch_one
+    from distance_matrix import STORE as DISTANCES
+    from road_network import default_network
+    from routes_logic import (
+        DistanceMatrix,
+        client_key,
+        nearest_neighbor_route,
+        optimize_route_with_google,
+        replan_route,
+    )
+    from settings import env_float
+    from travel_model import MODEL as TRAVEL_MODEL
+    from travel_model import TravelTimeModel
+else:
+    from .database import fetch_all, fetch_one
+    from .distance_matrix import STORE as DISTANCES
+    from .road_network import default_network
+    from .routes_logic import (
+        DistanceMatrix,
+        client_key,
+        nearest_neighbor_route,
+        optimize_route_with_google,
+        replan_route,
+    )
+    from .settings import env_float
+    from .travel_model import MODEL as TRAVEL_MODEL
+    from .travel_model import TravelTimeModel
+
+DEFAULT_START = (-23.55052, -46.633308)  # São Paulo como ponto inicial padrão
+ROUTE_REPLAN_BUDGET_MS = env_float("ROUTE_REPLAN_BUDGET_MS", 200.0)
+
+Point = Tuple[float, float]
+
+
+@dataclass
+class PreparedRoute:
+    """Inputs of one plan, read from the database before solving."""
+
+    start: Point
+    date: Optional[str]
+    replan: bool
+    clients: List[Dict]
+    with_coordinates: List[Dict]
+    missing_coordinates: List[Dict]
+    matrix: DistanceMatrix
+    routing_matrix: DistanceMatrix
+    travel_model: TravelTimeModel
+    departure: datetime
+    previous_order: List[int] = field(default_factory=list)
+    budget_seconds: float = 0.0
+    # Cost of the first hop in the unit of ``routing_matrix``; ``None`` for km.
+    start_costs: Optional[Dict[int, float]] = None
+
+    def solve_args(self, api_key: Optional[str]) -> Tuple:
+        """Positional arguments of :func:`solve_route` for this plan."""
+
+        return (
+            api_key,
+            self.start,
+            self.with_coordinates,
+            self.routing_matrix,
+            self.replan,
+            self.previous_order,
+            self.budget_seconds,
+            self.start_costs,
+        )
+
+    def inputs_hash(self) -> str:
+        """Hash of the start point and the stops to visit."""
+
+        stops = sorted(
+            (client_key(client), client.get("delivery_id"), client.get("latitude"), client.get("longitude"))
+            for client in self.with_coordinates
+        )
+        return _digest({"start": list(self.start), "stops": stops})
+
+    def fingerprint(self) -> str:
+        """Hash of everything that influences the ordering."""
+
+        return _digest(
+            {
+                "inputs": self.inputs_hash(),
+                "replan": self.replan,
+                "previous_order": self.previous_order if self.replan else [],
+                "budget": self.budget_seconds if self.replan else 0,
+                "hour": self.departure.hour if self.travel_model.trained else None,
+            }
+        )
+
+    def restore_order(self, order: Iterable[int]) -> List[Dict]:
+        """Clients with coordinates arranged in ``order``, skipping unknown ids.
+
+        A client with several deliveries appears once per delivery in both,
+        so each id takes the next of its stops.
+        """
+
+        by_id: Dict[int, List[Dict]] = {}
+        for client in self.with_coordinates:
+            by_id.setdefault(client_key(client), []).append(client)
+        restored = []
+        for client_id in order:
+            queue = by_id.get(client_id)
+            if queue:
+                restored.append(queue.pop(0))
+        return restored
+
+
+def _digest(document: Dict) -> str:
+    return hashlib.sha256(json.dumps(document, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _parse_float(value, default: float) -> float:
+    if value in (None, "", []):
+        return float(default)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float(default)
+
+
+def prepare_route(payload: Dict, departure: Optional[datetime] = None) -> PreparedRoute:
+    replan = payload.get("mode") == "replan"
+    default_start = last_driver_position() if replan else DEFAULT_START
+    start = (
+        _parse_float(payload.get("start_latitude"), default_start[0]),
+        _parse_float(payload.get("start_longitude"), default_start[1]),
+    )
+    date = payload.get("date")
+    try:
+        client_ids: Tuple[int, ...] = tuple(int(cid) for cid in payload.get("client_ids") or [])
+    except (TypeError, ValueError):
+        client_ids = ()
+
+    clients = fetch_route_candidates(date, client_ids)
+    with_coordinates = [
+        client
+        for client in clients
+        if client.get("latitude") is not None and client.get("longitude") is not None
+    ]
+    missing_coordinates = [
+        client
+        for client in clients
+        if client.get("latitude") is None or client.get("longitude") is None
+    ]
+
+    matrix = DISTANCES.matrix_for(with_coordinates)
+    travel_model = TRAVEL_MODEL.get()
+    departure = departure or datetime.now(timezone.utc)
+    # Without Google, order stops by learned travel time when history exists.
+    routing_matrix = matrix
+    start_costs = None
+    if travel_model.trained:
+        routing_matrix = travel_model.weight_matrix(matrix, departure.hour)
+        start_costs = travel_model.start_costs(start, with_coordinates, departure.hour)
+    prepared = PreparedRoute(
+        start=start,
+        date=date,
+        replan=replan,
+        clients=clients,
+        with_coordinates=with_coordinates,
+        missing_coordinates=missing_coordinates,
+        matrix=matrix,
+        routing_matrix=routing_matrix,
+        start_costs=start_costs,
+        travel_model=travel_model,
+        departure=departure,
+    )
+    if replan:
+        prepared.previous_order = previous_route_order(date, payload.get("previous_order"))
+        prepared.budget_seconds = replan_budget(payload.get("budget_ms")) / 1000
+    return prepared
+
+
+def solve_route(
+    api_key: Optional[str],
+    start: Point,
+    clients: List[Dict],
+    routing_matrix: Optional[DistanceMatrix],
+    replan: bool = False,
+    previous_order: Optional[List[int]] = None,
+    budget_seconds: float = 0.0,
+    start_costs: Optional[Dict[int, float]] = None,
+) -> Tuple[List[Dict], Optional[Dict], Optional[Dict]]:
+    """Order ``clients``; returns ``(ordered, directions, replan_summary)``.
+
+    Must stay free of database access: the job pool runs it in another
+    process, where the road graph is loaded once per worker.
+    """
+
+    replan_summary: Optional[Dict] = None
+    if replan:
+        # Warm start from the last plan; no external call within the budget.
+        planning_started = time.perf_counter()
+        ordered, inserted = replan_route(
+            start, clients, previous_order or [], routing_matrix, budget_seconds, start_costs
+        )
+        directions = None
+        replan_summary = {
+            "inserted_client_ids": inserted,
+            "planning_ms": round((time.perf_counter() - planning_started) * 1000, 3),
+        }
+    else:
+        ordered, directions = optimize_route_with_google(
+            api_key, start, clients, routing_matrix, road_network=default_network()
+        )
+
+    if not ordered and clients:
+        ordered = nearest_neighbor_route(start, clients, routing_matrix, start_costs)
+        directions = None
+    return ordered, directions, replan_summary
+
+
+def finish_route(prepared: PreparedRoute, ordered: List[Dict], directions: Optional[Dict]) -> None:
+    if directions:
+        record_leg_durations(ordered, directions.get("legs") or [])
+    prepared.travel_model.annotate_etas(prepared.start, ordered, prepared.departure, prepared.matrix)
+    remember_route_order(prepared.date, ordered)
+
+
+def last_driver_position() -> Point:
+    last = fetch_one(
+        "SELECT latitude, longitude FROM driver_positions ORDER BY recorded_ms DESC, id DESC LIMIT 1",
+        (),
+    )
+    if not last:
+        return DEFAULT_START
+    return (last["latitude"], last["longitude"])
+
+
+# Last ordering served per date, used as the warm start of re-plans.
+_route_orders: Dict[str, List[int]] = {}
+_route_orders_lock = threading.Lock()
+
+
+def remember_route_order(date: Optional[str], ordered: Iterable[Dict]) -> None:
+    order = [key for key in (client_key(client) for client in ordered) if key is not None]
+    with _route_orders_lock:
+        _route_orders[date or ""] = order
+
+
+def previous_route_order(date: Optional[str], explicit) -> List[int]:
+    if isinstance(explicit, list):
+        order = []
+        for value in explicit:
+            try:
+                order.append(int(value))
+            except (TypeError, ValueError):
+                continue
+        return order
+    with _route_orders_lock:
+        return list(_route_orders.get(date or "", ()))
+
+
+def replan_budget(value) -> float:
+    budget = _parse_float(value, ROUTE_REPLAN_BUDGET_MS)
+    return min(max(budget, 10.0), 5000.0)
+
+
+def record_leg_durations(ordered: List[Dict], legs: List[Dict]) -> None:
+    # The first leg leaves the start point; the rest join consecutive stops.
+    measured = []
+    for previous, current, leg in zip(ordered, ordered[1:], legs[1:]):
+        origin_id = client_key(previous)
+        destination_id = client_key(current)
+        seconds = (leg.get("duration") or {}).get("value")
+        if origin_id is not None and destination_id is not None and seconds is not None:
+            measured.append((origin_id, destination_id, float(seconds)))
+    DISTANCES.record_durations(measured)
+
+
+def fetch_route_candidates(date: Optional[str], client_ids: Iterable[int]) -> List[Dict]:
+    client_ids_tuple = tuple(client_ids)
+    if client_ids_tuple:
+        placeholders = ",".join(["?"] * len(client_ids_tuple))
+        clients = fetch_all(
+            f"SELECT * FROM clients WHERE id IN ({placeholders}) ORDER BY name",
+            client_ids_tuple,
+        )
+        deliveries_params: Tuple = client_ids_tuple
+        deliveries_query = (
+            "SELECT deliveries.*, clients.name as client_name FROM deliveries "
+            "JOIN clients ON clients.id = deliveries.client_id "
+            f"WHERE deliveries.client_id IN ({placeholders}) AND deliveries.status != 'completed'"
+        )
+        if date:
+            deliveries_query += " AND deliveries.scheduled_date = ?"
+            deliveries_params = client_ids_tuple + (date,)
+        deliveries = fetch_all(deliveries_query, deliveries_params)
+        delivery_map = {delivery["client_id"]: delivery for delivery in deliveries}
+
+        enriched: List[Dict] = []
+        for client in clients:
+            entry = dict(client)
+            delivery = delivery_map.get(client["id"])
+            if delivery:
+                entry.update(
+                    {
+                        "delivery_id": delivery["id"],
+                        "status": delivery["status"],
+                        "scheduled_date": delivery["scheduled_date"],
+                        "client_name": delivery["client_name"],
+                    }
+                )
+            else:
+                entry.update(
+                    {
+                        "delivery_id": None,
+                        "status": "pending",
+                        "scheduled_date": date,
+                        "client_name": client["name"],
+                    }
+                )
+            entry.setdefault("client_id", entry.get("id"))
+            enriched.append(entry)
+        return enriched
+
+    query = (
+        "SELECT clients.*, deliveries.id as delivery_id, deliveries.status, deliveries.scheduled_date, "
+        "clients.name as client_name "
+        "FROM deliveries JOIN clients ON deliveries.client_id = clients.id "
+        "WHERE deliveries.status != 'completed'"
+    )
+    params: Tuple = ()
+    if date:
+        query += " AND deliveries.scheduled_date = ?"
+        params = (date,)
+    query += " ORDER BY deliveries.scheduled_date ASC, deliveries.id ASC"
+    results = fetch_all(query, params)
+    if results:
+        for client in results:
+            client.setdefault("client_id", client.get("client_id") or client.get("id"))
+            client.setdefault("client_name", client.get("client_name") or client.get("name"))
+        return results
+
+    clients = fetch_all("SELECT * FROM clients ORDER BY name")
+    enriched = []
+    for client in clients:
+        entry = dict(client)
+        entry.setdefault("client_id", entry.get("id"))
+        entry.update(
+            {
+                "delivery_id": None,
+                "status": "pending",
+                "scheduled_date": date,
+                "client_name": client.get("name"),
+            }
+        )
+        enriched.append(entry)
+    return enriched
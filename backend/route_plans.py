@@ -0,0 +1,107 @@
+"""Stored route plans and their nightly precomputation.
+
+Plans are kept per delivery date in ``route_plans`` together with the hash of
+the inputs they were computed from (start point, stops and coordinates). A
+request whose inputs still hash the same is answered from the stored ordering;
+ETAs are always recomputed for the actual departure.
+
+After ``ROUTE_PRECOMPUTE_CUTOFF`` (server local time) the scheduler plans the
+next day and keeps re-checking it, so deliveries added late in the evening
+still make it into the morning plan.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+from datetime import date as date_type
+from datetime import datetime, time, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+if __package__ in (None, ""):
+    from database import execute, fetch_one
+    from route_planning import PreparedRoute, finish_route, prepare_route, solve_route
+    from routes_logic import client_key
+    from settings import env_int
+else:
+    from .database import execute, fetch_one
+    from .route_planning import PreparedRoute, finish_route, prepare_route, solve_route
+    from .routes_logic import client_key
+    from .settings import env_int
+
+logger = logging.getLogger(__name__)
+
+ROUTE_PRECOMPUTE_CUTOFF = os.getenv("ROUTE_PRECOMPUTE_CUTOFF", "20:00")
+ROUTE_PRECOMPUTE_INTERVAL_SECONDS = env_int("ROUTE_PRECOMPUTE_INTERVAL_SECONDS", 600)
+# UTC hour the travel model should assume for the next-day departure.
+ROUTE_PRECOMPUTE_DEPARTURE_HOUR = env_int("ROUTE_PRECOMPUTE_DEPARTURE_HOUR", 9)
+
+
+def parse_cutoff(value: str) -> time:
+    try:
+        hours, minutes = value.split(":", 1)
+        return time(int(hours), int(minutes))
+    except ValueError as exc:
+        raise ValueError(f"Horário de corte inválido: {value!r} (use HH:MM)") from exc
+
+
+def load_plan(prepared: PreparedRoute) -> Optional[Tuple[List[Dict], Optional[Dict]]]:
+    """Stored ``(ordered, directions)`` for ``prepared`` if its inputs are unchanged."""
+
+    if not prepared.date or prepared.replan:
+        return None
+    row = fetch_one("SELECT inputs_hash, payload FROM route_plans WHERE plan_date = ?", (prepared.date,))
+    if not row or row["inputs_hash"] != prepared.inputs_hash():
+        return None
+    payload = json.loads(row["payload"])
+    ordered = prepared.restore_order(payload["order"])
+    if len(ordered) != len(prepared.with_coordinates):
+        return None
+    return ordered, payload.get("directions")
+
+
+def store_plan(prepared: PreparedRoute, ordered: List[Dict], directions: Optional[Dict]) -> None:
+    if not prepared.date or prepared.replan:
+        return
+    payload = {
+        "order": [client_key(client) for client in ordered],
+        "directions": directions,
+    }
+    execute(
+        "INSERT INTO route_plans (plan_date, inputs_hash, payload, computed_at) "
+        "VALUES (?, ?, ?, datetime('now')) "
+        "ON CONFLICT(plan_date) DO UPDATE SET inputs_hash = excluded.inputs_hash, "
+        "payload = excluded.payload, computed_at = excluded.computed_at",
+        (prepared.date, prepared.inputs_hash(), json.dumps(payload)),
+    )
+
+
+def precompute_plan(plan_date: str, api_key: Optional[str]) -> bool:
+    """Plan ``plan_date`` unless a plan for the same inputs is stored; True if solved."""
+
+    day = date_type.fromisoformat(plan_date)
+    departure = datetime.combine(day, time(ROUTE_PRECOMPUTE_DEPARTURE_HOUR), tzinfo=timezone.utc)
+    prepared = prepare_route({"date": plan_date}, departure=departure)
+    if not prepared.with_coordinates or load_plan(prepared) is not None:
+        return False
+    ordered, directions, _ = solve_route(*prepared.solve_args(api_key))
+    finish_route(prepared, ordered, directions)
+    store_plan(prepared, ordered, directions)
+    logger.info("Rota de %s pré-calculada com %d paradas", plan_date, len(ordered))
+    return True
+
+
+def precompute_due_plans(api_key: Optional[str], now: Optional[datetime] = None) -> Optional[str]:
+    """Precompute tomorrow's plan once past the cutoff; returns the date planned.
+
+    The cutoff and "tomorrow" follow the server's local clock, the one the
+    bakery closes its day by; only the departure hour is in UTC.
+    """
+
+    now = now or datetime.now()
+    if now.time() < parse_cutoff(ROUTE_PRECOMPUTE_CUTOFF):
+        return None
+    plan_date = (now.date() + timedelta(days=1)).isoformat()
+    execute("DELETE FROM route_plans WHERE plan_date < ?", (now.date().isoformat(),))
+    return plan_date if precompute_plan(plan_date, api_key) else None
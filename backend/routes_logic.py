@@ -3,14 +3,20 @@
 from __future__ import annotations
 
 import json
+import time
 from dataclasses import dataclass
-from datetime import datetime
 from math import asin, cos, radians, sin, sqrt
-from typing import Dict, Iterable, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 from urllib.error import URLError
 from urllib.parse import urlencode
 from urllib.request import urlopen
 
+if __package__ in (None, ""):
+    import metrics
+else:
+    from . import metrics
+
+GOOGLE_DIRECTIONS_URL = "https://maps.googleapis.com/maps/api/directions/json"
 
 
 def haversine_distance(origin: Tuple[float, float], destination: Tuple[float, float]) -> float:
@@ -27,14 +33,56 @@ def haversine_distance(origin: Tuple[float, float], destination: Tuple[float, fl
     return radius_km * c
 
 
-def nearest_neighbor_route(start: Tuple[float, float], clients: List[Dict]) -> List[Dict]:
-    """Simple greedy route ordering by nearest neighbor (fallback when API unavailable)."""
+class DistanceMatrix:
+    """Dense pairwise distances in kilometers between clients, keyed by client id."""
+
+    def __init__(
+        self,
+        ids: Sequence[int],
+        rows: List[List[float]],
+        durations: Optional[Dict[Tuple[int, int], float]] = None,
+    ) -> None:
+        self.index = {client_id: position for position, client_id in enumerate(ids)}
+        self.rows = rows
+        self.durations = durations or {}
+
+    def distance(self, origin_id: int, destination_id: int) -> float:
+        return self.rows[self.index[origin_id]][self.index[destination_id]]
+
+    def duration(self, origin_id: int, destination_id: int) -> Optional[float]:
+        """Known travel time in seconds from origin to destination, if measured."""
+
+        return self.durations.get((origin_id, destination_id))
+
+
+def client_key(client: Dict) -> Optional[int]:
+    value = client.get("client_id") or client.get("id")
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def nearest_neighbor_route(
+    start: Tuple[float, float],
+    clients: List[Dict],
+    matrix: Optional[DistanceMatrix] = None,
+    start_costs: Optional[Dict[int, float]] = None,
+) -> List[Dict]:
+    """Simple greedy route ordering by nearest neighbor (fallback when API unavailable).
+
+    With a :class:`DistanceMatrix` covering every client, only the first hop
+    from ``start`` needs trigonometry (or ``start_costs``, in the matrix's
+    unit, when given); the rest are matrix lookups.
+    """
 
     remaining = [
         client
         for client in clients
         if client.get("latitude") is not None and client.get("longitude") is not None
     ]
+    if matrix is not None and remaining and all(client_key(client) in matrix.index for client in remaining):
+        return _nearest_neighbor_with_matrix(start, remaining, matrix, start_costs)
 
     ordered: List[Dict] = []
     current = start
@@ -52,19 +100,50 @@ def nearest_neighbor_route(start: Tuple[float, float], clients: List[Dict]) -> L
     return ordered
 
 
+def _nearest_neighbor_with_matrix(
+    start: Tuple[float, float],
+    clients: List[Dict],
+    matrix: DistanceMatrix,
+    start_costs: Optional[Dict[int, float]] = None,
+) -> List[Dict]:
+    positions = [matrix.index[client_key(client)] for client in clients]
+    remaining = list(range(len(clients)))
+    if start_costs is not None:
+        current = min(remaining, key=lambda item: start_costs[client_key(clients[item])])
+    else:
+        current = min(
+            remaining,
+            key=lambda item: haversine_distance(
+                start,
+                (float(clients[item]["latitude"]), float(clients[item]["longitude"])),
+            ),
+        )
+    order = [current]
+    remaining.remove(current)
+    while remaining:
+        row = matrix.rows[positions[current]]
+        current = min(remaining, key=lambda item: row[positions[item]])
+        order.append(current)
+        remaining.remove(current)
+    return [clients[item] for item in order]
+
+
 def optimize_route_with_google(
     api_key: Optional[str],
     start: Tuple[float, float],
     clients: List[Dict],
+    matrix: Optional[DistanceMatrix] = None,
+    road_network=None,
 ) -> Tuple[List[Dict], Optional[Dict]]:
     """Return ordered clients and optional route metadata using Google Directions.
 
     When the API key is missing or the request fails, fall back to the
-    :func:`nearest_neighbor_route` implementation.
+    :func:`nearest_neighbor_route` implementation, over driving times from
+    ``road_network`` (a :class:`road_network.RoadNetwork`) when one is given.
     """
 
     if not api_key:
-        return nearest_neighbor_route(start, clients), None
+        return _offline_route(start, clients, matrix, road_network), None
 
     waypoints: List[str] = []
     coordinate_clients: List[Tuple[str, Dict]] = []
@@ -92,21 +171,26 @@ def optimize_route_with_google(
     # Remove None values to keep the querystring clean.
     query = {key: value for key, value in payload.items() if value is not None}
 
+    started = time.perf_counter()
     try:
         with urlopen(
-            "https://maps.googleapis.com/maps/api/directions/json?" + urlencode(query, doseq=True),
+            GOOGLE_DIRECTIONS_URL + "?" + urlencode(query, doseq=True),
             timeout=10,
         ) as response:
             raw = response.read().decode("utf-8")
     except (URLError, TimeoutError):
-        return nearest_neighbor_route(start, clients), None
+        metrics.observe_google_call("network_error", time.perf_counter() - started)
+        return _offline_route(start, clients, matrix, road_network), None
 
     try:
         data = json.loads(raw)
     except json.JSONDecodeError:
-        return nearest_neighbor_route(start, clients), None
+        metrics.observe_google_call("invalid_response", time.perf_counter() - started)
+        return _offline_route(start, clients, matrix, road_network), None
     if data.get("status") != "OK":
-        return nearest_neighbor_route(start, clients), None
+        metrics.observe_google_call("api_error", time.perf_counter() - started)
+        return _offline_route(start, clients, matrix, road_network), None
+    metrics.observe_google_call("ok", time.perf_counter() - started)
 
     route = data["routes"][0]
     waypoint_order = route.get("waypoint_order", [])
@@ -128,12 +212,58 @@ def optimize_route_with_google(
     return ordered_clients, metadata
 
 
+def _offline_route(
+    start: Tuple[float, float],
+    clients: List[Dict],
+    matrix: Optional[DistanceMatrix],
+    road_network,
+) -> List[Dict]:
+    if road_network is not None:
+        routable = [
+            client
+            for client in clients
+            if client.get("latitude") is not None
+            and client.get("longitude") is not None
+            and client_key(client) is not None
+        ]
+        road = road_network.route_matrix(start, routable) if routable else None
+        if road is not None:
+            road_matrix, start_costs = road
+            return nearest_neighbor_route(start, routable, road_matrix, start_costs)
+    return nearest_neighbor_route(start, clients, matrix)
+
+
 @dataclass
 class VisitDetectionResult:
     delivery_id: int
     client_id: int
     stay_seconds: int
-    detected_at: datetime
+    detected_ms: int
+
+
+def first_visit_window(
+    samples: Iterable[Tuple[float, float]],
+    threshold_meters: float,
+    min_duration: float,
+) -> Optional[Tuple[float, float]]:
+    """Return the first ``(start, end)`` stay within ``threshold_meters``.
+
+    ``samples`` are ``(seconds, distance_meters)`` pairs in chronological
+    order. A stay counts once it lasts at least ``min_duration`` seconds; a
+    stay still open at the end of the samples is also considered.
+    """
+
+    window: Optional[Tuple[float, float]] = None
+    for seconds, distance in samples:
+        if distance <= threshold_meters:
+            window = (seconds, seconds) if window is None else (window[0], seconds)
+        elif window is not None:
+            if window[1] - window[0] >= min_duration:
+                return window
+            window = None
+    if window is not None and window[1] - window[0] >= min_duration:
+        return window
+    return None
 
 
 def detect_visit_events(
@@ -142,20 +272,24 @@ def detect_visit_events(
     threshold_meters: float = 80.0,
     min_duration: int = 90,
 ) -> List[VisitDetectionResult]:
-    """Return deliveries where the driver stayed within range for long enough."""
+    """Return deliveries where the driver stayed within range for long enough.
+
+    ``positions`` carry ``recorded_ms`` epoch milliseconds, in order.
+    """
 
     by_delivery: List[VisitDetectionResult] = []
-    trajectory: List[Tuple[datetime, float, float]] = []
+    trajectory: List[Tuple[int, float, float]] = []
     for position in positions:
-        try:
-            timestamp = datetime.fromisoformat(position["timestamp"])
-        except (KeyError, ValueError):
+        recorded_ms = position.get("recorded_ms")
+        if recorded_ms is None:
             continue
-        trajectory.append((timestamp, float(position["latitude"]), float(position["longitude"])))
+        trajectory.append((int(recorded_ms), float(position["latitude"]), float(position["longitude"])))
 
     if not trajectory:
         return by_delivery
 
+    origin = trajectory[0][0]
+    offsets = [(recorded_ms - origin) / 1000 for recorded_ms, _, _ in trajectory]
     for delivery in deliveries:
         client_lat = delivery.get("latitude")
         client_lon = delivery.get("longitude")
@@ -166,37 +300,134 @@ def detect_visit_events(
         if delivery_identifier is None or client_identifier is None:
             continue
 
-        inside_window: Optional[Tuple[datetime, datetime]] = None
-        for timestamp, lat, lon in trajectory:
-            distance = haversine_distance((lat, lon), (float(client_lat), float(client_lon))) * 1000
-            if distance <= threshold_meters:
-                if inside_window is None:
-                    inside_window = (timestamp, timestamp)
-                else:
-                    inside_window = (inside_window[0], timestamp)
-            elif inside_window is not None:
-                start, end = inside_window
-                if (end - start).total_seconds() >= min_duration:
-                    by_delivery.append(
-                        VisitDetectionResult(
-                            delivery_id=int(delivery_identifier),
-                            client_id=int(client_identifier),
-                            stay_seconds=int((end - start).total_seconds()),
-                            detected_at=end,
-                        )
-                    )
-                    break
-                inside_window = None
-        if inside_window is not None:
-            start, end = inside_window
-            if (end - start).total_seconds() >= min_duration:
-                by_delivery.append(
-                    VisitDetectionResult(
-                        delivery_id=int(delivery_identifier),
-                        client_id=int(client_identifier),
-                        stay_seconds=int((end - start).total_seconds()),
-                        detected_at=end,
-                    )
-                )
+        target = (float(client_lat), float(client_lon))
+        samples = (
+            (offset, haversine_distance((lat, lon), target) * 1000)
+            for offset, (_, lat, lon) in zip(offsets, trajectory)
+        )
+        window = first_visit_window(samples, threshold_meters, min_duration)
+        if window is None:
+            continue
+        start, end = window
+        by_delivery.append(
+            VisitDetectionResult(
+                delivery_id=int(delivery_identifier),
+                client_id=int(client_identifier),
+                stay_seconds=int(end - start),
+                detected_ms=origin + round(end * 1000),
+            )
+        )
 
     return by_delivery
+
+
+def replan_route(
+    start: Tuple[float, float],
+    clients: List[Dict],
+    previous_order: Sequence[int],
+    matrix: DistanceMatrix,
+    budget_seconds: float = 0.2,
+    start_costs: Optional[Dict[int, float]] = None,
+) -> Tuple[List[Dict], List[int]]:
+    """Re-optimize the remaining stops using the previous ordering as warm start.
+
+    Stops of ``previous_order`` that are no longer in ``clients`` (completed
+    or removed) are dropped, new clients are placed by cheapest insertion and
+    the path from ``start`` is then improved with 2-opt moves until no move
+    helps or ``budget_seconds`` runs out. ``matrix`` must cover ``clients``.
+    Hops from ``start`` cost ``start_costs[client_id]`` when given, which must
+    then be in the matrix's unit, and the straight-line kilometres otherwise.
+    Returns the ordered clients and the ids of the clients that were inserted.
+    """
+
+    deadline = time.perf_counter() + max(0.0, budget_seconds)
+    nodes = [
+        client
+        for client in clients
+        if client.get("latitude") is not None
+        and client.get("longitude") is not None
+        and client_key(client) in matrix.index
+    ]
+    if not nodes:
+        return [], []
+
+    by_id: Dict[int, List[int]] = {}
+    for position, client in enumerate(nodes):
+        by_id.setdefault(client_key(client), []).append(position)
+
+    # Path over node positions; index 0 of ``cost`` is the start point.
+    path: List[int] = []
+    for client_id in previous_order:
+        queue = by_id.get(client_id)
+        if queue:
+            path.append(queue.pop(0))
+    kept = set(path)
+    fresh = [position for position in range(len(nodes)) if position not in kept]
+
+    points = [matrix.index[client_key(client)] for client in nodes]
+    first_hops = [
+        start_costs[client_key(client)]
+        if start_costs is not None
+        else haversine_distance(start, (float(client["latitude"]), float(client["longitude"])))
+        for client in nodes
+    ]
+
+    def cost(a: int, b: int) -> float:
+        # ``a``/``b`` are node positions, -1 stands for the start point.
+        if a == -1:
+            return first_hops[b]
+        if b == -1:
+            return first_hops[a]
+        return matrix.rows[points[a]][points[b]]
+
+    for node in fresh:
+        best_position, best_delta = len(path), None
+        previous = -1
+        for position in range(len(path) + 1):
+            following = path[position] if position < len(path) else None
+            if following is None:
+                delta = cost(previous, node)
+            else:
+                delta = cost(previous, node) + cost(node, following) - cost(previous, following)
+            if best_delta is None or delta < best_delta:
+                best_position, best_delta = position, delta
+            previous = following if following is not None else previous
+        path.insert(best_position, node)
+
+    _two_opt(path, cost, deadline)
+    ordered = [nodes[position] for position in path]
+    inserted = [client_key(nodes[position]) for position in fresh]
+    return ordered, inserted
+
+
+def _two_opt(path: List[int], cost, deadline: float) -> None:
+    """Improve an open path starting at the start point (-1) in place.
+
+    ``cost`` may be asymmetric: reversing ``path[i:j+1]`` also turns every
+    edge inside the segment around, so ``inner`` tracks what that costs.
+    """
+
+    size = len(path)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(size - 1):
+            if time.perf_counter() >= deadline:
+                return
+            before = path[i - 1] if i > 0 else -1
+            first = path[i]
+            base = cost(before, first)
+            inner = 0.0
+            for j in range(i + 1, size):
+                last = path[j]
+                inner += cost(last, path[j - 1]) - cost(path[j - 1], last)
+                after = path[j + 1] if j + 1 < size else None
+                delta = cost(before, last) - base + inner
+                if after is not None:
+                    delta += cost(first, after) - cost(last, after)
+                if delta < -1e-9:
+                    path[i : j + 1] = reversed(path[i : j + 1])
+                    improved = True
+                    first = path[i]
+                    base = cost(before, first)
+                    inner = -inner
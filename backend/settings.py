@@ -0,0 +1,30 @@
+"""Numeric settings read from environment variables.
+
+Modules read their settings at import time; a malformed value stops the
+server with a message naming the variable instead of a bare ``ValueError``.
+An unset or empty variable falls back to the default.
+"""
+
+from __future__ import annotations
+
+import os
+
+
+def env_int(name: str, default: int) -> int:
+    raw = os.getenv(name, "").strip()
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        raise ValueError(f"Variável de ambiente {name} deve ser um número inteiro: {raw!r}") from None
+
+
+def env_float(name: str, default: float) -> float:
+    raw = os.getenv(name, "").strip()
+    if not raw:
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        raise ValueError(f"Variável de ambiente {name} deve ser um número: {raw!r}") from None
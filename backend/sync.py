@@ -0,0 +1,126 @@
+"""Delta synchronisation of clients and deliveries for offline-first clients.
+
+Triggers append every insert, update and delete of ``clients`` and
+``deliveries`` to ``change_log``. A client remembers the ``seq`` of its last
+sync and asks only for what changed after it; ``since=0`` asks for everything.
+
+Compaction keeps only the newest entry per row and drops entries older than
+``SYNC_LOG_RETENTION_DAYS``. A client whose ``since`` falls before the dropped
+range gets a full snapshot flagged with ``reset`` and must replace its copy.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, List, Optional
+
+if __package__ in (None, ""):
+    from database import fetch_all, fetch_one, get_connection
+    from settings import env_int
+else:
+    from .database import fetch_all, fetch_one, get_connection
+    from .settings import env_int
+
+SYNC_PAGE_SIZE = env_int("SYNC_PAGE_SIZE", 1000)
+SYNC_LOG_RETENTION_DAYS = env_int("SYNC_LOG_RETENTION_DAYS", 30)
+SYNC_COMPACT_INTERVAL_SECONDS = env_int("SYNC_COMPACT_INTERVAL_SECONDS", 3600)
+SYNCED_TABLES = ("clients", "deliveries")
+# SQLite caps the number of bound parameters per statement.
+MAX_IN_PARAMS = 400
+
+
+def parse_since(value: Optional[str]) -> int:
+    if value in (None, ""):
+        return 0
+    try:
+        since = int(value)
+    except ValueError:
+        since = -1
+    if since < 0:
+        raise ValueError("since deve ser um número inteiro maior ou igual a zero")
+    return since
+
+
+def compacted_through() -> int:
+    row = fetch_one("SELECT value FROM sync_state WHERE name = 'compacted_through'", ())
+    return int(row["value"]) if row else 0
+
+
+def changes_since(since: int, limit: int = SYNC_PAGE_SIZE) -> Dict:
+    """Rows changed after ``since``, at most ``limit`` log entries per page."""
+
+    # AUTOINCREMENT keeps the high-water mark even after compaction empties the log.
+    row = fetch_one("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'", ())
+    latest = row["seq"] if row else 0
+    if since <= 0 or since > latest or since < compacted_through():
+        return snapshot(since, latest)
+
+    entries = fetch_all(
+        "SELECT seq, table_name, row_id, operation FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?",
+        (since, limit + 1),
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    operations: Dict[str, Dict[int, str]] = {table: {} for table in SYNCED_TABLES}
+    for entry in entries:
+        if entry["table_name"] in operations:
+            operations[entry["table_name"]][entry["row_id"]] = entry["operation"]
+
+    response: Dict = {
+        "since": since,
+        "seq": entries[-1]["seq"] if entries else since,
+        "reset": False,
+        "has_more": has_more,
+    }
+    for table, latest_operation in operations.items():
+        upserted_ids = [row_id for row_id, operation in latest_operation.items() if operation == "upsert"]
+        rows = _fetch_rows(table, upserted_ids)
+        present = {row["id"] for row in rows}
+        # Rows deleted after this page show up as deletions right away.
+        deleted = sorted(row_id for row_id in latest_operation if row_id not in present)
+        response[table] = {"upserted": rows, "deleted": deleted}
+    return response
+
+
+def snapshot(since: int, seq: int) -> Dict:
+    """Every synced row; ``seq`` is read first so later changes are re-sent, not lost."""
+
+    response: Dict = {"since": since, "seq": seq, "reset": True, "has_more": False}
+    for table in SYNCED_TABLES:
+        response[table] = {"upserted": fetch_all(f"SELECT * FROM {table} ORDER BY id"), "deleted": []}
+    return response
+
+
+def _fetch_rows(table: str, ids: List[int]) -> List[Dict]:
+    rows: List[Dict] = []
+    for offset in range(0, len(ids), MAX_IN_PARAMS):
+        chunk = ids[offset : offset + MAX_IN_PARAMS]
+        placeholders = ",".join("?" * len(chunk))
+        rows.extend(fetch_all(f"SELECT * FROM {table} WHERE id IN ({placeholders}) ORDER BY id", chunk))
+    return rows
+
+
+def compact_change_log(retention_days: int = SYNC_LOG_RETENTION_DAYS) -> Dict[str, int]:
+    """Drop superseded entries and entries older than ``retention_days``."""
+
+    conn = get_connection()
+    try:
+        with conn:
+            superseded = conn.execute(
+                "DELETE FROM change_log WHERE seq NOT IN "
+                "(SELECT MAX(seq) FROM change_log GROUP BY table_name, row_id)"
+            ).rowcount
+            cutoff = conn.execute(
+                "SELECT MAX(seq) FROM change_log WHERE changed_at < datetime('now', ?)",
+                (f"-{retention_days} days",),
+            ).fetchone()[0]
+            expired = 0
+            if cutoff is not None:
+                expired = conn.execute("DELETE FROM change_log WHERE seq <= ?", (cutoff,)).rowcount
+                conn.execute(
+                    "INSERT INTO sync_state (name, value) VALUES ('compacted_through', ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)",
+                    (cutoff,),
+                )
+    finally:
+        conn.close()
+    return {"superseded": superseded, "expired": expired}
@@ -0,0 +1,342 @@
+"""Travel-time model learned from recorded deliveries and GPS traces.
+
+Two sources feed the model, both processed incrementally from a watermark
+kept in ``travel_model_state``:
+
+* legs between consecutive completed deliveries of a day (departure from one
+  client to arrival at the next), aggregated per directed client pair and
+  hour of day in ``travel_leg_stats``;
+* consecutive ``driver_positions`` fixes, aggregated into moving speed per
+  hour of day in ``travel_speed_stats``.
+
+Hours are UTC, like every timestamp the backend stores.
+
+Run ``python -m backend.travel_model`` to update the model from the command
+line; the server also refreshes it periodically.
+"""
+
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+if __package__ in (None, ""):
+    from archive import connect_history
+    from database import execute_many, fetch_all, fetch_one, iter_rows
+    from routes_logic import DistanceMatrix, client_key, haversine_distance
+else:
+    from .archive import connect_history
+    from .database import execute_many, fetch_all, fetch_one, iter_rows
+    from .routes_logic import DistanceMatrix, client_key, haversine_distance
+
+DEFAULT_SPEED_KMH = 22.0
+# Straight-line distance underestimates the road distance between clients.
+DETOUR_FACTOR = 1.35
+DEFAULT_STOP_SECONDS = 300.0
+MIN_LEG_SAMPLES = 2
+MAX_LEG_SECONDS = 3 * 3600
+MAX_FIX_GAP_SECONDS = 120
+MIN_MOVING_KMH = 3.0
+MS_PER_HOUR = 3_600_000
+MAX_MOVING_KMH = 130.0
+
+LegKey = Tuple[int, int, int]
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+@dataclass
+class TravelTimeModel:
+    legs: Dict[LegKey, Tuple[int, float]]
+    speeds: Dict[int, Tuple[float, float]]
+    stop_seconds: float = DEFAULT_STOP_SECONDS
+
+    def __post_init__(self) -> None:
+        # Precomputed so that estimates are a couple of dict lookups.
+        self._pairs: Dict[Tuple[int, int], Tuple[int, float]] = {}
+        for (origin, destination, _), (samples, total) in self.legs.items():
+            count, seconds = self._pairs.get((origin, destination), (0, 0.0))
+            self._pairs[(origin, destination)] = (count + samples, seconds + total)
+        all_km = sum(km for km, _ in self.speeds.values())
+        all_seconds = sum(seconds for _, seconds in self.speeds.values())
+        overall = all_km / all_seconds * 3600 if all_seconds > 0 else DEFAULT_SPEED_KMH
+        self._speeds = {
+            hour: (
+                self.speeds[hour][0] / self.speeds[hour][1] * 3600
+                if hour in self.speeds and self.speeds[hour][1] > 0
+                else overall
+            )
+            for hour in range(24)
+        }
+
+    @property
+    def trained(self) -> bool:
+        return bool(self.legs or self.speeds)
+
+    def speed_kmh(self, hour: int) -> float:
+        return self._speeds[hour % 24]
+
+    def estimate_seconds(
+        self,
+        origin_id: Optional[int],
+        destination_id: Optional[int],
+        distance_km: float,
+        hour: int,
+    ) -> float:
+        """Expected driving time, preferring observed legs over average speed."""
+
+        if (origin_id, destination_id) in self._pairs:
+            samples, total = self.legs.get((origin_id, destination_id, hour), (0, 0.0))
+            if samples >= MIN_LEG_SAMPLES:
+                return total / samples
+            samples, total = self._pairs[(origin_id, destination_id)]
+            if samples >= MIN_LEG_SAMPLES:
+                return total / samples
+        return distance_km * DETOUR_FACTOR / self.speed_kmh(hour) * 3600
+
+    def start_costs(self, start: Tuple[float, float], clients: Iterable[Dict], hour: int) -> Dict[int, float]:
+        """Expected seconds from ``start`` to each client, the unit of :meth:`weight_matrix`."""
+
+        return {
+            client_key(client): self.estimate_seconds(
+                None,
+                client_key(client),
+                haversine_distance(start, (float(client["latitude"]), float(client["longitude"]))),
+                hour,
+            )
+            for client in clients
+        }
+
+    def weight_matrix(self, matrix: DistanceMatrix, hour: int) -> DistanceMatrix:
+        """Return a matrix of expected seconds to order stops by travel time."""
+
+        ids = sorted(matrix.index, key=matrix.index.__getitem__)
+        seconds_per_km = DETOUR_FACTOR / self.speed_kmh(hour) * 3600
+        rows = [[distance * seconds_per_km for distance in row] for row in matrix.rows]
+        position = matrix.index
+        for origin, destination in self._pairs:
+            if origin in position and destination in position and origin != destination:
+                i, j = position[origin], position[destination]
+                rows[i][j] = self.estimate_seconds(origin, destination, matrix.rows[i][j], hour)
+        return DistanceMatrix(ids, rows, matrix.durations)
+
+    def annotate_etas(
+        self,
+        start: Tuple[float, float],
+        ordered: Sequence[Dict],
+        departure: datetime,
+        matrix: Optional[DistanceMatrix] = None,
+    ) -> None:
+        """Add ``eta_seconds`` and ``eta`` (UTC ISO) to each stop of ``ordered``."""
+
+        elapsed = 0.0
+        previous_id: Optional[int] = None
+        previous_point = start
+        for client in ordered:
+            point = (float(client["latitude"]), float(client["longitude"]))
+            current_id = client_key(client)
+            moment = departure + timedelta(seconds=elapsed)
+            if matrix is not None and previous_id in matrix.index and current_id in matrix.index:
+                distance = matrix.distance(previous_id, current_id)
+            else:
+                distance = haversine_distance(previous_point, point)
+            elapsed += self.estimate_seconds(previous_id, current_id, distance, moment.hour)
+            client["eta_seconds"] = int(elapsed)
+            client["eta"] = (departure + timedelta(seconds=elapsed)).isoformat(timespec="seconds")
+            elapsed += self.stop_seconds
+            previous_id, previous_point = current_id, point
+
+
+def load_model() -> TravelTimeModel:
+    legs = {
+        (row["origin_id"], row["destination_id"], row["hour"]): (row["samples"], row["total_seconds"])
+        for row in fetch_all("SELECT * FROM travel_leg_stats")
+    }
+    speeds = {
+        row["hour"]: (row["total_km"], row["total_seconds"])
+        for row in fetch_all("SELECT * FROM travel_speed_stats")
+    }
+    state = _read_state()
+    stop_samples = state.get("stop_samples", 0.0)
+    stop_seconds = state.get("stop_total_seconds", 0.0) / stop_samples if stop_samples else DEFAULT_STOP_SECONDS
+    return TravelTimeModel(legs, speeds, stop_seconds)
+
+
+def _read_state() -> Dict[str, float]:
+    return {row["name"]: row["value"] for row in fetch_all("SELECT name, value FROM travel_model_state")}
+
+
+def _write_state(values: Dict[str, float]) -> None:
+    execute_many(
+        "INSERT INTO travel_model_state (name, value) VALUES (?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+        values.items(),
+    )
+
+
+def extract_legs(deliveries: Iterable[Dict]) -> List[Tuple[int, int, int, float]]:
+    """Legs ``(origin, destination, hour, seconds)`` between consecutive stops.
+
+    ``deliveries`` must belong to one day and be ordered by arrival.
+    """
+
+    legs: List[Tuple[int, int, int, float]] = []
+    previous: Optional[Dict] = None
+    for delivery in deliveries:
+        if previous is not None:
+            departed = _parse_timestamp(previous.get("departed_at") or previous.get("completed_at"))
+            arrived = _parse_timestamp(delivery.get("arrived_at"))
+            if departed and arrived and previous["client_id"] != delivery["client_id"]:
+                seconds = (arrived - departed).total_seconds()
+                if 0 < seconds <= MAX_LEG_SECONDS:
+                    legs.append((previous["client_id"], delivery["client_id"], departed.hour, seconds))
+        previous = delivery
+    return legs
+
+
+def _update_legs(state: Dict[str, float], today: str) -> Tuple[int, Dict[str, float]]:
+    # Days are stored as the ordinal of the date so the state table stays numeric.
+    last_day = state.get("last_leg_day")
+    after = datetime.fromordinal(int(last_day)).date().isoformat() if last_day else ""
+    rows = iter_rows(
+        "SELECT client_id, scheduled_date, arrived_at, departed_at, completed_at, stay_seconds "
+        "FROM deliveries_history WHERE status = 'completed' AND arrived_at IS NOT NULL "
+        "AND scheduled_date > ? AND scheduled_date < ? "
+        "ORDER BY scheduled_date ASC, arrived_at ASC",
+        (after, today),
+        connect=connect_history,
+    )
+    aggregated: Dict[LegKey, Tuple[int, float]] = {}
+    stop_samples = 0
+    stop_total = 0.0
+    newest_day: Optional[str] = None
+    day_rows: List[Dict] = []
+
+    def flush() -> None:
+        for origin, destination, hour, seconds in extract_legs(day_rows):
+            count, total = aggregated.get((origin, destination, hour), (0, 0.0))
+            aggregated[(origin, destination, hour)] = (count + 1, total + seconds)
+
+    for row in rows:
+        if day_rows and row["scheduled_date"] != day_rows[-1]["scheduled_date"]:
+            flush()
+            day_rows = []
+        day_rows.append(row)
+        newest_day = row["scheduled_date"]
+        if row["stay_seconds"]:
+            stop_samples += 1
+            stop_total += row["stay_seconds"]
+    if day_rows:
+        flush()
+
+    if aggregated:
+        execute_many(
+            "INSERT INTO travel_leg_stats (origin_id, destination_id, hour, samples, total_seconds) "
+            "VALUES (?, ?, ?, ?, ?) ON CONFLICT(origin_id, destination_id, hour) DO UPDATE SET "
+            "samples = samples + excluded.samples, total_seconds = total_seconds + excluded.total_seconds",
+            [key + value for key, value in aggregated.items()],
+        )
+    updates: Dict[str, float] = {}
+    if newest_day:
+        updates["last_leg_day"] = float(datetime.fromisoformat(newest_day).toordinal())
+    if stop_samples:
+        updates["stop_samples"] = state.get("stop_samples", 0.0) + stop_samples
+        updates["stop_total_seconds"] = state.get("stop_total_seconds", 0.0) + stop_total
+    return sum(count for count, _ in aggregated.values()), updates
+
+
+def _update_speeds(state: Dict[str, float]) -> Tuple[int, Dict[str, float]]:
+    last_id = int(state.get("last_position_id", 0))
+    columns = "SELECT id, recorded_ms, latitude, longitude FROM driver_positions"
+    previous = fetch_one(f"{columns} WHERE id = ?", (last_id,)) if last_id else None
+    speeds: Dict[int, Tuple[float, float]] = {}
+    newest_id = last_id
+    samples = 0
+    for row in iter_rows(f"{columns} WHERE id > ? ORDER BY id ASC", (last_id,)):
+        newest_id = row["id"]
+        if previous is not None:
+            started = previous["recorded_ms"]
+            ended = row["recorded_ms"]
+            if started is not None and ended is not None:
+                seconds = (ended - started) / 1000
+                if 0 < seconds <= MAX_FIX_GAP_SECONDS:
+                    km = haversine_distance(
+                        (previous["latitude"], previous["longitude"]),
+                        (row["latitude"], row["longitude"]),
+                    )
+                    kmh = km / seconds * 3600
+                    if MIN_MOVING_KMH <= kmh <= MAX_MOVING_KMH:
+                        hour = started // MS_PER_HOUR % 24
+                        total_km, total_seconds = speeds.get(hour, (0.0, 0.0))
+                        speeds[hour] = (total_km + km, total_seconds + seconds)
+                        samples += 1
+        previous = row
+    if speeds:
+        execute_many(
+            "INSERT INTO travel_speed_stats (hour, total_km, total_seconds) VALUES (?, ?, ?) "
+            "ON CONFLICT(hour) DO UPDATE SET total_km = total_km + excluded.total_km, "
+            "total_seconds = total_seconds + excluded.total_seconds",
+            [(hour, km, seconds) for hour, (km, seconds) in speeds.items()],
+        )
+    return samples, ({"last_position_id": float(newest_id)} if newest_id != last_id else {})
+
+
+def update_model(today: Optional[str] = None) -> Dict[str, int]:
+    """Fold history recorded since the last update into the model tables.
+
+    Only days before ``today`` contribute legs, so a day is never counted
+    while its deliveries are still being made.
+    """
+
+    state = _read_state()
+    legs, leg_state = _update_legs(state, today or datetime.now(timezone.utc).date().isoformat())
+    moves, speed_state = _update_speeds(state)
+    _write_state({**leg_state, **speed_state})
+    return {"legs": legs, "moves": moves}
+
+
+class TravelModelCache:
+    """Keeps the last loaded model and refreshes it after updates."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._model: Optional[TravelTimeModel] = None
+
+    def get(self) -> TravelTimeModel:
+        with self._lock:
+            if self._model is None:
+                self._model = load_model()
+            return self._model
+
+    def refresh(self) -> Dict[str, int]:
+        summary = update_model()
+        model = load_model()
+        with self._lock:
+            self._model = model
+        return summary
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._model = None
+
+
+MODEL = TravelModelCache()
+
+
+if __name__ == "__main__":
+    if __package__ in (None, ""):
+        from database import initialize
+    else:
+        from .database import initialize
+
+    initialize()
+    print(update_model())
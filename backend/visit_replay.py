@@ -0,0 +1,261 @@
+"""Offline replay of recorded trajectories to tune visit detection.
+
+Example::
+
+    python -m backend.visit_replay --from 2024-05-01 --to 2024-05-31 \\
+        --thresholds 50,80,120 --durations 60,90,180
+
+Each day of ``driver_positions`` is replayed against the deliveries
+scheduled for that day and the detections are scored against confirmed
+``delivery_visits``. Days are spread over a process pool; within a day the
+distance from every fix to every client is computed once and then reused for
+the whole parameter grid, so sweeping many combinations costs little more
+than replaying one.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from functools import partial
+from itertools import product
+from math import cos, radians
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+if __package__ in (None, ""):
+    from archive import attach_archive_readonly
+    from database import DB_PATH, epoch_ms
+    from routes_logic import first_visit_window, haversine_distance
+else:
+    from .archive import attach_archive_readonly
+    from .database import DB_PATH, epoch_ms
+    from .routes_logic import first_visit_window, haversine_distance
+
+Params = Tuple[float, int]
+Samples = List[Tuple[float, float]]
+
+METERS_PER_DEGREE = 111_320.0
+# Stand-in distance for fixes that are clearly outside every threshold.
+FAR_AWAY = float("inf")
+
+
+@dataclass
+class Score:
+    true_positives: int = 0
+    false_positives: int = 0
+    false_negatives: int = 0
+
+    def add(self, other: "Score") -> None:
+        self.true_positives += other.true_positives
+        self.false_positives += other.false_positives
+        self.false_negatives += other.false_negatives
+
+    @property
+    def precision(self) -> float:
+        predicted = self.true_positives + self.false_positives
+        return self.true_positives / predicted if predicted else 0.0
+
+    @property
+    def recall(self) -> float:
+        expected = self.true_positives + self.false_negatives
+        return self.true_positives / expected if expected else 0.0
+
+    @property
+    def f1(self) -> float:
+        total = self.precision + self.recall
+        return 2 * self.precision * self.recall / total if total else 0.0
+
+
+def _connect_readonly(db_path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    # Archived days keep their positions in the main file; their deliveries
+    # and visits are only reachable through the history views.
+    return attach_archive_readonly(conn, db_path)
+
+
+def _day_start_ms(day: date) -> int:
+    return epoch_ms(datetime(day.year, day.month, day.day))
+
+
+def list_days(db_path: Path, date_from: Optional[date], date_to: Optional[date]) -> List[str]:
+    conditions, params = [], []
+    if date_from:
+        conditions.append("recorded_ms >= ?")
+        params.append(_day_start_ms(date_from))
+    if date_to:
+        conditions.append("recorded_ms < ?")
+        params.append(_day_start_ms(date_to + timedelta(days=1)))
+    query = "SELECT DISTINCT date(recorded_ms / 1000, 'unixepoch') AS day FROM driver_positions"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    conn = _connect_readonly(db_path)
+    try:
+        return [row["day"] for row in conn.execute(query + " ORDER BY day", params) if row["day"]]
+    finally:
+        conn.close()
+
+
+def _distance_samples(
+    trajectory: Sequence[Tuple[float, float, float]],
+    target: Tuple[float, float],
+    max_threshold: float,
+) -> Samples:
+    """Distances from ``target`` along the trajectory, computed once per day.
+
+    Fixes outside a cheap bounding box around ``target`` cannot fall under any
+    threshold of the grid; they skip the trigonometry and runs of them are
+    collapsed into a single marker, which preserves the window semantics.
+    """
+
+    lat_margin = max_threshold / METERS_PER_DEGREE
+    lon_margin = lat_margin / max(cos(radians(target[0])), 1e-6)
+    samples: Samples = []
+    previous_far = False
+    for seconds, lat, lon in trajectory:
+        if abs(lat - target[0]) > lat_margin or abs(lon - target[1]) > lon_margin:
+            if not previous_far:
+                samples.append((seconds, FAR_AWAY))
+                previous_far = True
+            continue
+        samples.append((seconds, haversine_distance((lat, lon), target) * 1000))
+        previous_far = False
+    return samples
+
+
+def replay_day(db_path: Path, day: str, grid: Sequence[Params]) -> Dict[Params, Score]:
+    """Score every parameter combination of ``grid`` on one recorded day."""
+
+    conn = _connect_readonly(db_path)
+    try:
+        start = date.fromisoformat(day)
+        positions = conn.execute(
+            "SELECT recorded_ms, latitude, longitude FROM driver_positions "
+            "WHERE recorded_ms >= ? AND recorded_ms < ? ORDER BY recorded_ms ASC",
+            (_day_start_ms(start), _day_start_ms(start + timedelta(days=1))),
+        ).fetchall()
+        deliveries = conn.execute(
+            "SELECT deliveries.id, clients.latitude, clients.longitude FROM deliveries_history AS deliveries "
+            "JOIN clients ON clients.id = deliveries.client_id "
+            "WHERE deliveries.scheduled_date = ? AND clients.latitude IS NOT NULL "
+            "AND clients.longitude IS NOT NULL",
+            (day,),
+        ).fetchall()
+        confirmed = {
+            row["delivery_id"]
+            for row in conn.execute(
+                "SELECT visits.delivery_id FROM delivery_visits_history AS visits "
+                "JOIN deliveries_history AS deliveries ON deliveries.id = visits.delivery_id "
+                "WHERE deliveries.scheduled_date = ? AND visits.status = 'confirmed'",
+                (day,),
+            )
+        }
+    finally:
+        conn.close()
+
+    origin = positions[0]["recorded_ms"] if positions else 0
+    trajectory: List[Tuple[float, float, float]] = [
+        ((row["recorded_ms"] - origin) / 1000, row["latitude"], row["longitude"]) for row in positions
+    ]
+
+    max_threshold = max(threshold for threshold, _ in grid)
+    per_delivery = {
+        row["id"]: _distance_samples(trajectory, (row["latitude"], row["longitude"]), max_threshold)
+        for row in deliveries
+    }
+    scores: Dict[Params, Score] = {}
+    for params in grid:
+        threshold, min_duration = params
+        detected = {
+            delivery_id
+            for delivery_id, samples in per_delivery.items()
+            if first_visit_window(samples, threshold, min_duration) is not None
+        }
+        scores[params] = Score(
+            true_positives=len(detected & confirmed),
+            false_positives=len(detected - confirmed),
+            false_negatives=len(confirmed - detected),
+        )
+    return scores
+
+
+def sweep(
+    db_path: Path,
+    thresholds: Sequence[float],
+    durations: Sequence[int],
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    workers: Optional[int] = None,
+) -> List[Dict]:
+    """Replay the selected days for every threshold/duration combination."""
+
+    grid: List[Params] = list(product(thresholds, durations))
+    days = list_days(db_path, date_from, date_to)
+    totals = {params: Score() for params in grid}
+    if days:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            for day_scores in pool.map(partial(replay_day, db_path, grid=grid), days):
+                for params, score in day_scores.items():
+                    totals[params].add(score)
+    report = [
+        {
+            "threshold_meters": threshold,
+            "min_duration": min_duration,
+            "days": len(days),
+            "true_positives": score.true_positives,
+            "false_positives": score.false_positives,
+            "false_negatives": score.false_negatives,
+            "precision": round(score.precision, 4),
+            "recall": round(score.recall, 4),
+            "f1": round(score.f1, 4),
+        }
+        for (threshold, min_duration), score in totals.items()
+    ]
+    report.sort(key=lambda item: (item["f1"], item["precision"]), reverse=True)
+    return report
+
+
+def _parse_numbers(raw: str, cast) -> List:
+    return [cast(value) for value in raw.split(",") if value.strip()]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat)
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat)
+    parser.add_argument("--thresholds", default="50,80,120", help="meters, comma separated")
+    parser.add_argument("--durations", default="60,90,180", help="seconds, comma separated")
+    parser.add_argument("--workers", type=int, help="processes (default: all CPU cores)")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = sweep(
+        args.db,
+        _parse_numbers(args.thresholds, float),
+        _parse_numbers(args.durations, int),
+        args.date_from,
+        args.date_to,
+        args.workers,
+    )
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    print(f"{'raio m':>7} {'min s':>6} {'VP':>5} {'FP':>5} {'FN':>5} {'precisão':>9} {'recall':>7} {'F1':>6}")
+    for item in report:
+        print(
+            f"{item['threshold_meters']:>7.0f} {item['min_duration']:>6} {item['true_positives']:>5} "
+            f"{item['false_positives']:>5} {item['false_negatives']:>5} {item['precision']:>9.3f} "
+            f"{item['recall']:>7.3f} {item['f1']:>6.3f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1 @@
+"""Performance harnesses for the bakery delivery backend."""
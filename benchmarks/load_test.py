@@ -0,0 +1,311 @@
+"""HTTP load test simulating a fleet of drivers and dispatcher dashboards.
+
+Example::
+
+    python -m benchmarks.load_test --drivers 20 --dashboards 3 --duration 60 --output result.json
+
+The harness seeds a synthetic database in a temporary directory, serves
+``backend.app.RequestHandler`` in-process and reports throughput and
+p50/p95/p99 latency per endpoint. ``--compare`` prints the change against a
+previous result file.
+"""
+
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import math
+import platform
+import random
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import backend.app as app_module
+import backend.database as database
+
+from .synthetic import SAO_PAULO_CENTER, seed_database
+
+DEFAULT_DASHBOARD_MIX = "summary=4,deliveries=2,routes=1,positions=2"
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence."""
+
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+@dataclass
+class EndpointStats:
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stats: Dict[str, EndpointStats] = {}
+
+    def record(self, endpoint: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, EndpointStats())
+            stats.latencies.append(seconds)
+            if not ok:
+                stats.errors += 1
+
+    def summary(self, elapsed: float) -> Dict[str, Dict[str, float]]:
+        result: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            for endpoint, stats in sorted(self._stats.items()):
+                ordered = sorted(stats.latencies)
+                result[endpoint] = {
+                    "requests": len(ordered),
+                    "errors": stats.errors,
+                    "throughput_rps": round(len(ordered) / elapsed, 3) if elapsed else 0.0,
+                    "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+                    "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+                    "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+                    "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+                }
+        return result
+
+
+def _request(
+    address: Tuple[str, int],
+    method: str,
+    path: str,
+    payload: Optional[Dict] = None,
+) -> bool:
+    conn = http.client.HTTPConnection(*address, timeout=30)
+    try:
+        body = json.dumps(payload).encode() if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status < 400
+    except (OSError, http.client.HTTPException):
+        return False
+    finally:
+        conn.close()
+
+
+def _timed(recorder: Recorder, endpoint: str, address, method: str, path: str, payload=None) -> None:
+    started = time.perf_counter()
+    ok = _request(address, method, path, payload)
+    recorder.record(endpoint, time.perf_counter() - started, ok)
+
+
+def _driver_loop(
+    address: Tuple[str, int],
+    recorder: Recorder,
+    interval: float,
+    deadline: float,
+    rng: random.Random,
+) -> None:
+    latitude, longitude = SAO_PAULO_CENTER
+    # Stagger the fleet so drivers do not post in lockstep.
+    time.sleep(rng.uniform(0, interval))
+    while time.monotonic() < deadline:
+        latitude += rng.uniform(-0.0005, 0.0005)
+        longitude += rng.uniform(-0.0005, 0.0005)
+        _timed(
+            recorder,
+            "POST /api/driver/location",
+            address,
+            "POST",
+            "/api/driver/location",
+            {"latitude": latitude, "longitude": longitude},
+        )
+        time.sleep(max(0.0, interval))
+
+
+def _dashboard_loop(
+    address: Tuple[str, int],
+    recorder: Recorder,
+    interval: float,
+    deadline: float,
+    mix: Sequence[Tuple[str, int]],
+    rng: random.Random,
+) -> None:
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    today = date.today().isoformat()
+    while time.monotonic() < deadline:
+        action = rng.choices(names, weights)[0]
+        if action == "summary":
+            _timed(recorder, "GET /api/metrics/summary", address, "GET", "/api/metrics/summary")
+        elif action == "deliveries":
+            _timed(recorder, "GET /api/deliveries", address, "GET", f"/api/deliveries?date={today}")
+        elif action == "positions":
+            _timed(recorder, "GET /api/driver/location", address, "GET", "/api/driver/location")
+        elif action == "routes":
+            _timed(recorder, "POST /api/routes", address, "POST", "/api/routes", {"date": today})
+        time.sleep(max(0.0, interval))
+
+
+def parse_mix(raw: str) -> List[Tuple[str, int]]:
+    allowed = {"summary", "deliveries", "positions", "routes"}
+    mix: List[Tuple[str, int]] = []
+    for part in raw.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in allowed:
+            raise ValueError(f"unknown endpoint in mix: {name}")
+        mix.append((name, int(weight or 1)))
+    if not mix:
+        raise ValueError("empty endpoint mix")
+    return mix
+
+
+def run_load_test(
+    drivers: int = 20,
+    dashboards: int = 3,
+    duration: float = 30.0,
+    location_interval: float = 5.0,
+    dashboard_interval: float = 1.0,
+    mix: str = DEFAULT_DASHBOARD_MIX,
+    clients: int = 300,
+    days: int = 30,
+    positions: int = 20000,
+    seed: int = 7,
+) -> Dict:
+    """Run the scenario against a fresh synthetic database and return the report."""
+
+    endpoint_mix = parse_mix(mix)
+    original_path = database.DB_PATH
+    with tempfile.TemporaryDirectory() as workdir:
+        database.DB_PATH = Path(workdir) / "load.db"
+        try:
+            database.initialize()
+            seed_database(database.DB_PATH, clients=clients, days=days, positions=positions, seed=seed)
+            server = ThreadingHTTPServer(("127.0.0.1", 0), app_module.RequestHandler)
+            server.daemon_threads = True
+            server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+            server_thread.start()
+            recorder = Recorder()
+            rng = random.Random(seed)
+            started = time.monotonic()
+            deadline = started + duration
+            workers = [
+                threading.Thread(
+                    target=_driver_loop,
+                    args=(server.server_address, recorder, location_interval, deadline, random.Random(rng.random())),
+                )
+                for _ in range(drivers)
+            ] + [
+                threading.Thread(
+                    target=_dashboard_loop,
+                    args=(
+                        server.server_address,
+                        recorder,
+                        dashboard_interval,
+                        deadline,
+                        endpoint_mix,
+                        random.Random(rng.random()),
+                    ),
+                )
+                for _ in range(dashboards)
+            ]
+            try:
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+            finally:
+                elapsed = time.monotonic() - started
+                server.shutdown()
+                server.server_close()
+        finally:
+            database.DB_PATH = original_path
+
+    endpoints = recorder.summary(elapsed)
+    total = sum(stats["requests"] for stats in endpoints.values())
+    return {
+        "scenario": {
+            "drivers": drivers,
+            "dashboards": dashboards,
+            "duration_s": duration,
+            "location_interval_s": location_interval,
+            "dashboard_interval_s": dashboard_interval,
+            "mix": mix,
+            "clients": clients,
+            "days": days,
+            "positions": positions,
+            "seed": seed,
+        },
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "elapsed_s": round(elapsed, 3),
+        "total_requests": total,
+        "throughput_rps": round(total / elapsed, 3) if elapsed else 0.0,
+        "endpoints": endpoints,
+    }
+
+
+def format_report(report: Dict, baseline: Optional[Dict] = None) -> str:
+    lines = [
+        f"{'endpoint':<28} {'reqs':>6} {'err':>4} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+        + ("  p95 vs base" if baseline else "")
+    ]
+    for endpoint, stats in report["endpoints"].items():
+        line = (
+            f"{endpoint:<28} {stats['requests']:>6} {stats['errors']:>4} {stats['throughput_rps']:>8.2f} "
+            f"{stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}"
+        )
+        previous = (baseline or {}).get("endpoints", {}).get(endpoint)
+        if previous and previous.get("p95_ms"):
+            change = (stats["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"] * 100
+            line += f"  {change:+.1f}%"
+        lines.append(line)
+    lines.append(f"total: {report['total_requests']} requests, {report['throughput_rps']:.2f} req/s")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--drivers", type=int, default=20)
+    parser.add_argument("--dashboards", type=int, default=3)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--location-interval", type=float, default=5.0, help="seconds between driver posts")
+    parser.add_argument("--dashboard-interval", type=float, default=1.0, help="seconds between dashboard calls")
+    parser.add_argument("--mix", default=DEFAULT_DASHBOARD_MIX, help="weighted dashboard endpoints")
+    parser.add_argument("--clients", type=int, default=300)
+    parser.add_argument("--days", type=int, default=30, help="days of delivery history to seed")
+    parser.add_argument("--positions", type=int, default=20000, help="GPS fixes to seed")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", type=Path, help="write the JSON report to this file")
+    parser.add_argument("--compare", type=Path, help="previous JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    report = run_load_test(
+        drivers=args.drivers,
+        dashboards=args.dashboards,
+        duration=args.duration,
+        location_interval=args.location_interval,
+        dashboard_interval=args.dashboard_interval,
+        mix=args.mix,
+        clients=args.clients,
+        days=args.days,
+        positions=args.positions,
+        seed=args.seed,
+    )
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print(format_report(report, baseline))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,260 @@
+"""Scaling micro-benchmarks for ``backend.routes_logic``.
+
+Example::
+
+    python -m benchmarks.routes_logic_bench                  # compare with the stored baseline
+    python -m benchmarks.routes_logic_bench --update-baseline
+    python -m benchmarks.routes_logic_bench --quick --tolerance 0.5
+
+Each case is timed over increasing input sizes (best of several runs) and
+measured once more under ``tracemalloc`` for peak memory. Cases slower than
+``baseline * (1 + tolerance)`` are reported as regressions and make the
+command exit with status 1.
+
+``optimize_route_with_google`` runs against a local stub of the Directions
+API. Like the real API, the stub cannot take thousands of waypoints in one
+URL, so the largest sizes end up measuring the nearest-neighbour fallback.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from backend import routes_logic
+from backend.routes_logic import (
+    DistanceMatrix,
+    detect_visit_events,
+    haversine_distance,
+    nearest_neighbor_route,
+    optimize_route_with_google,
+)
+
+from .synthetic import SAO_PAULO_CENTER, make_clients, make_trajectory
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "routes_logic.json"
+STOP_SIZES = (10, 100, 500, 1000, 5000)
+POINT_SIZES = (100, 1000, 10000, 50000)
+QUICK_STOP_SIZES = (10, 100, 500)
+QUICK_POINT_SIZES = (100, 1000, 10000)
+DETECTION_DELIVERIES = 20
+# A dense matrix for 5,000 stops would not fit comfortably in memory.
+MATRIX_MAX_STOPS = 1000
+MIN_SAMPLE_SECONDS = 0.2
+MAX_REPEATS = 5
+
+Case = Tuple[str, int, Callable[[], object]]
+
+
+class _StubDirectionsHandler(BaseHTTPRequestHandler):
+    """Answers like the Directions API, keeping the waypoint order unchanged."""
+
+    def log_message(self, format: str, *args) -> None:  # noqa: D401
+        return
+
+    def do_GET(self) -> None:  # noqa: N802
+        query = parse_qs(urlparse(self.path).query)
+        waypoints = query.get("waypoints", [""])[0]
+        count = max(0, len(waypoints.split("|")) - 1) if waypoints else 0
+        body = json.dumps(
+            {
+                "status": "OK",
+                "routes": [
+                    {
+                        "waypoint_order": list(range(count)),
+                        "overview_polyline": {"points": ""},
+                        "legs": [],
+                        "warnings": [],
+                        "summary": "stub",
+                    }
+                ],
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@contextmanager
+def stub_directions_server() -> Iterator[str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubDirectionsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    original = routes_logic.GOOGLE_DIRECTIONS_URL
+    routes_logic.GOOGLE_DIRECTIONS_URL = f"http://127.0.0.1:{server.server_address[1]}/directions/json"
+    try:
+        yield routes_logic.GOOGLE_DIRECTIONS_URL
+    finally:
+        routes_logic.GOOGLE_DIRECTIONS_URL = original
+        server.shutdown()
+        server.server_close()
+
+
+def build_cases(stop_sizes: Sequence[int], point_sizes: Sequence[int], seed: int = 11) -> List[Case]:
+    rng = random.Random(seed)
+    cases: List[Case] = []
+    for size in stop_sizes:
+        clients = make_clients(size, rng)
+        points = [(client["latitude"], client["longitude"]) for client in clients]
+
+        def haversine_case(points=points) -> None:
+            origin = SAO_PAULO_CENTER
+            for point in points:
+                haversine_distance(origin, point)
+
+        cases.append(("haversine_distance", size, haversine_case))
+        cases.append(("nearest_neighbor_route", size, lambda clients=clients: nearest_neighbor_route(SAO_PAULO_CENTER, clients)))
+        if size <= MATRIX_MAX_STOPS:
+            matrix = DistanceMatrix(
+                [client["id"] for client in clients],
+                [[haversine_distance(a, b) for b in points] for a in points],
+            )
+            cases.append(
+                (
+                    "nearest_neighbor_route_matrix",
+                    size,
+                    lambda clients=clients, matrix=matrix: nearest_neighbor_route(SAO_PAULO_CENTER, clients, matrix),
+                )
+            )
+        cases.append(
+            (
+                "optimize_route_with_google",
+                size,
+                lambda clients=clients: optimize_route_with_google("bench-key", SAO_PAULO_CENTER, clients),
+            )
+        )
+    deliveries = [
+        {**client, "delivery_id": client["id"]}
+        for client in make_clients(DETECTION_DELIVERIES, rng)
+    ]
+    for size in point_sizes:
+        trajectory = make_trajectory(deliveries, size, rng)
+        cases.append(
+            (
+                "detect_visit_events",
+                size,
+                lambda trajectory=trajectory: detect_visit_events(trajectory, deliveries),
+            )
+        )
+    return cases
+
+
+def measure(func: Callable[[], object]) -> Dict[str, float]:
+    timings: List[float] = []
+    spent = 0.0
+    while len(timings) < MAX_REPEATS and (not timings or spent < MIN_SAMPLE_SECONDS):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        timings.append(elapsed)
+        spent += elapsed
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(timings), "runs": len(timings), "peak_kib": round(peak / 1024, 1)}
+
+
+def run_benchmarks(stop_sizes: Sequence[int], point_sizes: Sequence[int]) -> Dict[str, Dict[str, Dict[str, float]]]:
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    with stub_directions_server():
+        for name, size, func in build_cases(stop_sizes, point_sizes):
+            results.setdefault(name, {})[str(size)] = measure(func)
+    return results
+
+
+def find_regressions(
+    results: Dict[str, Dict[str, Dict[str, float]]],
+    baseline: Dict[str, Dict[str, Dict[str, float]]],
+    tolerance: float,
+) -> List[Dict[str, float]]:
+    regressions = []
+    for name, sizes in results.items():
+        for size, current in sizes.items():
+            previous = baseline.get(name, {}).get(size)
+            if not previous or not previous.get("seconds"):
+                continue
+            ratio = current["seconds"] / previous["seconds"]
+            if ratio > 1 + tolerance:
+                regressions.append(
+                    {
+                        "case": name,
+                        "size": int(size),
+                        "baseline_seconds": previous["seconds"],
+                        "seconds": current["seconds"],
+                        "ratio": round(ratio, 3),
+                    }
+                )
+    return regressions
+
+
+def format_results(
+    results: Dict[str, Dict[str, Dict[str, float]]],
+    baseline: Optional[Dict[str, Dict[str, Dict[str, float]]]] = None,
+) -> str:
+    lines = [f"{'case':<28} {'size':>7} {'ms':>11} {'peak KiB':>10}" + ("  vs base" if baseline else "")]
+    for name, sizes in results.items():
+        for size, current in sorted(sizes.items(), key=lambda item: int(item[0])):
+            line = f"{name:<28} {size:>7} {current['seconds'] * 1000:>11.3f} {current['peak_kib']:>10.1f}"
+            previous = (baseline or {}).get(name, {}).get(size)
+            if previous and previous.get("seconds"):
+                line += f"  {current['seconds'] / previous['seconds']:.2f}x"
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="skip the largest input sizes")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--output", type=Path, help="write the JSON results to this file")
+    args = parser.parse_args(argv)
+
+    stop_sizes = QUICK_STOP_SIZES if args.quick else STOP_SIZES
+    point_sizes = QUICK_POINT_SIZES if args.quick else POINT_SIZES
+    results = run_benchmarks(stop_sizes, point_sizes)
+    document = {
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(document, indent=2) + "\n")
+    if args.update_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(document, indent=2) + "\n")
+        print(format_results(results))
+        print(f"baseline written to {args.baseline}")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text())["results"] if args.baseline.exists() else None
+    print(format_results(results, baseline))
+    if baseline is None:
+        print("no baseline found; run with --update-baseline to create one")
+        return 0
+    regressions = find_regressions(results, baseline, args.tolerance)
+    for item in regressions:
+        print(
+            f"REGRESSION {item['case']} size={item['size']}: "
+            f"{item['seconds'] * 1000:.3f} ms vs {item['baseline_seconds'] * 1000:.3f} ms ({item['ratio']}x)"
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
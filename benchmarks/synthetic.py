@@ -0,0 +1,144 @@
+"""Synthetic data generators shared by the benchmark harnesses."""
+
+from __future__ import annotations
+
+import random
+import sqlite3
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from backend.database import epoch_ms
+
+SAO_PAULO_CENTER = (-23.55052, -46.633308)
+# Roughly a 20 km box around the city centre.
+SPREAD_DEGREES = 0.18
+
+
+def random_coordinate(rng: random.Random, center: Tuple[float, float] = SAO_PAULO_CENTER) -> Tuple[float, float]:
+    return (
+        center[0] + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES),
+        center[1] + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES),
+    )
+
+
+def make_clients(count: int, rng: random.Random) -> List[Dict]:
+    clients = []
+    for index in range(count):
+        latitude, longitude = random_coordinate(rng)
+        clients.append(
+            {
+                "id": index + 1,
+                "client_id": index + 1,
+                "name": f"Cliente {index + 1:05d}",
+                "latitude": latitude,
+                "longitude": longitude,
+            }
+        )
+    return clients
+
+
+def make_trajectory(
+    stops: List[Dict],
+    points: int,
+    rng: random.Random,
+    start: datetime = datetime(2024, 1, 1, 6, 0, 0),
+    interval_seconds: int = 5,
+    dwell_points: int = 30,
+) -> List[Dict]:
+    """Return GPS fixes that drive between ``stops`` and linger at each one."""
+
+    positions: List[Dict] = []
+    current = SAO_PAULO_CENTER
+    timestamp = start
+    stop_index = 0
+    while len(positions) < points:
+        target = stops[stop_index % len(stops)] if stops else None
+        if target is None:
+            destination = random_coordinate(rng)
+        else:
+            destination = (float(target["latitude"]), float(target["longitude"]))
+        travel_points = max(1, min(60, points - len(positions)))
+        for step in range(1, travel_points + 1):
+            fraction = step / travel_points
+            positions.append(
+                {
+                    "recorded_ms": epoch_ms(timestamp),
+                    "latitude": current[0] + (destination[0] - current[0]) * fraction,
+                    "longitude": current[1] + (destination[1] - current[1]) * fraction,
+                }
+            )
+            timestamp += timedelta(seconds=interval_seconds)
+        for _ in range(min(dwell_points, points - len(positions))):
+            positions.append(
+                {
+                    "recorded_ms": epoch_ms(timestamp),
+                    "latitude": destination[0] + rng.uniform(-0.0002, 0.0002),
+                    "longitude": destination[1] + rng.uniform(-0.0002, 0.0002),
+                }
+            )
+            timestamp += timedelta(seconds=interval_seconds)
+        current = destination
+        stop_index += 1
+    return positions[:points]
+
+
+def seed_database(
+    path: Path,
+    clients: int = 300,
+    days: int = 30,
+    deliveries_per_day: int = 60,
+    positions: int = 20000,
+    seed: int = 7,
+) -> None:
+    """Fill the SQLite database at ``path`` (already initialized) with history."""
+
+    rng = random.Random(seed)
+    today = datetime.now().replace(hour=6, minute=0, second=0, microsecond=0)
+    client_rows = make_clients(clients, rng)
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT INTO clients (name, address, latitude, longitude) VALUES (?, ?, ?, ?)",
+                [
+                    (client["name"], f"Endereço {client['id']}", client["latitude"], client["longitude"])
+                    for client in client_rows
+                ],
+            )
+            client_ids = [row[0] for row in conn.execute("SELECT id FROM clients")]
+            delivery_rows = []
+            for offset in range(days, -1, -1):
+                day = today - timedelta(days=offset)
+                for client_id in rng.sample(client_ids, min(deliveries_per_day, len(client_ids))):
+                    if offset:
+                        arrived = day + timedelta(minutes=rng.randint(0, 360))
+                        completed = arrived + timedelta(seconds=rng.randint(90, 900))
+                        delivery_rows.append(
+                            (
+                                client_id,
+                                day.date().isoformat(),
+                                "completed",
+                                rng.randint(10, 200),
+                                arrived.isoformat(sep=" "),
+                                completed.isoformat(sep=" "),
+                                completed.isoformat(sep=" "),
+                                int((completed - arrived).total_seconds()),
+                            )
+                        )
+                    else:
+                        delivery_rows.append(
+                            (client_id, day.date().isoformat(), "pending", rng.randint(10, 200), None, None, None, None)
+                        )
+            conn.executemany(
+                "INSERT INTO deliveries (client_id, scheduled_date, status, quantity, arrived_at, departed_at, "
+                "completed_at, stay_seconds) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                delivery_rows,
+            )
+            trajectory = make_trajectory(client_rows[:50], positions, rng, start=today - timedelta(days=days))
+            conn.executemany(
+                "INSERT INTO driver_positions (recorded_ms, latitude, longitude) VALUES (?, ?, ?)",
+                [(item["recorded_ms"], item["latitude"], item["longitude"]) for item in trajectory],
+            )
+    finally:
+        conn.close()
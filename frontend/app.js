@@ -15,9 +15,14 @@ const selectedClientIds = new Set();
 let cachedClients = [];
 let hasAutoSelectedClients = false;
 let routeUpdateTimeout;
+let clientSearchTimeout;
+let clientSearchSeq = 0;
 const pendingConfirmationDeliveries = new Set();
 let nextStopClientId = null;
 let driverWatchId = null;
+const SYNC_STORAGE_KEY = 'bakery-sync-v1';
+const syncState = { seq: 0, clients: new Map(), deliveries: new Map() };
+let syncInFlight = null;
 
 async function fetchJSON(url, options = {}) {
     const response = await fetch(url, {
@@ -34,6 +39,90 @@ async function fetchJSON(url, options = {}) {
     return response.json();
 }
 
+function newIdempotencyKey() {
+    if (window.crypto?.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+}
+
+// Network failures are retried with the same key, so the server applies the post once.
+async function postIdempotent(url, payload, attempts = 3) {
+    const key = newIdempotencyKey();
+    for (let attempt = 1; ; attempt += 1) {
+        try {
+            return await fetchJSON(url, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json', 'Idempotency-Key': key },
+                body: JSON.stringify(payload),
+            });
+        } catch (error) {
+            if (!(error instanceof TypeError) || attempt >= attempts) {
+                throw error;
+            }
+            await new Promise((resolve) => setTimeout(resolve, 500 * attempt));
+        }
+    }
+}
+
+function restoreSyncState() {
+    try {
+        const saved = JSON.parse(localStorage.getItem(SYNC_STORAGE_KEY) || 'null');
+        if (!saved) return;
+        syncState.seq = saved.seq || 0;
+        (saved.clients || []).forEach((row) => syncState.clients.set(Number(row.id), row));
+        (saved.deliveries || []).forEach((row) => syncState.deliveries.set(Number(row.id), row));
+    } catch (error) {
+        syncState.seq = 0;
+    }
+}
+
+function persistSyncState() {
+    try {
+        localStorage.setItem(
+            SYNC_STORAGE_KEY,
+            JSON.stringify({
+                seq: syncState.seq,
+                clients: Array.from(syncState.clients.values()),
+                deliveries: Array.from(syncState.deliveries.values()),
+            }),
+        );
+    } catch (error) {
+        // Sem espaço no armazenamento local: a próxima visita baixa tudo de novo.
+    }
+}
+
+function applyChanges(store, changes) {
+    changes.upserted.forEach((row) => store.set(Number(row.id), row));
+    changes.deleted.forEach((id) => store.delete(Number(id)));
+}
+
+async function runSync() {
+    let hasMore = true;
+    while (hasMore) {
+        const changes = await fetchJSON(`${API_BASE}/sync?since=${syncState.seq}`);
+        if (changes.reset) {
+            syncState.clients.clear();
+            syncState.deliveries.clear();
+        }
+        applyChanges(syncState.clients, changes.clients);
+        applyChanges(syncState.deliveries, changes.deliveries);
+        syncState.seq = changes.seq;
+        hasMore = changes.has_more;
+    }
+    persistSyncState();
+}
+
+// Pulls only the rows changed since the last sync; concurrent callers share one request.
+function syncChanges() {
+    if (!syncInFlight) {
+        syncInFlight = runSync().finally(() => {
+            syncInFlight = null;
+        });
+    }
+    return syncInFlight;
+}
+
 function serializeForm(form) {
     const data = new FormData(form);
     const payload = {};
@@ -420,10 +509,7 @@ function updateDriverStatus(progress) {
 
 async function sendLocationUpdate(position) {
     try {
-        const response = await fetchJSON(`${API_BASE}/driver/location`, {
-            method: 'POST',
-            body: JSON.stringify(position),
-        });
+        const response = await postIdempotent(`${API_BASE}/driver/location`, position);
         handleTrackingResponse(response);
     } catch (error) {
         console.warn('Falha ao enviar localização', error);
@@ -504,7 +590,10 @@ function showRouteWarnings(skipped) {
 }
 
 async function loadClients() {
-    const clients = await fetchJSON(`${API_BASE}/clients`);
+    await syncChanges();
+    const clients = Array.from(syncState.clients.values()).sort((a, b) =>
+        (a.name || '').localeCompare(b.name || ''),
+    );
     cachedClients = clients;
 
     const validIds = new Set(clients.map((client) => Number(client.id)));
@@ -529,12 +618,9 @@ async function loadClients() {
     }
 
     const tbody = document.querySelector('#clientsTable tbody');
-    const select = document.querySelector('#deliveryClient');
-    if (tbody) tbody.innerHTML = '';
-    if (select) select.innerHTML = '<option value="">Selecione...</option>';
-
-    clients.forEach((client) => {
-        if (tbody) {
+    if (tbody) {
+        tbody.innerHTML = '';
+        clients.forEach((client) => {
             const row = document.createElement('tr');
             row.innerHTML = `
                 <td>${client.name}</td>
@@ -544,24 +630,64 @@ async function loadClients() {
                 <td>${client.longitude ?? ''}</td>
             `;
             tbody.appendChild(row);
-        }
-        if (select) {
-            const option = document.createElement('option');
-            option.value = client.id;
-            option.textContent = client.name;
-            select.appendChild(option);
-        }
-    });
+        });
+    }
+    if (!document.querySelector('#deliveryClientSearch')?.value.trim()) {
+        fillClientSelect(clients);
+    }
 
     renderRouteClients(clients);
     renderClientsOnMap(clients);
     return clients;
 }
 
+function fillClientSelect(clients) {
+    const select = document.querySelector('#deliveryClient');
+    if (!select) return;
+    const current = select.value;
+    select.innerHTML = '<option value="">Selecione...</option>';
+    clients.forEach((client) => {
+        const option = document.createElement('option');
+        option.value = client.id;
+        option.textContent = client.name;
+        select.appendChild(option);
+    });
+    if (clients.some((client) => String(client.id) === current)) {
+        select.value = current;
+    }
+}
+
+async function searchDeliveryClients(text) {
+    const seq = ++clientSearchSeq;
+    if (!text.trim()) {
+        fillClientSelect(cachedClients);
+        return;
+    }
+    try {
+        const results = await fetchJSON(`${API_BASE}/clients/search?q=${encodeURIComponent(text)}`);
+        // A slower reply to an earlier keystroke must not replace newer results.
+        if (seq === clientSearchSeq) {
+            fillClientSelect(results);
+        }
+    } catch (error) {
+        console.warn('Falha ao buscar clientes', error);
+    }
+}
+
 async function loadDeliveries() {
     const dateInput = document.querySelector('#routeDate');
-    const params = dateInput && dateInput.value ? `?date=${dateInput.value}` : '';
-    const deliveries = await fetchJSON(`${API_BASE}/deliveries${params}`);
+    const date = dateInput && dateInput.value ? dateInput.value : null;
+    await syncChanges();
+    const deliveries = Array.from(syncState.deliveries.values())
+        .filter((delivery) => !date || delivery.scheduled_date === date)
+        .map((delivery) => ({
+            ...delivery,
+            client_name: syncState.clients.get(Number(delivery.client_id))?.name,
+        }))
+        .sort(
+            (a, b) =>
+                (b.scheduled_date || '').localeCompare(a.scheduled_date || '') || Number(b.id) - Number(a.id),
+        );
     const tbody = document.querySelector('#deliveriesTable tbody');
     const template = document.querySelector('#deliveryRowTemplate');
     if (!tbody || !template) return deliveries;
@@ -696,9 +822,9 @@ async function completeDelivery(id, context = {}) {
     }
     const quantity = Number(quantityValue);
     const notes = prompt('Observações adicionais? (opcional)') || undefined;
-    await fetchJSON(`${API_BASE}/deliveries/${id}/complete`, {
-        method: 'POST',
-        body: JSON.stringify({ quantity: Number.isNaN(quantity) ? null : quantity, notes }),
+    await postIdempotent(`${API_BASE}/deliveries/${id}/complete`, {
+        quantity: Number.isNaN(quantity) ? null : quantity,
+        notes,
     });
     pendingConfirmationDeliveries.delete(id);
     await Promise.all([loadDeliveries(), loadSummary(), generateRoute()]);
@@ -733,6 +859,7 @@ function setupInstallPrompt() {
 }
 
 document.addEventListener('DOMContentLoaded', async () => {
+    restoreSyncState();
     await initMap();
     startDriverTracking();
     clientLocationPicker = setupClientMapPicker();
@@ -767,6 +894,7 @@ document.addEventListener('DOMContentLoaded', async () => {
                 body: JSON.stringify(payload),
             });
             deliveryForm.reset();
+            fillClientSelect(cachedClients);
             await Promise.all([loadDeliveries(), loadSummary(), generateRoute()]);
         });
     }
@@ -776,6 +904,11 @@ document.addEventListener('DOMContentLoaded', async () => {
         await generateRoute();
     });
 
+    document.getElementById('deliveryClientSearch')?.addEventListener('input', (event) => {
+        clearTimeout(clientSearchTimeout);
+        const text = event.target.value;
+        clientSearchTimeout = setTimeout(() => searchDeliveryClients(text), 150);
+    });
     document.getElementById('refreshDeliveries')?.addEventListener('click', loadDeliveries);
     document.getElementById('refreshSummary')?.addEventListener('click', loadSummary);
     document.getElementById('generateRoute')?.addEventListener('click', generateRoute);
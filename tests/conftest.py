@@ -0,0 +1,29 @@
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import backend.app as app_module
+import backend.database as database
+from backend.distance_matrix import STORE as DISTANCES
+from backend.travel_model import MODEL as TRAVEL_MODEL
+
+
+@pytest.fixture
+def api_server(tmp_path, monkeypatch):
+    """Run the HTTP API on an ephemeral port backed by a temporary database."""
+
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "delivery.db")
+    database.initialize()
+    # Process-wide caches must not leak state between temporary databases.
+    DISTANCES.clear()
+    TRAVEL_MODEL.invalidate()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), app_module.RequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_address
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
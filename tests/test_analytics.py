@@ -0,0 +1,146 @@
+import http.client
+import json
+from datetime import date
+
+import pytest
+
+import backend.database as database
+from backend.analytics import build_report, parse_analytics_query, rebuild_rollups
+from backend.archive import archive_completed
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "delivery.db")
+    monkeypatch.delenv("ARCHIVE_DB_PATH", raising=False)
+    database.initialize()
+    yield
+
+
+def _clients():
+    return [row["id"] for row in database.fetch_all("SELECT id FROM clients ORDER BY id LIMIT 2")]
+
+
+def _completed(client_id, day, quantity, arrived=None, stay=None):
+    return database.execute(
+        "INSERT INTO deliveries (client_id, scheduled_date, status, quantity, arrived_at, completed_at, stay_seconds) "
+        "VALUES (?, ?, 'completed', ?, ?, ?, ?)",
+        (client_id, day, quantity, arrived, f"{day} 10:30:00", stay),
+    )
+
+
+def _rollups():
+    return database.fetch_all("SELECT * FROM delivery_rollups ORDER BY period, period_start, client_id, arrival_hour")
+
+
+def test_report_groups_rollups_by_day_week_and_client(db):
+    first, second = _clients()
+    _completed(first, "2024-05-06", 40, "2024-05-06 07:10:00", 120)
+    _completed(first, "2024-05-07", 60, "2024-05-07 07:50:00", 240)
+    _completed(second, "2024-05-07", 10)
+    _completed(second, "2024-05-13", 99, "2024-05-13 08:00:00")
+    pending = database.execute(
+        "INSERT INTO deliveries (client_id, scheduled_date, quantity) VALUES (?, '2024-05-08', 5)", (second,)
+    )
+
+    by_day = build_report(parse_analytics_query({"from": ["2024-05-06"], "to": ["2024-05-12"]}))
+    assert [(item["period_start"], item["breads"]) for item in by_day["items"]] == [
+        ("2024-05-06", 40),
+        ("2024-05-07", 70),
+    ]
+    assert by_day["totals"]["deliveries"] == 3
+    assert by_day["totals"]["average_stay_seconds"] == 180.0
+    assert by_day["totals"]["arrivals_by_hour"][7] == 2
+    assert by_day["totals"]["arrivals_by_hour"][10] == 1
+
+    by_week = build_report(parse_analytics_query({"from": ["2024-05-08"], "to": ["2024-05-13"], "group_by": ["week"]}))
+    assert [(item["period_start"], item["deliveries"]) for item in by_week["items"]] == [
+        ("2024-05-06", 3),
+        ("2024-05-13", 1),
+    ]
+
+    by_client = build_report(
+        parse_analytics_query({"from": ["2024-05-01"], "to": ["2024-05-31"], "group_by": ["client"]})
+    )
+    assert [(item["client_id"], item["breads"]) for item in by_client["items"]] == [(second, 109), (first, 100)]
+    assert by_client["items"][0]["client_name"]
+
+    database.execute(
+        "UPDATE deliveries SET status = 'completed', completed_at = '2024-05-08 06:15:00' WHERE id = ?", (pending,)
+    )
+    database.execute("UPDATE deliveries SET notes = 'revisado' WHERE id = ?", (pending,))
+    again = build_report(parse_analytics_query({"from": ["2024-05-08"], "to": ["2024-05-08"]}))
+    assert again["totals"]["breads"] == 5
+    assert again["totals"]["arrivals_by_hour"][6] == 1
+
+
+def test_rollups_survive_archival_and_match_rebuild(db):
+    first, second = _clients()
+    _completed(first, "2024-01-02", 30, "2024-01-02 07:00:00", 60)
+    _completed(second, "2024-01-03", 20)
+    _completed(first, "2024-03-30", 15, "2024-03-30 09:00:00", 90)
+    maintained = _rollups()
+
+    archive_completed(days=30, today=date(2024, 4, 1))
+    assert _rollups() == maintained
+    assert rebuild_rollups() == len(maintained)
+    assert _rollups() == maintained
+
+
+def test_corrections_of_completed_deliveries_replace_their_rollups(db):
+    first = _clients()[0]
+    delivery = _completed(first, "2024-05-06", 10, "2024-05-06 07:10:00", 120)
+
+    # A second /complete to fix the quantity, then a corrected stay and date.
+    database.execute("UPDATE deliveries SET status = 'completed', quantity = 25 WHERE id = ?", (delivery,))
+    database.execute(
+        "UPDATE deliveries SET stay_seconds = 300, arrived_at = '2024-05-07 09:00:00', "
+        "scheduled_date = '2024-05-07' WHERE id = ?",
+        (delivery,),
+    )
+    report = build_report(parse_analytics_query({"from": ["2024-05-06"], "to": ["2024-05-12"]}))
+    assert [(item["period_start"], item["breads"]) for item in report["items"]] == [("2024-05-07", 25)]
+    assert report["totals"]["average_stay_seconds"] == 300.0
+    assert report["totals"]["arrivals_by_hour"][9] == 1
+
+    maintained = _rollups()
+    assert rebuild_rollups() == len(maintained)
+    assert _rollups() == maintained
+
+    database.execute("UPDATE deliveries SET status = 'pending' WHERE id = ?", (delivery,))
+    assert _rollups() == []
+
+
+def test_parse_analytics_query_defaults_and_validation():
+    query = parse_analytics_query({}, today=date(2024, 5, 31))
+    assert (query.date_from, query.date_to, query.group_by) == (date(2024, 5, 2), date(2024, 5, 31), "day")
+    with pytest.raises(ValueError):
+        parse_analytics_query({"group_by": ["month"]})
+    with pytest.raises(ValueError):
+        parse_analytics_query({"from": ["2024-05-10"], "to": ["2024-05-01"]})
+
+
+def test_analytics_endpoint(api_server):
+    client_id = _clients()[0]
+    _completed(client_id, "2024-05-06", 12, "2024-05-06 07:10:00", 100)
+
+    conn = http.client.HTTPConnection(*api_server, timeout=10)
+    try:
+        conn.request("GET", "/api/analytics?from=2024-05-01&to=2024-05-31&group_by=week")
+        response = conn.getresponse()
+        report = json.loads(response.read())
+    finally:
+        conn.close()
+    assert response.status == 200
+    assert report["items"][0]["period_start"] == "2024-05-06"
+    assert report["items"][0]["breads"] == 12
+
+    conn = http.client.HTTPConnection(*api_server, timeout=10)
+    try:
+        conn.request("GET", "/api/analytics?from=ontem")
+        response = conn.getresponse()
+        error = json.loads(response.read())
+    finally:
+        conn.close()
+    assert response.status == 400
+    assert "from" in error["error"]
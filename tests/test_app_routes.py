@@ -0,0 +1,51 @@
+import http.client
+import json
+
+import backend.database as database
+
+
+def _post(address, path, payload):
+    conn = http.client.HTTPConnection(*address, timeout=10)
+    try:
+        conn.request("POST", path, body=json.dumps(payload), headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def test_generate_route_orders_every_stop_with_etas(api_server):
+    status, payload = _post(api_server, "/api/routes", {})
+
+    assert status == 200
+    ordered = payload["ordered"]
+    assert len(ordered) == len(database.IDEAL_SUPERMARKETS)
+    etas = [stop["eta_seconds"] for stop in ordered]
+    assert etas == sorted(etas)
+    assert all(stop["eta"] for stop in payload["progress"]["stops"])
+
+
+def test_replan_starts_from_last_position_and_skips_completed(api_server):
+    clients = database.fetch_all("SELECT id FROM clients ORDER BY id")
+    for client in clients:
+        database.execute(
+            "INSERT INTO deliveries (client_id, scheduled_date) VALUES (?, '2024-06-03')",
+            (client["id"],),
+        )
+    status, first = _post(api_server, "/api/routes", {"date": "2024-06-03"})
+    assert status == 200
+    done = first["ordered"][0]
+    database.execute("UPDATE deliveries SET status = 'completed' WHERE id = ?", (done["delivery_id"],))
+    database.execute(
+        "INSERT INTO driver_positions (latitude, longitude) VALUES (?, ?)",
+        (done["latitude"], done["longitude"]),
+    )
+
+    status, replanned = _post(api_server, "/api/routes", {"date": "2024-06-03", "mode": "replan"})
+
+    assert status == 200
+    assert replanned["start"] == {"latitude": done["latitude"], "longitude": done["longitude"]}
+    assert replanned["directions"] is None
+    assert replanned["replan"]["inserted_client_ids"] == []
+    assert len(replanned["ordered"]) == len(clients) - 1
+    assert done["id"] not in [stop["id"] for stop in replanned["ordered"]]
@@ -0,0 +1,56 @@
+import http.client
+import json
+
+import backend.database as database
+
+
+def _seed_deliveries(total):
+    conn = database.get_connection()
+    try:
+        client_id = conn.execute("SELECT id FROM clients ORDER BY id LIMIT 1").fetchone()["id"]
+        conn.executemany(
+            "INSERT INTO deliveries (client_id, scheduled_date, quantity) VALUES (?, ?, ?)",
+            [(client_id, f"2024-01-{(index % 28) + 1:02d}", index) for index in range(total)],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _get(address, path, http_version=11):
+    conn = http.client.HTTPConnection(*address, timeout=10)
+    conn._http_vsn = http_version
+    conn._http_vsn_str = "HTTP/1.1" if http_version == 11 else "HTTP/1.0"
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        return response, response.read()
+    finally:
+        conn.close()
+
+
+def test_deliveries_list_is_streamed_in_chunks(api_server):
+    _seed_deliveries(3000)
+
+    response, body = _get(api_server, "/api/deliveries")
+
+    assert response.status == 200
+    assert response.getheader("Transfer-Encoding") == "chunked"
+    deliveries = json.loads(body)
+    assert len(deliveries) == 3000
+    assert {"client_name", "scheduled_date", "quantity"}.issubset(deliveries[0])
+
+
+def test_empty_result_is_a_valid_json_array(api_server):
+    response, body = _get(api_server, "/api/deliveries?date=1999-01-01")
+
+    assert response.status == 200
+    assert json.loads(body) == []
+
+
+def test_http10_clients_receive_unchunked_body(api_server):
+    response, body = _get(api_server, "/api/clients", http_version=10)
+
+    assert response.getheader("Transfer-Encoding") is None
+    clients = json.loads(body)
+    assert len(clients) == len(database.IDEAL_SUPERMARKETS)
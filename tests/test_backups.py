@@ -0,0 +1,124 @@
+import http.client
+import json
+import sqlite3
+import time
+from datetime import date
+
+import pytest
+
+import backend.database as database
+from backend.archive import archive_completed, archive_path
+from backend.backups import BackupManager, backup_dir, copy_database, list_backups, verify_backup, verify_snapshot
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "delivery.db")
+    monkeypatch.delenv("ARCHIVE_DB_PATH", raising=False)
+    monkeypatch.delenv("BACKUP_DIR", raising=False)
+    database.initialize()
+    yield tmp_path
+
+
+def _add_position(path, latitude):
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            conn.execute("INSERT INTO driver_positions (latitude, longitude) VALUES (?, -46.6)", (latitude,))
+    finally:
+        conn.close()
+
+
+def test_snapshot_copies_database_and_archive_and_rotates(db):
+    client_id = database.fetch_one("SELECT id FROM clients ORDER BY id LIMIT 1", ())["id"]
+    database.execute(
+        "INSERT INTO deliveries (client_id, scheduled_date, status, quantity, completed_at) "
+        "VALUES (?, '2024-01-05', 'completed', 10, '2024-01-05 09:00:00')",
+        (client_id,),
+    )
+    archive_completed(days=30, today=date(2024, 4, 1))
+    manager = BackupManager(keep=2)
+
+    runs = [manager.run() for _ in range(3)]
+
+    assert [run.status for run in runs] == ["done"] * 3
+    kept = list_backups()
+    assert [manifest["id"] for manifest in kept] == [runs[2].id, runs[1].id]
+    assert not list(backup_dir().glob("*.partial"))
+    files = {item["file"]: item for item in kept[0]["files"]}
+    assert set(files) == {"delivery.db", archive_path().name}
+    assert {path.name for path in (backup_dir() / runs[2].id).iterdir()} == set(files) | {"manifest.json"}
+    assert files["delivery.db"]["tables"]["clients"] == database.fetch_one("SELECT COUNT(*) AS n FROM clients", ())["n"]
+    assert files[archive_path().name]["tables"]["deliveries"] == 1
+    assert verify_snapshot(runs[2].id)["ok"]
+    assert verify_snapshot(runs[0].id) is None
+    assert verify_snapshot("../delivery.db") is None
+
+
+def test_copy_is_one_snapshot_and_never_blocks_writers(db, tmp_path):
+    source = database.DB_PATH
+    _add_position(source, 1.0)
+    remaining = []
+
+    def progress(left, total):
+        remaining.append(left)
+        # timeout=0: the insert raises "database is locked" if the copy blocks it.
+        conn = sqlite3.connect(source, timeout=0)
+        try:
+            with conn:
+                conn.execute("INSERT INTO driver_positions (latitude, longitude) VALUES (2, -46.6)")
+        finally:
+            conn.close()
+
+    copied = copy_database(source, tmp_path / "copy.db", pages=1, pause=0, progress=progress)
+
+    assert len(remaining) == copied["pages"]
+    assert remaining == sorted(remaining, reverse=True)
+    copy = sqlite3.connect(tmp_path / "copy.db")
+    try:
+        assert copy.execute("SELECT COUNT(*) FROM driver_positions").fetchone()[0] == 1
+    finally:
+        copy.close()
+    assert database.fetch_one("SELECT COUNT(*) AS n FROM driver_positions", ())["n"] == 1 + len(remaining)
+    assert verify_backup(tmp_path / "copy.db")["ok"]
+
+
+def test_verify_rejects_damaged_copies(db, tmp_path):
+    copy = tmp_path / "copy.db"
+    copy_database(database.DB_PATH, copy)
+    data = bytearray(copy.read_bytes())
+    data[4096 : 4096 * 3] = b"\xff" * (4096 * 2)
+    copy.write_bytes(bytes(data))
+
+    result = verify_backup(copy)
+
+    assert not result["ok"]
+    assert result["integrity"] != ["ok"]
+
+
+def test_backup_endpoints(api_server):
+    def request(method, path):
+        conn = http.client.HTTPConnection(*api_server, timeout=10)
+        try:
+            conn.request(method, path)
+            response = conn.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            conn.close()
+
+    status, started = request("POST", "/api/admin/backups")
+    assert status == 202
+    deadline = time.monotonic() + 10
+    while True:
+        status, report = request("GET", "/api/admin/backups")
+        if report["running"] is None and report["last"] and report["last"]["id"] == started["id"]:
+            break
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert report["last"]["status"] == "done"
+    assert report["backups"][0]["id"] == started["id"]
+
+    status, verified = request("POST", f"/api/admin/backups/{started['id']}/verify")
+    assert status == 200
+    assert verified["ok"]
+    assert request("POST", "/api/admin/backups/19990101T000000000000Z/verify")[0] == 404
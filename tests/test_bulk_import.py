@@ -0,0 +1,116 @@
+import http.client
+import json
+
+import pytest
+
+import backend.database as database
+from backend.bulk_import import (
+    expand_recurring_deliveries,
+    parse_records,
+    validate_clients,
+    validate_deliveries,
+)
+
+
+def test_parse_records_reads_csv_uploads():
+    body = "name,latitude,longitude\nPadaria A,-23.5,-46.6\n".encode()
+    records = parse_records(body, "text/csv; charset=utf-8")
+    assert records == [{"name": "Padaria A", "latitude": "-23.5", "longitude": "-46.6"}]
+
+
+def test_validate_clients_reports_errors_per_row():
+    rows, errors = validate_clients(
+        [
+            {"name": "Mercado 1", "latitude": "-23.5", "longitude": "-46.6"},
+            {"name": ""},
+            {"name": "Mercado 3", "latitude": "abc", "longitude": "-46.6"},
+            {"name": "Mercado 4", "latitude": "-23.5"},
+        ]
+    )
+    assert rows == [("Mercado 1", None, None, -23.5, -46.6, None)]
+    assert [error["row"] for error in errors] == [1, 2, 3]
+
+
+def test_validate_deliveries_checks_clients_dates_and_quantities():
+    rows, errors = validate_deliveries(
+        [
+            {"client_id": 1, "scheduled_date": "2024-03-01", "quantity": "12"},
+            {"client_id": 7, "scheduled_date": "2024-03-01"},
+            {"client_id": 1, "scheduled_date": "01/03/2024"},
+            {"client_id": 1, "scheduled_date": "2024-03-01", "quantity": -1},
+            {"client_id": 1, "scheduled_date": "2024-03-01", "quantity": 2.7},
+            {"client_id": 2, "scheduled_date": "2024-03-01", "quantity": "3.0"},
+        ],
+        known_client_ids=[1, 2],
+    )
+    assert rows == [(1, "2024-03-01", 12, None), (2, "2024-03-01", 3, None)]
+    assert [error["row"] for error in errors] == [1, 2, 3, 4]
+    assert errors[3]["error"] == "quantity deve ser um número inteiro"
+
+
+def test_expand_recurring_deliveries_respects_weekdays():
+    records = expand_recurring_deliveries(
+        {"client_ids": [1, 2], "start_date": "2024-03-04", "days": 7, "weekdays": [0, 2, 4]}
+    )
+    assert {record["scheduled_date"] for record in records} == {"2024-03-04", "2024-03-06", "2024-03-08"}
+    assert len(records) == 6
+
+
+def test_expand_recurring_deliveries_validates_range():
+    with pytest.raises(ValueError):
+        expand_recurring_deliveries({"client_ids": [1], "start_date": "2024-03-04", "days": 0})
+    for weekdays in ([7], [-1], "135"):
+        with pytest.raises(ValueError, match="weekdays"):
+            expand_recurring_deliveries({"client_ids": [1], "start_date": "2024-03-04", "weekdays": weekdays})
+
+
+def _post(address, path, body, content_type="application/json"):
+    conn = http.client.HTTPConnection(*address, timeout=10)
+    try:
+        conn.request("POST", path, body=body, headers={"Content-Type": content_type})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def test_bulk_clients_endpoint_inserts_csv_rows(api_server):
+    body = "name,address\nCafé Central,Rua A\nCafé Norte,Rua B\n"
+    status, payload = _post(api_server, "/api/clients/bulk", body.encode(), "text/csv")
+
+    assert status == 201
+    assert payload["inserted"] == 2
+    names = {row["name"] for row in database.fetch_all("SELECT name FROM clients")}
+    assert {"Café Central", "Café Norte"}.issubset(names)
+
+
+def test_bulk_deliveries_endpoint_is_all_or_nothing(api_server):
+    before = database.fetch_one("SELECT COUNT(*) as total FROM deliveries", ())["total"]
+    records = [
+        {"client_id": 1, "scheduled_date": "2024-03-01"},
+        {"client_id": 999, "scheduled_date": "2024-03-01"},
+    ]
+    status, payload = _post(api_server, "/api/deliveries/bulk", json.dumps(records).encode())
+
+    assert status == 400
+    assert payload["errors"][0]["row"] == 1
+    after = database.fetch_one("SELECT COUNT(*) as total FROM deliveries", ())["total"]
+    assert after == before
+
+
+def test_bulk_deliveries_endpoint_generates_recurring_week(api_server):
+    client_ids = [row["id"] for row in database.fetch_all("SELECT id FROM clients")]
+    spec = {"recurring": {"client_ids": client_ids, "start_date": "2024-03-04", "days": 7}}
+    status, payload = _post(api_server, "/api/deliveries/bulk", json.dumps(spec).encode())
+
+    assert status == 201
+    assert payload["inserted"] == 7 * len(client_ids)
+
+
+def test_bulk_deliveries_endpoint_rejects_malformed_recurrence(api_server):
+    for recurring in (["2024-03-04"], "semanal", {"client_ids": [1], "start_date": "2024-03-04", "weekdays": [9]}):
+        body = json.dumps({"recurring": recurring}).encode()
+        status, payload = _post(api_server, "/api/deliveries/bulk", body)
+
+        assert status == 400
+        assert payload["error"]
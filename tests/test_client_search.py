@@ -0,0 +1,91 @@
+import http.client
+import json
+
+import pytest
+
+import backend.database as database
+from backend.client_search import build_match_query, parse_limit, search_clients
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "delivery.db")
+    database.initialize()
+    yield
+
+
+def _names(results):
+    return [row["name"] for row in results]
+
+
+def test_match_query_quotes_every_word_as_prefix():
+    assert build_match_query("pad  ideal") == '"pad"* "ideal"*'
+    assert build_match_query('café" OR NEAR(') == '"café"* "OR"* "NEAR"*'
+    assert build_match_query(" - ") is None
+
+
+def test_search_matches_prefixes_without_accents_and_ranks_name_first(db):
+    database.execute(
+        "INSERT INTO clients (name, address, notes) VALUES (?, ?, ?)",
+        ("Café Paulista", "Rua Bom Jesus, 10", None),
+    )
+    database.execute(
+        "INSERT INTO clients (name, address, notes) VALUES (?, ?, ?)",
+        ("Mercado Bom Preço", "Rua Augusta, 2000", "Cliente do café da manhã"),
+    )
+
+    assert _names(search_clients("cafe")) == ["Café Paulista", "Mercado Bom Preço"]
+    assert _names(search_clients("bom")) == ["Mercado Bom Preço", "Café Paulista"]
+    assert _names(search_clients("ideal cent")) == ["Supermercado Ideal - Centro"]
+    assert len(search_clients("ideal", limit=2)) == 2
+
+
+def test_index_follows_updates_and_deletes(db):
+    client_id = database.execute("INSERT INTO clients (name, address) VALUES ('Padaria Sol', 'Rua Um')")
+
+    database.execute("UPDATE clients SET name = 'Padaria Lua' WHERE id = ?", (client_id,))
+    assert search_clients("sol") == []
+    assert _names(search_clients("lua")) == ["Padaria Lua"]
+
+    database.execute("UPDATE clients SET latitude = -23.5 WHERE id = ?", (client_id,))
+    assert _names(search_clients("lua")) == ["Padaria Lua"]
+
+    database.execute("DELETE FROM clients WHERE id = ?", (client_id,))
+    assert search_clients("lua") == []
+
+
+def test_existing_clients_are_indexed_when_the_index_is_created(db):
+    conn = database.get_connection()
+    try:
+        conn.executescript(
+            "DROP TRIGGER trg_clients_fts_insert; DROP TRIGGER trg_clients_fts_update; "
+            "DROP TRIGGER trg_clients_fts_delete; DROP TABLE clients_fts;"
+        )
+        conn.execute("INSERT INTO clients (name) VALUES ('Empório Antigo')")
+        conn.commit()
+    finally:
+        conn.close()
+
+    database.initialize()
+
+    assert _names(search_clients("empo")) == ["Empório Antigo"]
+
+
+def test_search_endpoint_validates_input(api_server):
+    def get(path):
+        conn = http.client.HTTPConnection(*api_server, timeout=10)
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            conn.close()
+
+    status, results = get("/api/clients/search?q=ideal%20norte")
+    assert status == 200
+    assert _names(results) == ["Supermercado Ideal - Norte"]
+
+    assert get("/api/clients/search?q=")[0] == 400
+    assert get("/api/clients/search?q=ideal&limit=1000")[0] == 400
+    with pytest.raises(ValueError):
+        parse_limit("0")
@@ -37,4 +37,71 @@ def test_initialize_creates_tracking_tables(tmp_path, monkeypatch):
         conn.close()
 
     assert {"arrived_at", "departed_at", "stay_seconds"}.issubset(delivery_columns)
-    assert {"client_id", "detected_at", "status"}.issubset(visit_columns)
+    assert {"client_id", "detected_ms", "confirmed_ms", "status"}.issubset(visit_columns)
+
+
+def test_initialize_migrates_text_timestamps_to_epoch_ms(tmp_path, monkeypatch):
+    db_path = tmp_path / "legacy.db"
+    monkeypatch.setattr(database, "DB_PATH", db_path)
+    conn = database.get_connection()
+    try:
+        conn.executescript(
+            """
+            CREATE TABLE driver_positions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT DEFAULT (datetime('now')),
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL
+            );
+            CREATE INDEX idx_driver_positions_timestamp ON driver_positions(timestamp);
+            CREATE TABLE delivery_visits (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                delivery_id INTEGER,
+                client_id INTEGER,
+                detected_at TEXT DEFAULT (datetime('now')),
+                confirmed_at TEXT,
+                stay_seconds INTEGER,
+                quantity INTEGER,
+                notes TEXT,
+                status TEXT NOT NULL DEFAULT 'detected'
+            );
+            INSERT INTO driver_positions (id, timestamp, latitude, longitude)
+            VALUES (7, '2024-03-01 08:00:00', -23.5, -46.6), (8, 'ontem', -23.5, -46.6);
+            INSERT INTO delivery_visits (delivery_id, client_id, detected_at, confirmed_at, stay_seconds, status)
+            VALUES (1, 1, '2024-03-01T08:05:30', '2024-03-01 08:10:00', 120, 'confirmed');
+            """
+        )
+    finally:
+        conn.close()
+
+    database.initialize()
+    database.initialize()
+
+    positions = database.fetch_all("SELECT * FROM driver_positions_iso ORDER BY id")
+    assert [(row["id"], row["recorded_ms"]) for row in positions] == [(7, 1709280000000), (8, None)]
+    assert positions[0]["timestamp"] == "2024-03-01 08:00:00"
+    visit = database.fetch_one("SELECT * FROM delivery_visits_iso", ())
+    assert visit["detected_ms"] == 1709280330000
+    assert (visit["detected_at"], visit["confirmed_at"]) == ("2024-03-01 08:05:30", "2024-03-01 08:10:00")
+
+    new_id = database.execute("INSERT INTO driver_positions (latitude, longitude) VALUES (0, 0)")
+    assert new_id == 9
+    row = database.fetch_one("SELECT recorded_ms FROM driver_positions WHERE id = ?", (new_id,))
+    assert abs(row["recorded_ms"] - database.epoch_ms()) < 5000
+    assert database.iso_from_ms(row["recorded_ms"]) == database.fetch_one(
+        "SELECT timestamp FROM driver_positions_iso WHERE id = ?", (new_id,)
+    )["timestamp"]
+
+
+def test_iter_rows_streams_in_batches(tmp_path, monkeypatch):
+    db_path = tmp_path / "stream.db"
+    monkeypatch.setattr(database, "DB_PATH", db_path)
+
+    database.initialize()
+
+    rows = database.iter_rows("SELECT name FROM clients ORDER BY name", batch_size=2)
+    first = next(rows)
+    remaining = list(rows)
+
+    names = [first["name"]] + [row["name"] for row in remaining]
+    assert names == sorted(client["name"] for client in database.IDEAL_SUPERMARKETS)
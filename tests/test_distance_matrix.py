@@ -0,0 +1,133 @@
+import random
+
+import pytest
+
+import backend.database as database
+import backend.distance_matrix as distance_matrix
+from backend.distance_matrix import DistanceMatrixStore
+from backend.routes_logic import DistanceMatrix, haversine_distance, nearest_neighbor_route
+from benchmarks.synthetic import SAO_PAULO_CENTER, make_clients
+
+
+@pytest.fixture
+def seeded_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "distances.db")
+    database.initialize()
+    return database.fetch_all("SELECT * FROM clients ORDER BY id")
+
+
+def test_matrix_is_persisted_and_reused_without_trigonometry(seeded_db, monkeypatch):
+    DistanceMatrixStore().matrix_for(seeded_db)
+    stored = database.fetch_one("SELECT COUNT(*) AS total FROM client_distances", ())["total"]
+    assert stored == len(seeded_db) * (len(seeded_db) - 1) // 2
+
+    def fail(*args):
+        raise AssertionError("distances should come from client_distances")
+
+    monkeypatch.setattr(distance_matrix, "haversine_distance", fail)
+    matrix = DistanceMatrixStore().matrix_for(seeded_db)
+
+    first, second = seeded_db[0], seeded_db[1]
+    expected = haversine_distance(
+        (first["latitude"], first["longitude"]),
+        (second["latitude"], second["longitude"]),
+    )
+    assert matrix.distance(first["id"], second["id"]) == pytest.approx(expected)
+    assert matrix.distance(second["id"], first["id"]) == pytest.approx(expected)
+
+
+def test_coordinate_change_invalidates_rows(seeded_db):
+    store = DistanceMatrixStore()
+    store.matrix_for(seeded_db)
+    moved = seeded_db[0]
+
+    database.execute("UPDATE clients SET latitude = ? WHERE id = ?", (-23.70, moved["id"]))
+    remaining = database.fetch_one(
+        "SELECT COUNT(*) AS total FROM client_distances WHERE origin_id = ? OR destination_id = ?",
+        (moved["id"], moved["id"]),
+    )["total"]
+    assert remaining == 0
+
+    refreshed = database.fetch_all("SELECT * FROM clients ORDER BY id")
+    matrix = store.matrix_for(refreshed)
+    other = refreshed[1]
+    assert matrix.distance(moved["id"], other["id"]) == pytest.approx(
+        haversine_distance((-23.70, moved["longitude"]), (other["latitude"], other["longitude"]))
+    )
+
+
+class _ForgetOnceFilled:
+    """Store lock that forgets a client the first time it is taken with pairs cached."""
+
+    def __init__(self, store, client_id):
+        self.store = store
+        self.client_id = client_id
+        self.lock = store._lock
+        self.done = False
+
+    def __enter__(self):
+        self.lock.acquire()
+        if not self.done and self.store._distances:
+            self.done = True
+            self.store._forget_locked(self.client_id)
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+
+def test_pairs_dropped_concurrently_are_recomputed(seeded_db):
+    store = DistanceMatrixStore()
+    store._lock = _ForgetOnceFilled(store, seeded_db[0]["id"])
+
+    matrix = store.matrix_for(seeded_db)
+
+    assert store._lock.done
+    first, second = seeded_db[0], seeded_db[1]
+    expected = haversine_distance(
+        (first["latitude"], first["longitude"]),
+        (second["latitude"], second["longitude"]),
+    )
+    assert matrix.distance(first["id"], second["id"]) == pytest.approx(expected)
+
+
+def test_refresh_client_fills_its_row(seeded_db):
+    store = DistanceMatrixStore()
+    client_id = database.execute(
+        "INSERT INTO clients (name, latitude, longitude) VALUES ('Novo', -23.6, -46.7)"
+    )
+    store.refresh_client(client_id, -23.6, -46.7)
+
+    rows = database.fetch_one(
+        "SELECT COUNT(*) AS total FROM client_distances WHERE origin_id = ? OR destination_id = ?",
+        (client_id, client_id),
+    )["total"]
+    assert rows == len(seeded_db)
+
+
+def test_nearest_neighbor_with_matrix_matches_plain_ordering():
+    clients = make_clients(60, random.Random(3))
+    ids = [client["id"] for client in clients]
+    rows = [
+        [
+            haversine_distance((a["latitude"], a["longitude"]), (b["latitude"], b["longitude"]))
+            for b in clients
+        ]
+        for a in clients
+    ]
+    matrix = DistanceMatrix(ids, rows)
+
+    plain = nearest_neighbor_route(SAO_PAULO_CENTER, clients)
+    with_matrix = nearest_neighbor_route(SAO_PAULO_CENTER, clients, matrix)
+
+    assert [client["id"] for client in with_matrix] == [client["id"] for client in plain]
+
+
+def test_measured_durations_keep_their_direction(seeded_db):
+    first, second = seeded_db[0]["id"], seeded_db[1]["id"]
+    DistanceMatrixStore().matrix_for(seeded_db)
+    store = DistanceMatrixStore()
+    store.record_durations([(first, second, 300.0), (second, first, 420.0)])
+
+    for matrix in (store.matrix_for(seeded_db), DistanceMatrixStore().matrix_for(seeded_db)):
+        assert matrix.duration(first, second) == 300.0
+        assert matrix.duration(second, first) == 420.0
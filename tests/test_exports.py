@@ -0,0 +1,108 @@
+import csv
+import http.client
+import io
+import json
+from datetime import datetime
+
+import pytest
+
+import backend.database as database
+from backend.exports import DELIVERY_COLUMNS, encode_rows, parse_export_filters
+
+
+def test_parse_export_filters_accepts_ranges_and_client_lists():
+    filters = parse_export_filters(
+        {"from": ["2024-01-01"], "to": ["2024-01-31"], "client_id": ["1,2", "5"], "format": ["ndjson"]}
+    )
+
+    assert filters.date_from.isoformat() == "2024-01-01"
+    assert filters.date_to.isoformat() == "2024-01-31"
+    assert filters.client_ids == (1, 2, 5)
+    assert filters.export_format == "ndjson"
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"format": ["xlsx"]},
+        {"from": ["01/02/2024"]},
+        {"from": ["2024-02-01"], "to": ["2024-01-01"]},
+        {"client_id": ["abc"]},
+    ],
+)
+def test_parse_export_filters_rejects_invalid_input(params):
+    with pytest.raises(ValueError):
+        parse_export_filters(params)
+
+
+def test_encode_csv_writes_header_even_without_rows():
+    body = b"".join(encode_rows(iter(()), DELIVERY_COLUMNS, "csv")).decode()
+    assert body.strip() == ",".join(DELIVERY_COLUMNS)
+
+
+def _seed_history():
+    conn = database.get_connection()
+    try:
+        client_ids = [row["id"] for row in conn.execute("SELECT id FROM clients ORDER BY id LIMIT 2")]
+        conn.executemany(
+            "INSERT INTO deliveries (client_id, scheduled_date, status, quantity) VALUES (?, ?, 'completed', ?)",
+            [
+                (client_ids[day % 2], f"2024-01-{day:02d}", day)
+                for day in range(1, 29)
+            ],
+        )
+        conn.execute(
+            "INSERT INTO delivery_visits (delivery_id, client_id, detected_ms, stay_seconds, status) "
+            "VALUES (1, ?, ?, 240, 'confirmed')",
+            (client_ids[0], database.epoch_ms(datetime(2024, 1, 10, 8, 30))),
+        )
+        conn.commit()
+        return client_ids
+    finally:
+        conn.close()
+
+
+def _get(address, path):
+    conn = http.client.HTTPConnection(*address, timeout=10)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        return response, response.read().decode()
+    finally:
+        conn.close()
+
+
+def test_export_deliveries_csv_filters_by_range_and_client(api_server):
+    client_ids = _seed_history()
+
+    response, body = _get(
+        api_server,
+        f"/api/export/deliveries?from=2024-01-05&to=2024-01-14&client_id={client_ids[1]}",
+    )
+
+    assert response.status == 200
+    assert response.getheader("Content-Type").startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(body)))
+    assert [row["scheduled_date"] for row in rows] == [
+        f"2024-01-{day:02d}" for day in (5, 7, 9, 11, 13)
+    ]
+    assert {row["client_id"] for row in rows} == {str(client_ids[1])}
+
+
+def test_export_visits_ndjson_includes_stay_seconds(api_server):
+    _seed_history()
+
+    response, body = _get(api_server, "/api/export/visits?format=ndjson&from=2024-01-10&to=2024-01-10")
+
+    assert response.status == 200
+    visits = [json.loads(line) for line in body.splitlines()]
+    assert len(visits) == 1
+    assert visits[0]["stay_seconds"] == 240
+    assert visits[0]["detected_at"] == "2024-01-10 08:30:00"
+
+
+def test_export_rejects_invalid_format(api_server):
+    response, body = _get(api_server, "/api/export/deliveries?format=xml")
+
+    assert response.status == 400
+    assert "error" in json.loads(body)
@@ -0,0 +1,130 @@
+import pytest
+
+import backend.database as database
+from backend.distance_matrix import STORE as DISTANCES
+from backend.geocoding import (
+    GeocoderError,
+    GeocodingWorker,
+    RateLimiter,
+    StubGeocoder,
+    normalize_address,
+)
+
+PAULISTA = (-23.5614, -46.6559)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "delivery.db")
+    database.initialize()
+    DISTANCES.clear()
+    yield
+    DISTANCES.clear()
+
+
+def _add_client(name, address, latitude=None, longitude=None):
+    return database.execute(
+        "INSERT INTO clients (name, address, latitude, longitude) VALUES (?, ?, ?, ?)",
+        (name, address, latitude, longitude),
+    )
+
+
+def _coordinates(client_id):
+    row = database.fetch_one("SELECT latitude, longitude FROM clients WHERE id = ?", (client_id,))
+    return (row["latitude"], row["longitude"])
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _worker(geocoder, **kwargs):
+    clock = _FakeClock()
+    return GeocodingWorker(geocoder, RateLimiter(2, clock=clock, sleep=clock.sleep), **kwargs), clock
+
+
+def test_normalize_address_ignores_accents_case_and_abbreviations():
+    assert normalize_address("Av. Paulista, 1000 - São Paulo/SP") == normalize_address(
+        "avenida  paulista 1000 sao paulo sao paulo"
+    )
+    assert normalize_address("R. Augusta, 50") == "rua augusta 50"
+
+
+def test_batch_geocodes_once_per_normalized_address(db):
+    first = _add_client("Padaria A", "Av. Paulista, 1000")
+    second = _add_client("Padaria B", "avenida paulista 1000")
+    located = _add_client("Padaria C", "Rua Augusta, 1", -23.55, -46.65)
+    geocoder = StubGeocoder({"Avenida Paulista 1000": PAULISTA}, synthesize=False)
+    worker, clock = _worker(geocoder)
+
+    counts = worker.run_batch()
+
+    assert geocoder.calls == ["Av. Paulista, 1000"]
+    assert counts["geocoded"] == 1 and counts["updated"] == 2
+    assert _coordinates(first) == PAULISTA
+    assert _coordinates(second) == PAULISTA
+    assert _coordinates(located) == (-23.55, -46.65)
+    assert database.fetch_one(
+        "SELECT COUNT(*) AS total FROM client_distances WHERE origin_id = ? OR destination_id = ?",
+        (first, first),
+    )["total"] > 0
+
+    # A new client at a known address is filled from the cache.
+    third = _add_client("Padaria D", "AV PAULISTA 1000")
+    counts = worker.run_batch()
+    assert geocoder.calls == ["Av. Paulista, 1000"]
+    assert counts["cached"] == 1
+    assert _coordinates(third) == PAULISTA
+
+
+def test_misses_are_cached_and_errors_retried(db):
+    unknown = _add_client("Sem endereço", "Rua Que Não Existe, 0")
+
+    class Flaky(StubGeocoder):
+        failures = 1
+
+        def geocode(self, address):
+            if self.failures:
+                self.failures -= 1
+                raise GeocoderError("timeout")
+            return super().geocode(address)
+
+    geocoder = Flaky(synthesize=False)
+    worker, _ = _worker(geocoder)
+
+    assert worker.run_batch()["errors"] == 1
+    assert worker.run_batch()["not_found"] == 1
+    assert worker.run_batch()["not_found"] == 0
+    assert len(geocoder.calls) == 1
+    assert _coordinates(unknown) == (None, None)
+
+
+def test_batch_size_and_rate_limit_bound_backend_calls(db):
+    for number in range(5):
+        _add_client(f"Cliente {number}", f"Rua {number}, 10")
+    geocoder = StubGeocoder()
+    worker, clock = _worker(geocoder, batch_size=3)
+
+    counts = worker.run_batch()
+
+    assert counts["geocoded"] == 3
+    assert len(geocoder.calls) == 3
+    assert clock.sleeps == [0.5, 0.5]
+    assert worker.run_batch()["geocoded"] == 2
+
+
+def test_stub_geocoder_is_deterministic():
+    first = StubGeocoder().geocode("Rua Augusta, 500")
+    second = StubGeocoder().geocode("rua augusta 500")
+
+    assert first == second
+    assert abs(first[0] + 23.55) < 0.06 and abs(first[1] + 46.63) < 0.06
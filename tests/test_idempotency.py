@@ -0,0 +1,116 @@
+import http.client
+import json
+
+import pytest
+
+import backend.database as database
+from backend.idempotency import IN_PROGRESS, MISMATCH, NEW, REPLAY, STORE, IdempotencyStore
+
+
+@pytest.fixture(autouse=True)
+def _clear_store():
+    STORE.clear()
+    yield
+    STORE.clear()
+
+
+def _post(address, path, payload, key=None):
+    headers = {"Content-Type": "application/json"}
+    if key is not None:
+        headers["Idempotency-Key"] = key
+    conn = http.client.HTTPConnection(*address, timeout=10)
+    try:
+        conn.request("POST", path, body=json.dumps(payload), headers=headers)
+        response = conn.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        conn.close()
+
+
+def _positions():
+    return database.fetch_one("SELECT COUNT(*) AS total FROM driver_positions", ())["total"]
+
+
+class _Clock:
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_store_replays_expires_and_evicts():
+    clock = _Clock()
+    store = IdempotencyStore(ttl_seconds=60, max_entries=2, clock=clock)
+
+    outcome, entry = store.begin("POST /a", "k1", b"{}")
+    assert outcome == NEW
+    store.complete(entry, 201, b"raw")
+    outcome, replay = store.begin("POST /a", "k1", b"{}")
+    assert (outcome, replay.raw) == (REPLAY, b"raw")
+    assert store.begin("POST /a", "k1", b'{"x": 1}')[0] == MISMATCH
+    assert store.begin("POST /b", "k1", b"{}")[0] == NEW
+
+    store.begin("POST /a", "k2", b"{}")
+    assert len(store) == 2
+    assert store.begin("POST /a", "k1", b"{}")[0] == NEW
+
+    clock.now = 61
+    assert store.begin("POST /a", "k2", b"{}")[0] == NEW
+    assert len(store) == 1
+
+
+def test_store_reports_in_flight_and_forgets_abandoned_keys():
+    store = IdempotencyStore()
+    outcome, entry = store.begin("POST /a", "k", b"{}")
+
+    assert store.begin("POST /a", "k", b"{}", wait=0.01)[0] == IN_PROGRESS
+    store.abandon("POST /a", "k", entry)
+    assert store.begin("POST /a", "k", b"{}")[0] == NEW
+
+
+def test_location_retry_is_replayed_without_writing(api_server):
+    position = {"latitude": -23.56, "longitude": -46.65}
+    before = _positions()
+
+    status, headers, first = _post(api_server, "/api/driver/location", position, key="abc")
+    again, replay_headers, second = _post(api_server, "/api/driver/location", position, key="abc")
+
+    assert status == again == 201
+    assert second == first
+    assert replay_headers.get("Idempotent-Replayed") == "true"
+    assert "Idempotent-Replayed" not in headers
+    assert _positions() == before + 1
+
+    status, _, body = _post(api_server, "/api/driver/location", {"latitude": 1, "longitude": 2}, key="abc")
+    assert status == 422
+    assert "Idempotency-Key" in json.loads(body)["error"]
+
+    _post(api_server, "/api/driver/location", position)
+    _post(api_server, "/api/driver/location", position)
+    assert _positions() == before + 3
+
+
+def test_completion_retry_returns_original_response(api_server):
+    delivery = database.fetch_one("SELECT id FROM deliveries ORDER BY id LIMIT 1", ())
+    if delivery is None:
+        client_id = database.fetch_one("SELECT id FROM clients ORDER BY id LIMIT 1", ())["id"]
+        delivery = {
+            "id": database.execute(
+                "INSERT INTO deliveries (client_id, scheduled_date) VALUES (?, '2024-06-03')", (client_id,)
+            )
+        }
+    path = f"/api/deliveries/{delivery['id']}/complete"
+
+    status, _, first = _post(api_server, path, {"quantity": 12}, key="entrega-1")
+    completed_at = database.fetch_one("SELECT completed_at FROM deliveries WHERE id = ?", (delivery["id"],))
+    database.execute("UPDATE deliveries SET completed_at = '2000-01-01 00:00:00' WHERE id = ?", (delivery["id"],))
+    again, _, second = _post(api_server, path, {"quantity": 12}, key="entrega-1")
+
+    assert status == again == 200
+    assert second == first
+    assert json.loads(first)["delivery"]["completed_at"] == completed_at["completed_at"]
+    row = database.fetch_one("SELECT completed_at FROM deliveries WHERE id = ?", (delivery["id"],))
+    assert row["completed_at"] == "2000-01-01 00:00:00"
+
+    status, _, _ = _post(api_server, path, {"quantity": 12}, key="x" * 300)
+    assert status == 400
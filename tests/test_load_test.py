@@ -0,0 +1,39 @@
+import pytest
+
+import backend.database as database
+from benchmarks.load_test import parse_mix, percentile, run_load_test
+
+
+def test_percentile_uses_nearest_rank():
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 0.50) == 50.0
+    assert percentile(values, 0.95) == 95.0
+    assert percentile(values, 0.99) == 99.0
+    assert percentile([], 0.5) == 0.0
+
+
+def test_parse_mix_rejects_unknown_endpoints():
+    assert parse_mix("summary=3,routes") == [("summary", 3), ("routes", 1)]
+    with pytest.raises(ValueError):
+        parse_mix("summary=1,export=2")
+
+
+def test_short_run_reports_every_endpoint():
+    original_path = database.DB_PATH
+    report = run_load_test(
+        drivers=2,
+        dashboards=2,
+        duration=1.0,
+        location_interval=0.1,
+        dashboard_interval=0.05,
+        mix="summary=1,routes=1",
+        clients=20,
+        days=2,
+        positions=200,
+    )
+
+    assert database.DB_PATH == original_path
+    assert "POST /api/driver/location" in report["endpoints"]
+    assert report["total_requests"] > 0
+    assert all(stats["errors"] == 0 for stats in report["endpoints"].values())
+    assert report["endpoints"]["POST /api/driver/location"]["p99_ms"] > 0
@@ -0,0 +1,66 @@
+import http.client
+
+from backend import metrics
+
+
+def test_normalize_route_collapses_ids():
+    assert metrics.normalize_route("/api/deliveries/42/complete") == "/api/deliveries/:id/complete"
+    assert metrics.normalize_route("/api/clients/7") == "/api/clients/:id"
+    assert metrics.normalize_route("/api/routes/jobs/3f2a9c") == "/api/routes/jobs/:id"
+    assert metrics.normalize_route("/api/clients/search") == "/api/clients/search"
+    assert metrics.normalize_route("/index.html") == "static"
+
+
+def test_unknown_api_paths_share_one_label():
+    for path in ("/api/wp-login.php", "/api/clients/7/../../etc", "/api/deliveries/abc/cancel", "/api/x/1"):
+        assert metrics.normalize_route(path) == metrics.UNMATCHED_ROUTE
+
+
+def test_registry_renders_cumulative_histogram_buckets():
+    registry = metrics.MetricsRegistry()
+    registry.histogram("latency_seconds", "Latency.", (0.1, 1.0))
+    registry.observe("latency_seconds", (("route", "/api/x"),), 0.05)
+    registry.observe("latency_seconds", (("route", "/api/x"),), 0.5)
+    registry.observe("latency_seconds", (("route", "/api/x"),), 3.0)
+
+    text = registry.render()
+
+    assert 'latency_seconds_bucket{route="/api/x",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{route="/api/x",le="1"} 2' in text
+    assert 'latency_seconds_bucket{route="/api/x",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{route="/api/x"} 3' in text
+
+
+def test_sql_statements_are_attributed_to_the_current_request():
+    metrics.REGISTRY.reset()
+    metrics.start_request()
+    metrics.observe_query("SELECT 1", (), 0.002)
+    metrics.observe_query("SELECT 2", (), 0.003)
+    metrics.finish_request("GET", "/api/clients", 200, 0.01)
+
+    text = metrics.render()
+
+    assert 'bakery_sql_statements_total{route="/api/clients"} 2' in text
+    assert 'bakery_http_requests_total{method="GET",route="/api/clients",status="200"} 1' in text
+
+
+def _get(address, path):
+    conn = http.client.HTTPConnection(*address, timeout=10)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        return response, response.read().decode()
+    finally:
+        conn.close()
+
+
+def test_runtime_metrics_endpoint_reports_requests(api_server):
+    metrics.REGISTRY.reset()
+    _get(api_server, "/api/metrics/summary")
+
+    response, body = _get(api_server, "/api/metrics/runtime")
+
+    assert response.status == 200
+    assert response.getheader("Content-Type").startswith("text/plain")
+    assert 'bakery_http_requests_total{method="GET",route="/api/metrics/summary",status="200"} 1' in body
+    assert 'bakery_sql_statements_per_request_count{method="GET",route="/api/metrics/summary"} 1' in body
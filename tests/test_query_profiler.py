@@ -0,0 +1,70 @@
+import backend.database as database
+from backend.archive import connect_history
+from backend.query_profiler import QueryProfiler, normalize_statement, profiler_from_env
+
+
+def test_normalize_statement_collapses_whitespace_and_in_lists():
+    query = "SELECT *\n  FROM clients WHERE id IN (?, ?,?)"
+    assert normalize_statement(query) == "SELECT * FROM clients WHERE id IN (?, ...)"
+
+
+def test_profiler_captures_plan_once_for_slow_statements(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "profile.db")
+    database.initialize()
+    profiler = QueryProfiler(threshold_ms=0, connect=database.get_connection)
+    database.add_query_observer(profiler)
+    try:
+        for _ in range(3):
+            database.fetch_all(
+                "SELECT * FROM deliveries WHERE status != 'completed' AND date(completed_at) = date('now')"
+            )
+        database.fetch_one("SELECT COUNT(*) FROM clients", ())
+    finally:
+        database.remove_query_observer(profiler)
+
+    top = profiler.top()
+    deliveries = next(entry for entry in top if "FROM deliveries" in entry["statement"])
+    assert deliveries["calls"] == 3
+    assert deliveries["slow_calls"] == 3
+    assert any("SCAN" in step for step in deliveries["plan"])
+    assert "SCAN" in profiler.dump()
+
+
+def test_profiler_explains_on_the_connection_the_statement_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "profile.db")
+    monkeypatch.delenv("ARCHIVE_DB_PATH", raising=False)
+    database.initialize()
+    profiler = QueryProfiler(threshold_ms=0, connect=database.get_connection)
+    database.add_query_observer(profiler)
+    try:
+        database.fetch_all("SELECT * FROM deliveries_history WHERE status = ?", ("completed",), connect=connect_history)
+        database.execute_many("INSERT INTO driver_positions (latitude, longitude) VALUES (?, ?)", [(1, 2), (3, 4)])
+    finally:
+        database.remove_query_observer(profiler)
+
+    for entry in profiler.top():
+        assert entry["plan"] is not None
+        assert not any("indisponível" in step for step in entry["plan"]), entry
+    batch = next(entry for entry in profiler.top() if "driver_positions" in entry["statement"])
+    assert batch["last_slow_params"] == [1, 2]
+
+
+def test_profiler_skips_plan_for_fast_statements():
+    calls = []
+
+    def connect():
+        calls.append(1)
+        raise AssertionError("EXPLAIN should not run for fast statements")
+
+    profiler = QueryProfiler(threshold_ms=1000, connect=connect)
+    profiler("SELECT 1", (), 0.001)
+
+    assert calls == []
+    assert profiler.top()[0]["plan"] is None
+
+
+def test_profiler_from_env_requires_threshold(monkeypatch):
+    monkeypatch.delenv("SLOW_QUERY_MS", raising=False)
+    assert profiler_from_env(database.get_connection) is None
+    monkeypatch.setenv("SLOW_QUERY_MS", "25")
+    assert profiler_from_env(database.get_connection).threshold_ms == 25.0
@@ -0,0 +1,163 @@
+import heapq
+import random
+from math import inf
+from pathlib import Path
+
+import pytest
+
+from backend.road_network import ACCESS_SPEED_KMH, RoadNetwork, main, parse_osm_xml
+from backend.routes_logic import haversine_distance, optimize_route_with_google
+
+FIXTURE = Path(__file__).parent / "fixtures" / "road_graph.json"
+
+# Two river banks joined by a single bridge at the east end of the fixture.
+SOUTH_WEST = (-23.554, -46.660)
+NORTH_WEST = {"id": 1, "name": "Margem norte", "latitude": -23.548, "longitude": -46.660}
+SOUTH_EAST = {"id": 2, "name": "Margem sul", "latitude": -23.560, "longitude": -46.648}
+
+
+@pytest.fixture(scope="module")
+def network():
+    return RoadNetwork.load(FIXTURE)
+
+
+def _dijkstra(edges, source):
+    graph = {}
+    for origin, destination, seconds, _ in edges:
+        graph.setdefault(origin, []).append((destination, seconds))
+    dist = {source: 0.0}
+    heap = [(0.0, source)]
+    while heap:
+        cost, node = heapq.heappop(heap)
+        if cost > dist[node]:
+            continue
+        for neighbor, seconds in graph.get(node, ()):
+            if cost + seconds < dist.get(neighbor, inf):
+                dist[neighbor] = cost + seconds
+                heapq.heappush(heap, (cost + seconds, neighbor))
+    return dist
+
+
+def test_contracted_queries_match_plain_dijkstra(network):
+    nodes = list(range(len(network.coordinates)))
+    seconds, meters = network.many_to_many(nodes, nodes)
+
+    for source in nodes:
+        expected = _dijkstra(network.edges, source)
+        for target in nodes:
+            assert seconds[source][target] == pytest.approx(expected.get(target, inf))
+    assert all(value < inf for row in meters for value in row)
+
+
+def test_contraction_of_random_grid_preserves_distances():
+    rng = random.Random(7)
+    size = 10
+    coordinates = [(-23.6 + 0.002 * row, -46.7 + 0.002 * column) for row in range(size) for column in range(size)]
+    edges = []
+    for node in range(size * size):
+        for neighbor in (node + 1, node + size):
+            if neighbor < size * size and (neighbor != node + 1 or neighbor % size):
+                seconds = rng.uniform(10, 60)
+                edges.append((node, neighbor, seconds, seconds * 8))
+                if rng.random() > 0.2:
+                    edges.append((neighbor, node, seconds, seconds * 8))
+    network = RoadNetwork(coordinates, edges)
+    sample = rng.sample(range(size * size), 25)
+
+    seconds, _ = network.many_to_many(sample, sample)
+
+    for row, source in enumerate(sample):
+        expected = _dijkstra(network.edges, source)
+        assert seconds[row] == [pytest.approx(expected.get(target, inf)) for target in sample]
+
+
+def test_one_way_streets_are_respected(network):
+    # Nodes 6 -> 7 are joined by a street that only runs eastbound.
+    forward, _ = network.many_to_many([6], [7])
+    backward, _ = network.many_to_many([7], [6])
+    assert backward[0][0] > forward[0][0]
+
+
+def test_offline_route_goes_around_the_river(network):
+    clients = [NORTH_WEST, SOUTH_EAST]
+
+    straight_line, _ = optimize_route_with_google(None, SOUTH_WEST, clients)
+    by_road, directions = optimize_route_with_google(None, SOUTH_WEST, clients, road_network=network)
+
+    assert [client["id"] for client in straight_line] == [1, 2]
+    assert [client["id"] for client in by_road] == [2, 1]
+    assert directions is None
+
+
+def test_points_off_the_graph_fall_back_to_straight_line(network):
+    far_away = {"id": 3, "latitude": -22.9, "longitude": -43.2}
+
+    assert network.nearest_node((-22.9, -43.2)) is None
+    assert network.route_matrix(SOUTH_WEST, [far_away]) is None
+    ordered, _ = optimize_route_with_google(None, SOUTH_WEST, [far_away, NORTH_WEST], road_network=network)
+    assert [client["id"] for client in ordered] == [1, 3]
+
+
+def test_only_unsnapped_points_use_straight_lines(network):
+    far_away = {"id": 3, "latitude": -22.9, "longitude": -43.2}
+    on_graph = [NORTH_WEST, SOUTH_EAST]
+
+    road, road_from_start = network.route_matrix(SOUTH_WEST, on_graph)
+    mixed, from_start = network.route_matrix(SOUTH_WEST, on_graph + [far_away])
+
+    assert mixed.distance(1, 2) == road.distance(1, 2)
+    assert mixed.distance(2, 1) == road.distance(2, 1)
+    assert {key: from_start[key] for key in (1, 2)} == road_from_start
+    straight = haversine_distance((-23.548, -46.660), (-22.9, -43.2)) / ACCESS_SPEED_KMH * 3600
+    assert mixed.distance(1, 3) == pytest.approx(straight)
+    assert mixed.distance(3, 1) == pytest.approx(straight)
+    assert from_start[3] == pytest.approx(haversine_distance(SOUTH_WEST, (-22.9, -43.2)) / ACCESS_SPEED_KMH * 3600)
+
+
+def test_built_graph_round_trips_through_gzip(network, tmp_path):
+    output = tmp_path / "graph.json.gz"
+    assert main([str(FIXTURE), str(output)]) == 0
+
+    loaded = RoadNetwork.load(output)
+    nodes = list(range(len(network.coordinates)))
+    assert loaded.ranks == network.ranks
+    expected, _ = network.many_to_many(nodes, nodes)
+    actual, _ = loaded.many_to_many(nodes, nodes)
+    assert actual == [[pytest.approx(value, abs=0.5) for value in row] for row in expected]
+
+
+def test_parse_osm_xml_keeps_drivable_ways(tmp_path):
+    extract = tmp_path / "extract.osm"
+    extract.write_text(
+        """<?xml version="1.0"?>
+<osm version="0.6">
+  <node id="10" lat="-23.550" lon="-46.630"/>
+  <node id="11" lat="-23.551" lon="-46.630"/>
+  <node id="12" lat="-23.552" lon="-46.630"/>
+  <node id="13" lat="-23.553" lon="-46.630"/>
+  <way id="1">
+    <nd ref="10"/><nd ref="11"/><nd ref="12"/>
+    <tag k="highway" v="residential"/>
+  </way>
+  <way id="2">
+    <nd ref="12"/><nd ref="13"/>
+    <tag k="highway" v="primary"/><tag k="oneway" v="yes"/><tag k="maxspeed" v="60"/>
+  </way>
+  <way id="3">
+    <nd ref="10"/><nd ref="13"/>
+    <tag k="highway" v="footway"/>
+  </way>
+</osm>
+""",
+        encoding="utf-8",
+    )
+
+    coordinates, edges = parse_osm_xml(extract)
+
+    assert len(coordinates) == 4
+    assert len(edges) == 5
+    one_way = [edge for edge in edges if {edge[0], edge[1]} == {2, 3}]
+    assert [(edge[0], edge[1]) for edge in one_way] == [(2, 3)]
+    residential = next(edge for edge in edges if (edge[0], edge[1]) == (0, 1))
+    assert residential[2] == pytest.approx(residential[3] / (25 / 3.6))
+    assert one_way[0][2] == pytest.approx(one_way[0][3] / (60 / 3.6))
@@ -0,0 +1,194 @@
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import backend.app as app_module
+import backend.database as database
+from backend import metrics
+from backend.route_jobs import RouteJobManager
+
+
+def _thread_manager(**kwargs):
+    return RouteJobManager(workers=1, executor_factory=lambda workers: ThreadPoolExecutor(workers), **kwargs)
+
+
+def _wait_for(manager, job_id, statuses=("done", "failed"), timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = manager.get(job_id)
+        if job.status in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} ainda em {job.status}")
+
+
+def test_identical_in_flight_jobs_are_deduplicated():
+    manager = _thread_manager()
+    release = threading.Event()
+    try:
+        first, first_dedup = manager.submit("same", None, release.wait)
+        second, second_dedup = manager.submit("same", None, release.wait)
+        other, _ = manager.submit("other", None, lambda: 1)
+
+        assert not first_dedup and second_dedup
+        assert second is first
+        assert other is not first
+        release.set()
+        assert _wait_for(manager, first.id).status == "done"
+
+        # Once finished, the same inputs start a fresh job.
+        third, third_dedup = manager.submit("same", None, lambda: 2)
+        assert not third_dedup and third is not first
+    finally:
+        release.set()
+        manager.shutdown()
+
+
+def test_cancel_discards_queued_job():
+    manager = _thread_manager()
+    release = threading.Event()
+    try:
+        manager.submit("busy", None, release.wait)
+        queued, _ = manager.submit("queued", None, lambda: "never")
+
+        assert manager.cancel(queued.id).status == "cancelled"
+        release.set()
+        assert not queued.future.running()
+        assert manager.get(queued.id).result is None
+        assert manager.cancel("missing") is None
+    finally:
+        release.set()
+        manager.shutdown()
+
+
+def test_timeout_and_failure_are_reported():
+    manager = _thread_manager(timeout=0.05)
+    release = threading.Event()
+    try:
+        slow, _ = manager.submit("slow", None, release.wait)
+        time.sleep(0.1)
+        job = manager.get(slow.id)
+        assert job.status == "timeout"
+        assert "Tempo limite" in job.error
+        release.set()
+        time.sleep(0.05)
+        assert manager.get(slow.id).status == "timeout"
+    finally:
+        release.set()
+        manager.shutdown()
+
+    manager = _thread_manager()
+    try:
+        broken, _ = manager.submit("broken", None, lambda: 1 / 0)
+        job = _wait_for(manager, broken.id)
+        assert job.status == "failed"
+        assert "division" in job.error
+    finally:
+        manager.shutdown()
+
+
+def test_finished_jobs_are_pruned_after_retention():
+    manager = _thread_manager(retention=0)
+    try:
+        job, _ = manager.submit("quick", None, lambda: 1)
+        _wait_for(manager, job.id)
+        manager.submit("next", None, lambda: 2)
+        assert manager.get(job.id) is None
+    finally:
+        manager.shutdown()
+
+
+def _request(address, method, path, payload=None):
+    conn = http.client.HTTPConnection(*address, timeout=30)
+    try:
+        body = json.dumps(payload) if payload is not None else None
+        conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def _call_google(outcome):
+    metrics.observe_google_call(outcome, 0.2)
+    return outcome
+
+
+def test_google_calls_made_in_worker_processes_are_recorded_by_the_server():
+    metrics.REGISTRY.reset()
+    manager = RouteJobManager(workers=1)
+    try:
+        job, _ = manager.submit("google", None, _call_google, "api_error")
+        job = _wait_for(manager, job.id, timeout=30)
+    finally:
+        manager.shutdown()
+
+    assert job.status == "done"
+    assert job.result == "api_error"
+    assert 'bakery_google_api_requests_total{outcome="api_error"} 1' in metrics.render()
+
+
+@pytest.fixture
+def process_jobs(monkeypatch):
+    manager = RouteJobManager(workers=1)
+    monkeypatch.setattr(app_module, "ROUTE_JOBS", manager)
+    yield manager
+    manager.shutdown()
+
+
+def test_route_job_endpoints_solve_in_worker_process(api_server, process_jobs):
+    status, submitted = _request(api_server, "POST", "/api/routes/jobs", {})
+    assert status == 202
+    assert submitted["status"] in ("queued", "running", "done")
+    assert submitted["deduplicated"] is False
+
+    deadline = time.monotonic() + 30
+    while True:
+        status, report = _request(api_server, "GET", f"/api/routes/jobs/{submitted['job_id']}")
+        assert status == 200
+        if report["status"] == "done" or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+
+    assert report["status"] == "done"
+    ordered = report["result"]["ordered"]
+    assert len(ordered) == len(database.IDEAL_SUPERMARKETS)
+    assert all(stop["eta"] for stop in report["result"]["progress"]["stops"])
+
+    status, again = _request(api_server, "GET", f"/api/routes/jobs/{submitted['job_id']}")
+    assert again["result"] == report["result"]
+
+    status, _ = _request(api_server, "GET", "/api/routes/jobs/missing")
+    assert status == 404
+    status, _ = _request(api_server, "DELETE", "/api/routes/jobs/missing")
+    assert status == 404
+
+
+def test_route_jobs_reuse_and_store_precomputed_plans(api_server, monkeypatch):
+    manager = _thread_manager()
+    monkeypatch.setattr(app_module, "ROUTE_JOBS", manager)
+    for client in database.fetch_all("SELECT id FROM clients ORDER BY id"):
+        database.execute("INSERT INTO deliveries (client_id, scheduled_date) VALUES (?, '2024-06-07')", (client["id"],))
+    try:
+        status, submitted = _request(api_server, "POST", "/api/routes/jobs", {"date": "2024-06-07"})
+        assert status == 202
+        _wait_for(manager, submitted["job_id"])
+        assert database.fetch_one("SELECT plan_date FROM route_plans", ())["plan_date"] == "2024-06-07"
+        status, solved = _request(api_server, "GET", f"/api/routes/jobs/{submitted['job_id']}")
+
+        def refuse(*args, **kwargs):
+            raise AssertionError("a rota deveria vir do plano armazenado")
+
+        monkeypatch.setattr(app_module, "solve_route", refuse)
+        status, stored = _request(api_server, "POST", "/api/routes/jobs", {"date": "2024-06-07"})
+        assert status == 202
+        assert stored["status"] == "done"
+        status, report = _request(api_server, "GET", f"/api/routes/jobs/{stored['job_id']}")
+    finally:
+        manager.shutdown()
+
+    assert [stop["id"] for stop in report["result"]["ordered"]] == [stop["id"] for stop in solved["result"]["ordered"]]
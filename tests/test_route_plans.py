@@ -0,0 +1,97 @@
+import http.client
+import json
+from datetime import datetime
+
+import pytest
+
+import backend.app as app_module
+import backend.database as database
+import backend.route_plans as route_plans
+from backend.route_plans import parse_cutoff, precompute_due_plans, precompute_plan
+
+
+def _post(address, payload):
+    conn = http.client.HTTPConnection(*address, timeout=10)
+    try:
+        conn.request("POST", "/api/routes", body=json.dumps(payload), headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def _schedule(day):
+    for client in database.fetch_all("SELECT id FROM clients ORDER BY id"):
+        database.execute("INSERT INTO deliveries (client_id, scheduled_date) VALUES (?, ?)", (client["id"], day))
+
+
+def _refuse(*args, **kwargs):
+    raise AssertionError("a rota deveria vir do plano armazenado")
+
+
+def test_precomputed_plan_is_served_until_inputs_change(api_server, monkeypatch):
+    _schedule("2024-06-04")
+    assert precompute_plan("2024-06-04", None) is True
+    assert precompute_plan("2024-06-04", None) is False
+
+    with monkeypatch.context() as patched:
+        patched.setattr(app_module, "solve_route", _refuse)
+        status, served = _post(api_server, {"date": "2024-06-04"})
+    assert status == 200
+    assert len(served["ordered"]) == len(database.IDEAL_SUPERMARKETS)
+    assert all(stop["eta"] for stop in served["ordered"])
+
+    first = served["ordered"][0]
+    database.execute("UPDATE deliveries SET status = 'completed' WHERE id = ?", (first["delivery_id"],))
+    status, recomputed = _post(api_server, {"date": "2024-06-04"})
+    assert status == 200
+    assert first["id"] not in [stop["id"] for stop in recomputed["ordered"]]
+
+    monkeypatch.setattr(app_module, "solve_route", _refuse)
+    status, again = _post(api_server, {"date": "2024-06-04"})
+    assert [stop["id"] for stop in again["ordered"]] == [stop["id"] for stop in recomputed["ordered"]]
+
+
+def test_stored_plan_keeps_every_delivery_of_a_client(api_server, monkeypatch):
+    _schedule("2024-06-06")
+    client_id = database.fetch_one("SELECT id FROM clients ORDER BY id LIMIT 1", ())["id"]
+    database.execute("INSERT INTO deliveries (client_id, scheduled_date) VALUES (?, '2024-06-06')", (client_id,))
+    expected = {row["id"] for row in database.fetch_all("SELECT id FROM deliveries WHERE scheduled_date = '2024-06-06'")}
+    assert precompute_plan("2024-06-06", None) is True
+
+    monkeypatch.setattr(app_module, "solve_route", _refuse)
+    status, served = _post(api_server, {"date": "2024-06-06"})
+
+    assert status == 200
+    assert sorted(stop["delivery_id"] for stop in served["ordered"]) == sorted(expected)
+
+
+def test_precompute_waits_for_cutoff_and_plans_next_day(api_server):
+    _schedule("2024-06-05")
+
+    assert precompute_due_plans(None, datetime(2024, 6, 4, 12, 0)) is None
+    assert precompute_due_plans(None, datetime(2024, 6, 4, 21, 0)) == "2024-06-05"
+    assert precompute_due_plans(None, datetime(2024, 6, 4, 21, 10)) is None
+    assert database.fetch_one("SELECT plan_date FROM route_plans", ())["plan_date"] == "2024-06-05"
+
+
+def test_precomputed_departure_is_utc(api_server, monkeypatch):
+    _schedule("2024-06-08")
+    departures = []
+    finish = route_plans.finish_route
+
+    def capture(prepared, ordered, directions):
+        departures.append(prepared.departure)
+        finish(prepared, ordered, directions)
+
+    monkeypatch.setattr(route_plans, "finish_route", capture)
+    assert precompute_plan("2024-06-08", None) is True
+
+    assert departures[0].utcoffset() is not None
+    assert departures[0].utcoffset().total_seconds() == 0
+
+
+def test_parse_cutoff_rejects_invalid_values():
+    assert parse_cutoff("19:30").hour == 19
+    with pytest.raises(ValueError):
+        parse_cutoff("tarde")
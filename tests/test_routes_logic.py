@@ -1,11 +1,15 @@
 import unittest
 from datetime import datetime, timedelta
 
+from backend.database import epoch_ms
 from backend.routes_logic import (
     detect_visit_events,
+    DistanceMatrix,
+    first_visit_window,
     haversine_distance,
     nearest_neighbor_route,
     optimize_route_with_google,
+    replan_route,
 )
 
 
@@ -81,7 +85,7 @@ class DetectVisitEventsTests(unittest.TestCase):
         for offset in range(0, 120, 30):
             positions.append(
                 {
-                    "timestamp": (base + timedelta(seconds=offset)).isoformat(sep=" "),
+                    "recorded_ms": epoch_ms(base + timedelta(seconds=offset)),
                     "latitude": self.client["latitude"],
                     "longitude": self.client["longitude"],
                 }
@@ -96,7 +100,7 @@ class DetectVisitEventsTests(unittest.TestCase):
         for offset in range(0, 60, 15):
             positions.append(
                 {
-                    "timestamp": (base + timedelta(seconds=offset)).isoformat(sep=" "),
+                    "recorded_ms": epoch_ms(base + timedelta(seconds=offset)),
                     "latitude": self.client["latitude"],
                     "longitude": self.client["longitude"],
                 }
@@ -104,6 +108,86 @@ class DetectVisitEventsTests(unittest.TestCase):
         detections = detect_visit_events(positions, [self.client], threshold_meters=50, min_duration=90)
         self.assertFalse(detections)
 
+    def test_reports_a_single_visit_when_driver_leaves(self):
+        base = datetime(2024, 1, 1, 8, 0, 0)
+        positions = [
+            {
+                "recorded_ms": epoch_ms(base + timedelta(seconds=offset)),
+                "latitude": self.client["latitude"],
+                "longitude": self.client["longitude"],
+            }
+            for offset in range(0, 150, 30)
+        ]
+        positions.append(
+            {
+                "recorded_ms": epoch_ms(base + timedelta(seconds=200)),
+                "latitude": -23.60,
+                "longitude": -46.70,
+            }
+        )
+        detections = detect_visit_events(positions, [self.client], threshold_meters=50, min_duration=90)
+        self.assertEqual(len(detections), 1)
+        self.assertEqual(detections[0].stay_seconds, 120)
+        self.assertEqual(detections[0].detected_ms, epoch_ms(base + timedelta(seconds=120)))
+
+
+class FirstVisitWindowTests(unittest.TestCase):
+    def test_returns_first_window_long_enough(self):
+        samples = [(0, 10), (60, 20), (90, 500), (100, 5), (400, 5), (410, 900)]
+        self.assertEqual(first_visit_window(samples, 50, 120), (100, 400))
+
+    def test_returns_none_without_long_stay(self):
+        samples = [(0, 10), (60, 20), (90, 500)]
+        self.assertIsNone(first_visit_window(samples, 50, 120))
+
+
+class ReplanRouteTests(unittest.TestCase):
+    def setUp(self):
+        # Five stops along a line heading east from the start.
+        self.start = (-23.55, -46.70)
+        self.clients = [
+            {"id": index, "name": f"Cliente {index}", "latitude": -23.55, "longitude": -46.70 + 0.01 * index}
+            for index in range(1, 6)
+        ]
+        ids = [client["id"] for client in self.clients]
+        rows = [
+            [
+                haversine_distance((a["latitude"], a["longitude"]), (b["latitude"], b["longitude"]))
+                for b in self.clients
+            ]
+            for a in self.clients
+        ]
+        self.matrix = DistanceMatrix(ids, rows)
+
+    def test_drops_completed_stops_and_inserts_new_ones(self):
+        remaining = [client for client in self.clients if client["id"] != 1]
+        ordered, inserted = replan_route(self.start, remaining, [1, 2, 4, 5], self.matrix, budget_seconds=0.5)
+
+        self.assertEqual([client["id"] for client in ordered], [2, 3, 4, 5])
+        self.assertEqual(inserted, [3])
+
+    def test_two_opt_repairs_a_crossing_warm_start(self):
+        ordered, inserted = replan_route(self.start, self.clients, [1, 4, 3, 2, 5], self.matrix, budget_seconds=0.5)
+
+        self.assertEqual([client["id"] for client in ordered], [1, 2, 3, 4, 5])
+        self.assertEqual(inserted, [])
+
+    def test_zero_budget_keeps_warm_start_order(self):
+        ordered, _ = replan_route(self.start, self.clients, [1, 4, 3, 2, 5], self.matrix, budget_seconds=0)
+
+        self.assertEqual([client["id"] for client in ordered], [1, 4, 3, 2, 5])
+
+    def test_two_opt_counts_reversed_edges_of_asymmetric_costs(self):
+        # 1 -> 2 -> 3 costs 3; reversing 1, 2 looks 0.5 cheaper at its ends
+        # but turns 1 -> 2 into the expensive 2 -> 1.
+        clients = self.clients[:3]
+        matrix = DistanceMatrix([1, 2, 3], [[0, 1, 0.5], [10, 0, 1], [5, 5, 0]])
+        start_costs = {1: 1, 2: 1, 3: 5}
+
+        ordered, _ = replan_route(self.start, clients, [1, 2, 3], matrix, budget_seconds=0.5, start_costs=start_costs)
+
+        self.assertEqual([client["id"] for client in ordered], [1, 2, 3])
+
 
 if __name__ == "__main__":
     unittest.main()
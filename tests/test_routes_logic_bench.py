@@ -0,0 +1,26 @@
+from benchmarks.routes_logic_bench import find_regressions, run_benchmarks
+
+
+def test_find_regressions_applies_tolerance():
+    baseline = {"nearest_neighbor_route": {"100": {"seconds": 0.010}, "500": {"seconds": 0.100}}}
+    results = {"nearest_neighbor_route": {"100": {"seconds": 0.012}, "500": {"seconds": 0.200}}}
+
+    regressions = find_regressions(results, baseline, tolerance=0.25)
+
+    assert [(item["case"], item["size"]) for item in regressions] == [("nearest_neighbor_route", 500)]
+
+
+def test_run_benchmarks_covers_every_case():
+    results = run_benchmarks(stop_sizes=(10,), point_sizes=(100,))
+
+    assert set(results) == {
+        "haversine_distance",
+        "nearest_neighbor_route",
+        "nearest_neighbor_route_matrix",
+        "optimize_route_with_google",
+        "detect_visit_events",
+    }
+    for sizes in results.values():
+        for measurement in sizes.values():
+            assert measurement["seconds"] > 0
+            assert measurement["peak_kib"] >= 0
@@ -0,0 +1,20 @@
+import pytest
+
+from backend.settings import env_float, env_int
+
+
+def test_env_numbers_fall_back_to_defaults(monkeypatch):
+    monkeypatch.delenv("VISIT_MIN_DURATION", raising=False)
+    monkeypatch.setenv("VISIT_THRESHOLD_METERS", " ")
+
+    assert env_int("VISIT_MIN_DURATION", 90) == 90
+    assert env_float("VISIT_THRESHOLD_METERS", 80.0) == 80.0
+
+
+def test_env_numbers_name_the_malformed_variable(monkeypatch):
+    monkeypatch.setenv("VISIT_MIN_DURATION", "90s")
+    monkeypatch.setenv("VISIT_THRESHOLD_METERS", "1.5")
+
+    with pytest.raises(ValueError, match="VISIT_MIN_DURATION"):
+        env_int("VISIT_MIN_DURATION", 90)
+    assert env_float("VISIT_THRESHOLD_METERS", 80.0) == 1.5
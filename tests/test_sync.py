@@ -0,0 +1,95 @@
+import http.client
+import json
+
+import pytest
+
+import backend.database as database
+from backend.sync import changes_since, compact_change_log, parse_since
+
+
+def _get(address, path):
+    conn = http.client.HTTPConnection(*address, timeout=10)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def _send(address, method, path, payload=None):
+    conn = http.client.HTTPConnection(*address, timeout=10)
+    try:
+        conn.request(method, path, body=json.dumps(payload or {}), headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def test_sync_returns_only_rows_changed_since_seq(api_server):
+    status, initial = _get(api_server, "/api/sync?since=0")
+    assert status == 200
+    assert initial["reset"] is True
+    assert len(initial["clients"]["upserted"]) == len(database.IDEAL_SUPERMARKETS)
+
+    _, client = _send(api_server, "POST", "/api/clients", {"name": "Padaria Nova", "address": "Rua A, 1"})
+    _, delivery = _send(
+        api_server, "POST", "/api/deliveries", {"client_id": client["id"], "scheduled_date": "2024-06-03"}
+    )
+    _send(api_server, "POST", f"/api/deliveries/{delivery['id']}/complete", {"quantity": 10})
+    removed = initial["clients"]["upserted"][0]["id"]
+    _send(api_server, "DELETE", f"/api/clients/{removed}")
+
+    status, delta = _get(api_server, f"/api/sync?since={initial['seq']}")
+
+    assert status == 200
+    assert delta["reset"] is False and delta["has_more"] is False
+    assert [row["id"] for row in delta["clients"]["upserted"]] == [client["id"]]
+    assert delta["clients"]["deleted"] == [removed]
+    assert [(row["id"], row["status"]) for row in delta["deliveries"]["upserted"]] == [
+        (delivery["id"], "completed")
+    ]
+
+    status, empty = _get(api_server, f"/api/sync?since={delta['seq']}")
+    assert empty["seq"] == delta["seq"]
+    assert empty["clients"] == {"upserted": [], "deleted": []}
+
+
+def test_sync_pages_and_rejects_bad_since(api_server):
+    start = changes_since(0)["seq"]
+    for number in range(5):
+        database.execute("INSERT INTO clients (name) VALUES (?)", (f"Cliente {number}",))
+
+    page = changes_since(start, limit=3)
+    assert page["has_more"] is True
+    assert len(page["clients"]["upserted"]) == 3
+    rest = changes_since(page["seq"], limit=3)
+    assert rest["has_more"] is False
+    assert len(rest["clients"]["upserted"]) == 2
+
+    status, error = _get(api_server, "/api/sync?since=abc")
+    assert status == 400
+    assert "since" in error["error"]
+    with pytest.raises(ValueError):
+        parse_since("-1")
+
+
+def test_compaction_keeps_latest_entry_and_resets_stale_clients(api_server):
+    start = changes_since(0)["seq"]
+    client_id = database.execute("INSERT INTO clients (name) VALUES ('Cliente')")
+    for number in range(3):
+        database.execute("UPDATE clients SET notes = ? WHERE id = ?", (str(number), client_id))
+
+    result = compact_change_log()
+
+    assert result["superseded"] == 3
+    delta = changes_since(start)
+    assert [row["notes"] for row in delta["clients"]["upserted"]] == ["2"]
+
+    database.execute("UPDATE change_log SET changed_at = datetime('now', '-90 days')")
+    assert compact_change_log(retention_days=30)["expired"] > 0
+    latest = delta["seq"]
+    assert changes_since(start)["reset"] is True
+    # Up-to-date clients keep receiving deltas after the log is emptied.
+    assert changes_since(latest)["reset"] is False
@@ -0,0 +1,140 @@
+import random
+from datetime import datetime
+
+import pytest
+
+import backend.database as database
+from backend.archive import archive_completed
+from backend.routes_logic import DistanceMatrix, haversine_distance, replan_route
+from backend.travel_model import (
+    DEFAULT_SPEED_KMH,
+    DETOUR_FACTOR,
+    TravelTimeModel,
+    extract_legs,
+    load_model,
+    update_model,
+)
+
+
+@pytest.fixture
+def history_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "travel.db")
+    monkeypatch.delenv("ARCHIVE_DB_PATH", raising=False)
+    database.initialize()
+    conn = database.get_connection()
+    try:
+        # Two days driving client 1 -> client 2, leaving at 08:00 and taking 10 and 14 minutes.
+        conn.executemany(
+            "INSERT INTO deliveries (client_id, scheduled_date, status, arrived_at, departed_at, "
+            "completed_at, stay_seconds) VALUES (?, ?, 'completed', ?, ?, ?, 240)",
+            [
+                (1, "2024-04-01", "2024-04-01 07:50:00", "2024-04-01 08:00:00", "2024-04-01 08:00:00"),
+                (2, "2024-04-01", "2024-04-01 08:10:00", None, "2024-04-01 08:15:00"),
+                (1, "2024-04-02", "2024-04-02 07:55:00", "2024-04-02 08:00:00", "2024-04-02 08:00:00"),
+                (2, "2024-04-02", "2024-04-02 08:14:00", None, "2024-04-02 08:20:00"),
+            ],
+        )
+        # Driving 1 km per minute for a few fixes at 09:00.
+        conn.executemany(
+            "INSERT INTO driver_positions (recorded_ms, latitude, longitude) VALUES (?, ?, ?)",
+            [
+                (database.epoch_ms(datetime(2024, 4, 2, 9, 0)), -23.5500, -46.6300),
+                (database.epoch_ms(datetime(2024, 4, 2, 9, 1)), -23.5590, -46.6300),
+                (database.epoch_ms(datetime(2024, 4, 2, 9, 2)), -23.5680, -46.6300),
+            ],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_extract_legs_joins_departure_to_next_arrival():
+    legs = extract_legs(
+        [
+            {"client_id": 1, "arrived_at": "2024-04-01 07:50:00", "departed_at": "2024-04-01 08:00:00"},
+            {"client_id": 2, "arrived_at": "2024-04-01 08:10:00", "completed_at": "2024-04-01 08:15:00"},
+        ]
+    )
+    assert legs == [(1, 2, 8, 600.0)]
+
+
+def test_update_model_is_incremental(history_db):
+    first = update_model(today="2024-04-03")
+    second = update_model(today="2024-04-03")
+
+    assert first == {"legs": 2, "moves": 2}
+    assert second == {"legs": 0, "moves": 0}
+    model = load_model()
+    assert model.legs[(1, 2, 8)] == (2, 1440.0)
+    assert model.stop_seconds == 240
+    assert model.speed_kmh(9) == pytest.approx(60, rel=0.01)
+
+
+def test_update_model_skips_the_current_day(history_db):
+    update_model(today="2024-04-02")
+
+    assert load_model().legs[(1, 2, 8)] == (1, 600.0)
+    update_model(today="2024-04-03")
+    assert load_model().legs[(1, 2, 8)] == (2, 1440.0)
+
+
+def test_update_model_learns_from_archived_days(history_db):
+    assert archive_completed(days=30, today=datetime(2024, 6, 1).date())["deliveries"] == 4
+
+    assert update_model(today="2024-04-03")["legs"] == 2
+    assert load_model().legs[(1, 2, 8)] == (2, 1440.0)
+
+
+def test_estimates_prefer_observed_legs_then_speed():
+    model = TravelTimeModel(legs={(1, 2, 8): (2, 1440.0)}, speeds={})
+
+    assert model.estimate_seconds(1, 2, 5.0, 8) == 720.0
+    assert model.estimate_seconds(1, 2, 5.0, 17) == 720.0
+    assert model.estimate_seconds(2, 1, 5.0, 8) == pytest.approx(5.0 * DETOUR_FACTOR / DEFAULT_SPEED_KMH * 3600)
+
+
+def test_weight_matrix_and_etas_use_travel_time():
+    model = TravelTimeModel(legs={(1, 2, 8): (3, 300.0)}, speeds={8: (30.0, 3600.0)}, stop_seconds=60)
+    matrix = DistanceMatrix([1, 2], [[0.0, 4.0], [4.0, 0.0]])
+
+    weighted = model.weight_matrix(matrix, 8)
+    assert weighted.distance(1, 2) == 100.0
+    assert weighted.distance(2, 1) == pytest.approx(4.0 * DETOUR_FACTOR / 30.0 * 3600)
+
+    stops = [
+        {"id": 1, "latitude": -23.55, "longitude": -46.63},
+        {"id": 2, "latitude": -23.56, "longitude": -46.63},
+    ]
+    model.annotate_etas((-23.55, -46.63), stops, datetime(2024, 4, 1, 8, 0, 0), matrix)
+    assert stops[0]["eta_seconds"] == 0
+    assert stops[1]["eta_seconds"] == 160
+    assert stops[1]["eta"] == "2024-04-01T08:02:40"
+
+
+def test_replan_with_trained_model_costs_the_first_hop_in_seconds():
+    # Speeds only: travel time is distance times a constant, so ordering by
+    # seconds must give the same plan as ordering by kilometres.
+    model = TravelTimeModel(legs={}, speeds={8: (30.0, 3600.0)})
+    start = (-23.55, -46.63)
+    rnd = random.Random(0)
+    clients = [
+        {"id": index, "latitude": -23.55 + rnd.uniform(-0.03, 0.03), "longitude": -46.63 + rnd.uniform(-0.03, 0.03)}
+        for index in range(1, 7)
+    ]
+    rows = [
+        [haversine_distance((a["latitude"], a["longitude"]), (b["latitude"], b["longitude"])) for b in clients]
+        for a in clients
+    ]
+    matrix = DistanceMatrix([client["id"] for client in clients], rows)
+
+    by_km, _ = replan_route(start, clients, [3, 1, 5], matrix, budget_seconds=0)
+    by_seconds, _ = replan_route(
+        start,
+        clients,
+        [3, 1, 5],
+        model.weight_matrix(matrix, 8),
+        budget_seconds=0,
+        start_costs=model.start_costs(start, clients, 8),
+    )
+
+    assert [client["id"] for client in by_seconds] == [client["id"] for client in by_km]
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import backend.database as database
+from backend.archive import archive_completed
+from backend.visit_replay import replay_day, sweep
+
+
+def _seed_day(db_path):
+    database.DB_PATH = db_path
+    database.initialize()
+    conn = database.get_connection()
+    try:
+        clients = conn.execute("SELECT id, latitude, longitude FROM clients ORDER BY id LIMIT 2").fetchall()
+        stay_client, pass_client = clients
+        conn.execute(
+            "INSERT INTO deliveries (id, client_id, scheduled_date, status) VALUES (1, ?, '2024-05-02', 'completed')",
+            (stay_client["id"],),
+        )
+        conn.execute(
+            "INSERT INTO deliveries (id, client_id, scheduled_date, status) VALUES (2, ?, '2024-05-02', 'pending')",
+            (pass_client["id"],),
+        )
+        conn.execute(
+            "INSERT INTO delivery_visits (delivery_id, client_id, status) VALUES (1, ?, 'confirmed')",
+            (stay_client["id"],),
+        )
+        base = datetime(2024, 5, 2, 7, 0, 0)
+        fixes = []
+        # Five minutes parked at the first client, then a 60 s pass by the second.
+        for offset in range(0, 300, 15):
+            fixes.append((base + timedelta(seconds=offset), stay_client["latitude"], stay_client["longitude"]))
+        fixes.append((base + timedelta(seconds=600), -23.40, -46.40))
+        for offset in range(0, 75, 15):
+            fixes.append((base + timedelta(seconds=900 + offset), pass_client["latitude"], pass_client["longitude"]))
+        fixes.append((base + timedelta(seconds=1200), -23.40, -46.40))
+        conn.executemany(
+            "INSERT INTO driver_positions (recorded_ms, latitude, longitude) VALUES (?, ?, ?)",
+            [(database.epoch_ms(moment), lat, lon) for moment, lat, lon in fixes],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_replay_day_scores_each_parameter_combination(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", database.DB_PATH)
+    db_path = tmp_path / "replay.db"
+    _seed_day(db_path)
+
+    scores = replay_day(db_path, "2024-05-02", [(80.0, 90), (80.0, 30)])
+
+    strict, loose = scores[(80.0, 90)], scores[(80.0, 30)]
+    assert (strict.true_positives, strict.false_positives, strict.false_negatives) == (1, 0, 0)
+    assert (loose.true_positives, loose.false_positives) == (1, 1)
+    assert strict.precision == 1.0 and loose.precision == 0.5
+
+
+def test_sweep_ranks_combinations_by_f1(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", database.DB_PATH)
+    db_path = tmp_path / "replay.db"
+    _seed_day(db_path)
+
+    report = sweep(db_path, thresholds=[80.0], durations=[30, 90], workers=2)
+
+    assert [item["min_duration"] for item in report] == [90, 30]
+    assert report[0]["f1"] == 1.0
+    assert report[0]["days"] == 1
+
+
+def test_replay_reads_archived_deliveries_and_visits(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", database.DB_PATH)
+    monkeypatch.delenv("ARCHIVE_DB_PATH", raising=False)
+    db_path = tmp_path / "replay.db"
+    _seed_day(db_path)
+    before = replay_day(db_path, "2024-05-02", [(80.0, 90)])
+
+    assert archive_completed(days=30, today=datetime(2024, 7, 1).date())["deliveries"] == 1
+    after = replay_day(db_path, "2024-05-02", [(80.0, 90)])
+
+    assert after[(80.0, 90)] == before[(80.0, 90)]
+    assert after[(80.0, 90)].true_positives == 1